@@ -5,6 +5,7 @@ Example:
 
 """
 
+import concurrent.futures
 import io
 import os
 import shutil
@@ -102,6 +103,50 @@ class GrpInfo(object):
         return info
 
 
+# Size of the chunks used to copy members when the copy can not be done by
+# the kernel
+_COPY_BUFFER_SIZE = 1 << 20
+
+
+def _copy_range(source, target, offset, size):
+    """Copies size bytes at offset of the source file descriptor to the
+    current position of the target file descriptor."""
+
+    position = offset
+    end = offset + size
+
+    # Let the kernel copy the bytes directly between the files when it can
+    for copy in ('copy_file_range', 'sendfile'):
+        if position >= end or not hasattr(os, copy):
+            continue
+
+        try:
+            while position < end:
+                if copy == 'copy_file_range':
+                    count = os.copy_file_range(source, target, end - position, position)
+
+                else:
+                    count = os.sendfile(target, source, position, end - position)
+
+                if not count:
+                    break
+
+                position += count
+
+        except OSError:
+            # Not supported between these files, fall back to the next method
+            continue
+
+    while position < end:
+        data = os.pread(source, min(_COPY_BUFFER_SIZE, end - position), position)
+
+        if not data:
+            raise EOFError
+
+        os.write(target, data)
+        position += len(data)
+
+
 class _SharedFile:
     def __init__(self, file, position, size, close, lock):
         self._file = file
@@ -148,7 +193,7 @@ class GrpExtFile(io.BufferedIOBase):
         self._close_file_object = close_file_object
         self._bytes_left = grp_info.file_size
 
-        self._eof = False
+        self._eof = self._bytes_left <= 0
         self._readbuffer = b''
         self._offset = 0
         self._size = grp_info.file_size
@@ -500,7 +545,7 @@ class GrpFile(object):
 
         return self._extract_member(member, path)
 
-    def extractall(self, path=None, members=None):
+    def extractall(self, path=None, members=None, workers=None):
         """Extract all members from the grp file to the current working
         directory.
 
@@ -510,13 +555,78 @@ class GrpFile(object):
         members: The names of the members to extract. This must be a subset of
             the list returned by namelist(). All members will be extracted if
             None.
+
+        workers: The number of threads to extract with. Defaults to the
+            number of CPUs. Members are extracted one at a time if 1, or if
+            the archive is not a file opened for reading.
+        """
+
+        for member, error in self.iter_extract(path, members, workers):
+            if error is not None:
+                raise error
+
+    def iter_extract(self, path=None, members=None, workers=None):
+        """Extract members like extractall() and yield (info, error) for
+        each member as soon as it has been extracted, in the order they
+        finish. error is the exception raised while extracting the member,
+        or None. Extraction carries on past members that fail.
         """
 
         if members is None:
             members = self.namelist()
 
-        for GrpInfo in members:
-            self.extract(GrpInfo, path)
+        if path is None:
+            path = os.getcwd()
+
+        members = [m if isinstance(m, GrpInfo) else self.getinfo(m) for m in members]
+        fileno = self._extract_fileno()
+
+        if fileno is None or workers == 1:
+            for grpinfo in members:
+                try:
+                    self.extract(grpinfo, path)
+
+                except Exception as e:
+                    yield grpinfo, e
+                    continue
+
+                yield grpinfo, None
+
+            return
+
+        targets = [self._target_path(m, path) for m in members]
+
+        # Create every directory once up front rather than once per member
+        for directory in sorted({os.path.dirname(t) for t in targets}):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        def copy(member, target_path):
+            if member.filename[-1] == '/':
+                os.makedirs(target_path, exist_ok=True)
+                return
+
+            with open(target_path, 'wb') as target:
+                _copy_range(fileno, target.fileno(), member.file_offset, member.file_size)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(copy, m, t): m for m, t in zip(members, targets)}
+
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.exception()
+
+    def _extract_fileno(self):
+        """Returns the file descriptor to extract members from with positional
+        reads, or None if members have to be read through open()."""
+
+        if self.mode != 'r' or not self.fp or not hasattr(os, 'pread'):
+            return None
+
+        try:
+            return self.fp.fileno()
+
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
 
     @classmethod
     def _sanitize_windows_name(cls, archive_name, path_separator):
@@ -539,9 +649,9 @@ class GrpFile(object):
 
         return archive_name
 
-    def _extract_member(self, member, target_path):
-        """Extract the GrpInfo object 'member' to a physical file on the path
-        target_path.
+    def _target_path(self, member, target_path):
+        """Returns the path the GrpInfo object 'member' is extracted to
+        within target_path.
         """
 
         # Build the destination pathname, replacing forward slashes to
@@ -562,7 +672,15 @@ class GrpFile(object):
             archive_name = self._sanitize_windows_name(archive_name, os.path.sep)
 
         target_path = os.path.join(target_path, archive_name)
-        target_path = os.path.normpath(target_path)
+
+        return os.path.normpath(target_path)
+
+    def _extract_member(self, member, target_path):
+        """Extract the GrpInfo object 'member' to a physical file on the path
+        target_path.
+        """
+
+        target_path = self._target_path(member, target_path)
 
         # Create all upper directories if necessary.
         upperdirs = os.path.dirname(target_path)
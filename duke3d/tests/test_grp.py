@@ -1,10 +1,17 @@
 import io
+import os
+import tempfile
 import unittest
 
 from tests.basecase import TestCase
 from duke3d import grp
 
 
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
 class TestGrpReadWrite(TestCase):
     def test_check_file_type(self):
         self.assertFalse(grp.is_grpfile('./test_data/test.art'))
@@ -125,6 +132,29 @@ class TestGrpReadWrite(TestCase):
             data = grp_file.read('zero.txt')
             self.assertEqual(len(data), 0, 'Length of bytes read should be zero.')
 
+    def test_extractall(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.grp')
+
+            with grp.GrpFile(path, 'w') as grp_file:
+                grp_file.writestr('duke3d.cfg', b'[Setup]')
+                grp_file.writestr('empty.txt', b'')
+                grp_file.writestr('tiles000.art', read_file('./test_data/test.art'))
+
+            with grp.GrpFile(path) as grp_file:
+                expected = {name: grp_file.read(name) for name in grp_file.namelist()}
+
+                for workers in (1, 4):
+                    target = os.path.join(directory, str(workers))
+                    grp_file.extractall(target, workers=workers)
+
+                    for name, data in expected.items():
+                        with open(os.path.join(target, name), 'rb') as file:
+                            self.assertEqual(file.read(), data, 'Extracted %s should match' % name)
+
+                grp_file.extractall(os.path.join(directory, 'subset'), ['duke3d.cfg'])
+                self.assertEqual(os.listdir(os.path.join(directory, 'subset')), ['duke3d.cfg'], 'Only the given members should be extracted')
+
 
 if __name__ == '__main__':
     unittest.main()
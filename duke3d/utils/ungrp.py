@@ -71,14 +71,14 @@ if __name__ == '__main__':
         if not args.quiet:
             print('Archive: %s' % os.path.basename(args.file))
 
-        for item in grp_file.infolist():
-            filename = item.filename
-            fullpath = os.path.join(args.dest, filename)
+        info_list = grp_file.infolist()
 
-            # Extract as raw file
-            grp_file.extract(filename, args.dest)
+        # Extract as raw files
+        for item, error in grp_file.iter_extract(args.dest, info_list, workers=args.jobs):
+            if error is not None:
+                print('{0}: error: {1}'.format(parser.prog, error), file=sys.stderr)
 
-            if not args.quiet:
-                print(' extracting: %s' % fullpath)
+            elif not args.quiet:
+                print(' extracting: %s' % os.path.join(args.dest, item.filename))
 
     sys.exit(0)
@@ -0,0 +1,121 @@
+"""Benchmark for parallel Quake DEM decoding
+
+Builds a large demo on disk by repeating the gameplay blocks of the given
+demo and reports how decoding it scales with the number of worker
+processes, both with Dem.open(processes=...) and with map_message_blocks().
+
+Dem.open() has to rebuild every decoded message in the calling process, so
+its speedup is bounded by how long that takes compared to decoding. The
+benchmark measures that share directly, which gives the bound even on a
+machine with fewer cores than requested.
+
+Example:
+    python -m benchmarks.bench_dem_parallel
+    python -m benchmarks.bench_dem_parallel --processes 16 --copies 500
+
+Notes:
+    With the default demo the calling process spends about 46% of a serial
+    decode rebuilding compact tuples and about 41% with only Time messages,
+    which bounds Dem.open() near 2x however many processes are used.
+    Rebuilding full message objects takes longer than decoding them, so
+    Dem.open() only accepts processes together with compact or types.
+    map_message_blocks() returns one small result per chunk and spends
+    about 3% of a serial decode in the calling process, so it keeps
+    scaling up to about 30 processes.
+"""
+
+import argparse
+import os
+import pickle
+import tempfile
+import timeit
+
+from quake import dem
+from benchmarks.bench_dem import build_demo
+
+
+def count_messages(message_blocks):
+    return sum(len(b.messages) for b in message_blocks)
+
+
+def split(path, processes):
+    with open(path, 'rb') as file:
+        return dem._demo_chunks(file, processes * 4)
+
+
+def parent_seconds(path, processes, compact, types=None, function=None):
+    """Returns the seconds spent splitting the demo into chunks and
+    unpickling the results of every chunk, the parts of a parallel decode
+    that happen in the calling process."""
+
+    sources, ranges = split(path, processes)
+    results = [pickle.dumps(dem._read_message_blocks(s, start, end, types=types, compact=compact, function=function))
+               for s, (start, end) in zip(sources, ranges)]
+
+    seconds = min(timeit.repeat(lambda: split(path, processes), number=1, repeat=3))
+    seconds += min(timeit.repeat(lambda: [pickle.loads(r) for r in results], number=1, repeat=3))
+
+    return seconds
+
+
+def main():
+    default_demo = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test_data', 'test.dem')
+
+    parser = argparse.ArgumentParser(prog='bench_dem_parallel', description='Measures how DEM decoding scales with worker processes.')
+    parser.add_argument('file', nargs='?', default=default_demo, help='demo to use as a template')
+    parser.add_argument('--copies', type=int, default=200, help='number of times to repeat the gameplay blocks')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='largest number of worker processes to time')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as file:
+        data = build_demo(file.read(), args.copies)
+
+    counts = [1]
+
+    while counts[-1] * 2 < args.processes:
+        counts.append(counts[-1] * 2)
+
+    if args.processes > 1:
+        counts.append(args.processes)
+
+    handle, path = tempfile.mkstemp(suffix='.dem')
+
+    with os.fdopen(handle, 'wb') as file:
+        file.write(data)
+
+    try:
+        block_count = len(dem.DemIndex.build(path))
+
+        print('Demo size:  %i bytes, %i blocks' % (len(data), block_count))
+        print('CPUs:       %i' % os.cpu_count())
+
+        for name, compact, types, function in (
+                ('Dem.open, compact', True, None, None),
+                ('Dem.open, Time only', False, (dem.Time,), None),
+                ('map_message_blocks, count messages', False, None, count_messages)):
+            serial = None
+
+            if function is None:
+                run = lambda n: dem.Dem.open(path, types=types, processes=n, compact=compact).close()
+
+            else:
+                run = lambda n: dem.map_message_blocks(path, function, processes=n)
+
+            print()
+            print(name)
+
+            for processes in counts:
+                seconds = min(timeit.repeat(lambda: run(processes), number=1, repeat=args.repeat))
+                serial = serial or seconds
+                print('%3i processes: %8.2f ms, %5.2fx' % (processes, seconds * 1000, serial / seconds))
+
+            share = parent_seconds(path, args.processes, compact, types, function) / serial
+            print('Serial share:  %.1f%%, speedup bound %.1fx' % (share * 100, 1 / share))
+
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark for concurrent Quake PAK member reads
+
+Builds a PAK file of random members in a temporary directory and reports
+how read throughput scales with the number of threads reading from one open
+PakFile, with positional reads and with the locked shared file handle.
+
+Example:
+    python -m benchmarks.bench_pak
+    python -m benchmarks.bench_pak --members 2000 --size 64 --threads 1 2 4 8 16
+"""
+
+import argparse
+import concurrent.futures
+import os
+import tempfile
+import timeit
+
+from quake import pak
+
+
+def build_pak(path, members, size):
+    """Writes a PAK file of members of random data of the given size."""
+
+    with pak.PakFile(path, 'w') as pak_file:
+        for i in range(members):
+            pak_file.writestr('data/%05i.bin' % i, os.urandom(size))
+
+
+def read_all(pak_file, names, threads):
+    """Reads every member through PakFile.open() using a pool of threads."""
+
+    def read(name):
+        with pak_file.open(name) as member:
+            return len(member.read())
+
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        return sum(executor.map(read, names))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_pak', description='Measures concurrent PAK read throughput.')
+    parser.add_argument('--members', type=int, default=1000, help='number of members in the archive')
+    parser.add_argument('--size', type=int, default=128, help='size of each member in KiB')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8], help='thread counts to time')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.pak')
+        build_pak(path, args.members, args.size * 1024)
+        total = args.members * args.size * 1024
+
+        print('Archive:    %i members, %i bytes' % (args.members, total))
+        print('CPUs:       %i' % os.cpu_count())
+
+        with pak.PakFile(path) as pak_file:
+            names = pak_file.namelist()
+            fileno = pak_file._fileno
+
+            for name, positional in (('Positional reads', True), ('Locked reads', False)):
+                # Clearing the descriptor forces the shared, locked file handle
+                pak_file._fileno = fileno if positional else None
+
+                print()
+                print(name)
+
+                for threads in args.threads:
+                    seconds = min(timeit.repeat(lambda: read_all(pak_file, names, threads), number=1, repeat=args.repeat))
+                    print('%2i threads: %.2f ms, %.2f MB/s' % (threads, seconds * 1000, total / seconds / 1e6))
+
+            pak_file._fileno = fileno
+
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,20 @@ class ImportDEM(bpy.types.Operator, ImportHelper):
         default=1.0 / 32.0,
     )
 
+    tolerance = FloatProperty(
+        name='Position Tolerance',
+        description='Largest camera position error in Quake units when reducing keyframes',
+        min=0.001, max=64.0,
+        default=1.0,
+    )
+
+    angle_tolerance = FloatProperty(
+        name='Angle Tolerance',
+        description='Largest camera angle error in degrees when reducing keyframes',
+        min=0.001, max=45.0,
+        default=0.5,
+    )
+
     def execute(self, context):
         keywords = self.as_keywords(ignore=('filter_glob',))
         from . import import_dem
@@ -4,36 +4,36 @@ import bpy
 from mathutils import Euler, Vector
 
 from .quake.dem import Dem
+from .quake.demcamera import CameraPath
 
 
-def load(operator, context, filepath='', global_scale=1.0):
-    dem = Dem.open(filepath)
+def load(operator, context, filepath='', global_scale=1.0, tolerance=1.0, angle_tolerance=0.5):
+    dem = Dem.open(filepath, types=CameraPath.types)
     dem.close()
 
-    coords = []
-    times = []
-    angles = []
+    # Sample the camera at the scene frame rate and keep only the keyframes
+    # needed to stay within the tolerances.
+    fps = context.scene.render.fps
+    path = CameraPath.build(dem.message_blocks)
 
-    for message_block in dem.message_blocks[3:-2]:
-        for message in message_block.messages:
-            time = 0
-            if hasattr(message, 'time'):
-                time = message.time
+    if not len(path):
+        operator.report({'WARNING'}, 'No camera path found in demo')
+        return {'CANCELLED'}
 
-            if hasattr(message, 'entity') and hasattr(message, 'origin') and message.entity == 1:
-                x, y, z = message.origin
-                x = (x or 0) * global_scale
-                y = (y or 0) * global_scale
-                z = (z or 0) * global_scale
-                coords.append((x, y, z))
-                times.append(time)
+    path = path.resample(fps).simplify(tolerance, angle_tolerance)
+    start_time = path.time[0]
 
-                ax, ay, az = message_block.view_angles
-                va = math.radians(az), math.radians(ax), math.radians(ay)
+    coords = []
+    frames = []
+    angles = []
 
-                angles.append(va)
+    for i in range(len(path)):
+        x, y, z = path.origin[3 * i:3 * i + 3]
+        coords.append((x * global_scale, y * global_scale, z * global_scale))
+        frames.append(round((path.time[i] - start_time) * fps))
 
-                break
+        ax, ay, az = path.angles[3 * i:3 * i + 3]
+        angles.append((math.radians(az), math.radians(ax), math.radians(ay)))
 
     curve = bpy.data.curves.new('myCurve', type='CURVE')
     curve.dimensions = '3D'
@@ -41,7 +41,7 @@ def load(operator, context, filepath='', global_scale=1.0):
 
     polyline = curve.splines.new('BEZIER')
 
-    polyline.bezier_points.add(len(coords))
+    polyline.bezier_points.add(len(coords) - 1)
     for i, coord in enumerate(coords):
         x, y, z = coord
         polyline.bezier_points[i].co = (x, y, z)
@@ -59,8 +59,12 @@ def load(operator, context, filepath='', global_scale=1.0):
     for i in range(len(coords)):
         ob.location = Vector(coords[i])
         ob.rotation_euler = Euler(angles[i], 'XYZ')
-        ob.keyframe_insert(data_path="location", frame=i)
-        ob.keyframe_insert(data_path="rotation_euler", frame=i)
+        ob.keyframe_insert(data_path="location", frame=frames[i])
+        ob.keyframe_insert(data_path="rotation_euler", frame=frames[i])
 
+    # Keyframes were chosen for linear interpolation
+    for fcurve in ob.animation_data.action.fcurves:
+        for keyframe_point in fcurve.keyframe_points:
+            keyframe_point.interpolation = 'LINEAR'
 
     return {'FINISHED'}
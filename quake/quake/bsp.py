@@ -16,6 +16,8 @@ References:
 import io
 import struct
 
+from .pak import _ViewFile
+
 __all__ = ['BadBspFile', 'is_bspfile', 'Plane', 'Miptexture',
            'Vertex', 'Node', 'TextureInfo', 'Face', 'ClipNode',
            'Leaf', 'Edge', 'Model', 'Bsp']
@@ -1066,7 +1068,8 @@ class Bsp(object):
         """Returns a Bsp object
 
         Args:
-            file: Either the path to the file, a file-like object, or bytes.
+            file: Either the path to the file, a file-like object, bytes, or
+                a memoryview.
 
             mode: An optional string that indicates which mode to open the file
 
@@ -1091,6 +1094,9 @@ class Bsp(object):
         elif isinstance(file, bytes):
             file = io.BytesIO(file)
 
+        elif isinstance(file, memoryview):
+            file = _ViewFile(file)
+
         elif not hasattr(file, 'read'):
             raise RuntimeError(
                 "Bsp.open() requires 'file' to be a path, a file-like object, "
@@ -13,8 +13,16 @@ References:
     - https://www.quakewiki.net/archives/demospecs/dem/dem.html
 """
 
+import array
+import bisect
+import concurrent.futures
 import io
+import mmap
+import operator
+import os
 import struct
+import sys
+import time
 
 
 __all__ = ['Bad', 'Nop', 'Disconnect', 'UpdateStat', 'Version', 'SetView',
@@ -24,111 +32,187 @@ __all__ = ['Bad', 'Nop', 'Disconnect', 'UpdateStat', 'Version', 'SetView',
            'SpawnBinary', 'SpawnBaseline', 'TempEntity', 'SetPause',
            'SignOnNum', 'CenterPrint', 'KilledMonster', 'FoundSecret',
            'SpawnStaticSound', 'Intermission', 'Finale', 'CdTrack',
-           'SellScreen', 'CutScene', 'UpdateEntity', 'MessageBlock', 'Dem']
+           'SellScreen', 'CutScene', 'UpdateEntity', 'MessageBlock', 'DemIndex',
+           'Dem', 'map_message_blocks', 'cut', 'splice']
 
 
 class BadDemFile(Exception):
     pass
 
 
-def _read(fmt, file):
-    return struct.unpack(fmt, file.read(struct.calcsize(fmt)))[0]
+_char_struct = struct.Struct('<b')
+_short_struct = struct.Struct('<h')
+_long_struct = struct.Struct('<l')
+_float_struct = struct.Struct('<f')
+_coords_struct = struct.Struct('<3h')
+_angles_struct = struct.Struct('<3b')
+_block_header_struct = struct.Struct('<l3f')
 
+# The most data read to decode a single message. Messages never span message
+# blocks, which engines limit to MAX_MSGLEN bytes (64000 in FitzQuake).
+_max_message_size = 65536
+_empty_block_header = bytes(_block_header_struct.size)
 
-def _read_char(file):
-    return int(_read('<b', file))
+# Bytes collected before Dem.write() flushes its buffer to the file
+_write_buffer_size = 1 << 16
 
 
-def _read_byte(file):
-    return int(_read('<B', file))
+class _MessageBuffer(object):
+    """A read cursor over in-memory demo data.
 
+    Attributes:
+        data: A bytes-like object that supports find(). This is typically the
+            entire contents of a demo file.
+
+        position: The offset of the next unread byte in data.
+
+        base: The file offset of the first byte of data. Only used to report
+            errors.
+    """
+
+    __slots__ = (
+        'data',
+        'position',
+        'base',
+        '_file'
+    )
+
+    def __init__(self, data, position=0, base=0):
+        self.data = data
+        self.position = position
+        self.base = base
+        self._file = None
+
+    @staticmethod
+    def from_file(file, size):
+        """Returns a buffer over at most size bytes from the current position
+        of the given file-like object. Call release() once done to hand unread
+        data back to the file, which must be seekable.
+        """
+
+        if isinstance(file, _MessageBuffer):
+            return file
+
+        base = file.tell()
+        buffer = _MessageBuffer(file.read(size), base=base)
+        buffer._file = file
+
+        return buffer
+
+    def release(self):
+        """Seeks the wrapped file back to the first unread byte."""
+
+        if self._file is not None:
+            unread = len(self.data) - self.position
 
-def _read_short(file):
-    return int(_read('<h', file))
+            if unread:
+                self._file.seek(-unread, io.SEEK_CUR)
 
+            self._file = None
 
-def _read_long(file):
-    return int(_read('<l', file))
 
+def _read_char(buffer):
+    position = buffer.position
+    buffer.position = position + 1
+    return _char_struct.unpack_from(buffer.data, position)[0]
 
-def _read_float(file):
-    return float(_read('<f', file))
 
+def _read_byte(buffer):
+    position = buffer.position
+    buffer.position = position + 1
+    return buffer.data[position]
 
-def _read_coord(file):
-    return _read_short(file) * 0.125
 
+def _read_short(buffer):
+    position = buffer.position
+    buffer.position = position + 2
+    return _short_struct.unpack_from(buffer.data, position)[0]
 
-def _read_coords(file):
-    return _read_coord(file), _read_coord(file), _read_coord(file)
 
+def _read_long(buffer):
+    position = buffer.position
+    buffer.position = position + 4
+    return _long_struct.unpack_from(buffer.data, position)[0]
 
-def _read_angle(file):
-    return _read_char(file) / 256 * 360
 
+def _read_float(buffer):
+    position = buffer.position
+    buffer.position = position + 4
+    return _float_struct.unpack_from(buffer.data, position)[0]
 
-def _read_angles(file):
-    return _read_angle(file), _read_angle(file), _read_angle(file)
 
+def _read_coord(buffer):
+    return _read_short(buffer) * 0.125
 
-def _read_string(file, terminal_byte=b'\x00'):
-    string = b''
-    char = _read('<s', file)
 
-    while char != terminal_byte:
-        string += char
-        char = _read('<s', file)
+def _read_coords(buffer):
+    position = buffer.position
+    buffer.position = position + 6
+    x, y, z = _coords_struct.unpack_from(buffer.data, position)
+    return x * 0.125, y * 0.125, z * 0.125
 
-    return string.decode('ascii')
 
+def _read_angle(buffer):
+    return _read_char(buffer) / 256 * 360
 
-def _write(fmt, file, value):
-    data = struct.pack(fmt, value)
-    file.write(data)
 
+def _read_angles(buffer):
+    position = buffer.position
+    buffer.position = position + 3
+    x, y, z = _angles_struct.unpack_from(buffer.data, position)
+    return x / 256 * 360, y / 256 * 360, z / 256 * 360
 
-def _write_char(file, value):
-    _write('<b', file, int(value))
 
+def _read_string(buffer, terminal_byte=b'\x00'):
+    position = buffer.position
+    end = buffer.data.find(terminal_byte, position)
 
-def _write_byte(file, value):
-    _write('<B', file, int(value))
+    if end < 0:
+        raise BadDemFile('Unterminated string at offset %i' % (buffer.base + position))
 
+    buffer.position = end + 1
+    return buffer.data[position:end].decode('ascii')
 
-def _write_short(file, value):
-    _write('<h', file, int(value))
 
+def _write_char(buffer, value):
+    buffer += _char_struct.pack(int(value))
 
-def _write_long(file, value):
-    _write('<l', file, int(value))
 
+def _write_byte(buffer, value):
+    buffer.append(int(value))
 
-def _write_float(file, value):
-    _write('<f', file, float(value))
 
+def _write_short(buffer, value):
+    buffer += _short_struct.pack(int(value))
 
-def _write_coord(file, value):
-    _write_short(file, value / 0.125)
 
+def _write_long(buffer, value):
+    buffer += _long_struct.pack(int(value))
 
-def _write_coords(file, values):
-    _write_coord(file, values[0]), _write_coord(file, values[1]), _write_coord(file, values[2])
 
+def _write_float(buffer, value):
+    buffer += _float_struct.pack(float(value))
 
-def _write_angle(file, value):
-    _write_char(file, int(value * 256 / 360))
 
+def _write_coord(buffer, value):
+    _write_short(buffer, value / 0.125)
 
-def _write_angles(file, values):
-    _write_angle(file, values[0]), _write_angle(file, values[1]), _write_angle(file, values[2])
 
+def _write_coords(buffer, values):
+    buffer += _coords_struct.pack(int(values[0] / 0.125), int(values[1] / 0.125), int(values[2] / 0.125))
 
-def _write_string(file, value, terminal_byte=b'\x00'):
-    size = len(value)
-    format = '<%is' % (size + 1)
-    v = value.encode('ascii') + terminal_byte
-    data = struct.pack(format, v)
-    file.write(data)
+
+def _write_angle(buffer, value):
+    _write_char(buffer, int(value * 256 / 360))
+
+
+def _write_angles(buffer, values):
+    buffer += _angles_struct.pack(int(values[0] * 256 / 360), int(values[1] * 256 / 360), int(values[2] * 256 / 360))
+
+
+def _write_string(buffer, value, terminal_byte=b'\x00'):
+    buffer += value.encode('ascii')
+    buffer += terminal_byte
 
 
 SVC_BAD = 0
@@ -167,8 +251,42 @@ SVC_CDTRACK = 32
 SVC_SELLSCREEN = 33
 SVC_CUTSCENE = 34
 
+# Number of client sign on stages. A client is fully connected once its sign
+# on state reaches this value.
+SIGNONS = 4
+
+
+class _Message(object):
+    """Base class for messages
+
+    Subclasses implement _read() to decode a message from a _MessageBuffer and
+    _write() to encode it to the end of a bytearray.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def write(cls, file, message=None):
+        """Writes a message to a file-like object with a single write."""
+
+        buffer = bytearray()
+        cls._write(buffer, message)
+        file.write(buffer)
+
+    @classmethod
+    def read(cls, file):
+        """Reads a message from a file-like object or a _MessageBuffer."""
+
+        buffer = _MessageBuffer.from_file(file, _max_message_size)
+
+        try:
+            return cls._read(buffer)
 
-class Bad(object):
+        finally:
+            buffer.release()
+
+
+class Bad(_Message):
     """Class for representing a Bad message
 
     This is an error message and should not appear.
@@ -177,31 +295,31 @@ class Bad(object):
     __slots__ = ()
 
     @staticmethod
-    def write(file, bad=None):
-        _write_byte(file, SVC_BAD)
+    def _write(buffer, bad=None):
+        _write_byte(buffer, SVC_BAD)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_BAD
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_BAD
         return Bad()
 
 
-class Nop(object):
+class Nop(_Message):
     """Class for representing a Nop message"""
 
     __slots__ = ()
 
     @staticmethod
-    def write(file, nop=None):
-        _write_byte(file, SVC_NOP)
+    def _write(buffer, nop=None):
+        _write_byte(buffer, SVC_NOP)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_NOP
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_NOP
         return Nop()
 
 
-class Disconnect(object):
+class Disconnect(_Message):
     """Class for representing a Disconnect message
 
     Disconnect from the server and end the game. Typically this the last
@@ -211,16 +329,16 @@ class Disconnect(object):
     __slots__ = ()
 
     @staticmethod
-    def write(file, disconnect=None):
-        _write_byte(file, SVC_DISCONNECT)
+    def _write(buffer, disconnect=None):
+        _write_byte(buffer, SVC_DISCONNECT)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_DISCONNECT
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_DISCONNECT
         return Disconnect()
 
 
-class UpdateStat(object):
+class UpdateStat(_Message):
     """Class for representing UpdateStat messages
 
     Updates a player state value.
@@ -241,22 +359,22 @@ class UpdateStat(object):
         self.value = None
 
     @staticmethod
-    def write(file, update_stat):
-        _write_byte(file, SVC_UPDATESTAT)
-        _write_byte(file, update_stat.index)
-        _write_long(file, update_stat.value)
+    def _write(buffer, update_stat):
+        _write_byte(buffer, SVC_UPDATESTAT)
+        _write_byte(buffer, update_stat.index)
+        _write_long(buffer, update_stat.value)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_UPDATESTAT
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_UPDATESTAT
         update_stat = UpdateStat()
-        update_stat.index = _read_byte(file)
-        update_stat.value = _read_long(file)
+        update_stat.index = _read_byte(buffer)
+        update_stat.value = _read_long(buffer)
 
         return update_stat
 
 
-class Version(object):
+class Version(_Message):
     """Class for representing Version messages
 
     Attributes:
@@ -271,20 +389,20 @@ class Version(object):
         self.protocol_version = None
 
     @staticmethod
-    def write(file, version):
-        _write_byte(file, SVC_VERSION)
-        _write_long(file, version.protocol_version)
+    def _write(buffer, version):
+        _write_byte(buffer, SVC_VERSION)
+        _write_long(buffer, version.protocol_version)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_VERSION
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_VERSION
         version = Version()
-        version.protocol_version = _read_long(file)
+        version.protocol_version = _read_long(buffer)
 
         return version
 
 
-class SetView(object):
+class SetView(_Message):
     """Class for representing SetView messages
 
     Sets the camera position to the given entity.
@@ -301,15 +419,15 @@ class SetView(object):
         self.entity = None
 
     @staticmethod
-    def write(file, set_view):
-        _write_byte(file, SVC_SETVIEW)
-        _write_short(file, set_view.entity)
+    def _write(buffer, set_view):
+        _write_byte(buffer, SVC_SETVIEW)
+        _write_short(buffer, set_view.entity)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SETVIEW
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SETVIEW
         set_view = SetView()
-        set_view.entity = _read_short(file)
+        set_view.entity = _read_short(buffer)
 
         return set_view
 
@@ -319,7 +437,7 @@ SND_ATTENUATION = 0b0010
 SND_LOOPING = 0b0100
 
 
-class Sound(object):
+class Sound(_Message):
     """Class for representing Sound messages
 
     Plays a sound on a channel at a position.
@@ -360,45 +478,45 @@ class Sound(object):
         self.origin = None, None, None
 
     @staticmethod
-    def write(file, sound):
-        _write_byte(file, SVC_SOUND)
-        _write_byte(file, sound.bit_mask)
+    def _write(buffer, sound):
+        _write_byte(buffer, SVC_SOUND)
+        _write_byte(buffer, sound.bit_mask)
 
         if sound.bit_mask & SND_VOLUME:
-            _write_byte(file, sound.volume)
+            _write_byte(buffer, sound.volume)
 
         if sound.bit_mask & SND_ATTENUATION:
-            _write_byte(file, sound.attenuation * 64)
+            _write_byte(buffer, sound.attenuation * 64)
 
         channel = sound.entity << 3
         channel |= sound.channel
 
-        _write_short(file, channel)
-        _write_byte(file, sound.sound_number)
-        _write_coords(file, sound.origin)
+        _write_short(buffer, channel)
+        _write_byte(buffer, sound.sound_number)
+        _write_coords(buffer, sound.origin)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SOUND
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SOUND
         sound = Sound()
-        sound.bit_mask = _read_byte(file)
+        sound.bit_mask = _read_byte(buffer)
 
         if sound.bit_mask & SND_VOLUME:
-            sound.volume = _read_byte(file)
+            sound.volume = _read_byte(buffer)
 
         if sound.bit_mask & SND_ATTENUATION:
-            sound.attenuation = _read_byte(file) / 64
+            sound.attenuation = _read_byte(buffer) / 64
 
-        sound.channel = _read_short(file)
+        sound.channel = _read_short(buffer)
         sound.entity = sound.channel >> 3
         sound.channel &= 7
-        sound.sound_number = _read_byte(file)
-        sound.origin = _read_coords(file)
+        sound.sound_number = _read_byte(buffer)
+        sound.origin = _read_coords(buffer)
 
         return sound
 
 
-class Time(object):
+class Time(_Message):
     """Class for representing Time messages
 
     A time stamp that should appear in each block of messages.
@@ -416,20 +534,22 @@ class Time(object):
         self.time = None
 
     @staticmethod
-    def write(file, time):
-        _write_byte(file, SVC_TIME)
-        _write_float(file, time.time)
+    def _write(buffer, time):
+        _write_byte(buffer, SVC_TIME)
+        _write_float(buffer, time.time)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_TIME
+    def _read(buffer):
+        position = buffer.position
+        assert buffer.data[position] == SVC_TIME
         time = Time()
-        time.time = _read_float(file)
+        time.time = _float_struct.unpack_from(buffer.data, position + 1)[0]
+        buffer.position = position + 5
 
         return time
 
 
-class Print(object):
+class Print(_Message):
     """Class for representing Print messages
 
     Prints text in the top left corner of the screen and console.
@@ -446,20 +566,20 @@ class Print(object):
         self.text = None
 
     @staticmethod
-    def write(file, _print):
-        _write_byte(file, SVC_PRINT)
-        _write_string(file, _print.text)
+    def _write(buffer, _print):
+        _write_byte(buffer, SVC_PRINT)
+        _write_string(buffer, _print.text)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_PRINT
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_PRINT
         _print = Print()
-        _print.text = _read_string(file)
+        _print.text = _read_string(buffer)
 
         return _print
 
 
-class StuffText(object):
+class StuffText(_Message):
     """Class for representing StuffText messages
 
     Text sent to the client console and ran.
@@ -478,20 +598,20 @@ class StuffText(object):
         self.text = None
 
     @staticmethod
-    def write(file, stuff_text):
-        _write_byte(file, SVC_STUFFTEXT)
-        _write_string(file, stuff_text.text, b'\n')
+    def _write(buffer, stuff_text):
+        _write_byte(buffer, SVC_STUFFTEXT)
+        _write_string(buffer, stuff_text.text, b'\n')
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_STUFFTEXT
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_STUFFTEXT
         stuff_text = StuffText()
-        stuff_text.text = _read_string(file, b'\n')
+        stuff_text.text = _read_string(buffer, b'\n')
 
         return stuff_text
 
 
-class SetAngle(object):
+class SetAngle(_Message):
     """Class for representing SetAngle messages
 
     Sets the camera's orientation.
@@ -508,21 +628,21 @@ class SetAngle(object):
         self.angles = None
 
     @staticmethod
-    def write(file, set_angle):
-        _write_byte(file, SVC_SETANGLE)
-        _write_angles(file, set_angle.angles)
+    def _write(buffer, set_angle):
+        _write_byte(buffer, SVC_SETANGLE)
+        _write_angles(buffer, set_angle.angles)
 
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SETANGLE
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SETANGLE
         set_angle = SetAngle()
-        set_angle.angles = _read_angles(file)
+        set_angle.angles = _read_angles(buffer)
 
         return set_angle
 
 
-class ServerInfo(object):
+class ServerInfo(_Message):
     """Class for representing ServerInfo messages
 
     Handles the loading of assets. Usually first message sent after a level
@@ -560,50 +680,50 @@ class ServerInfo(object):
         self.sounds = []
 
     @staticmethod
-    def write(file, server_data):
-        _write_byte(file, SVC_SERVERINFO)
-        _write_long(file, server_data.protocol_version)
-        _write_byte(file, server_data.max_clients)
-        _write_byte(file, server_data.multi)
-        _write_string(file, server_data.map_name)
+    def _write(buffer, server_data):
+        _write_byte(buffer, SVC_SERVERINFO)
+        _write_long(buffer, server_data.protocol_version)
+        _write_byte(buffer, server_data.max_clients)
+        _write_byte(buffer, server_data.multi)
+        _write_string(buffer, server_data.map_name)
 
         for model in server_data.models:
-            _write_string(file, model)
+            _write_string(buffer, model)
 
-        _write_byte(file, 0)
+        _write_byte(buffer, 0)
 
         for sound in server_data.sounds:
-            _write_string(file, sound)
+            _write_string(buffer, sound)
 
-        _write_byte(file, 0)
+        _write_byte(buffer, 0)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SERVERINFO
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SERVERINFO
         server_data = ServerInfo()
-        server_data.protocol_version = _read_long(file)
-        server_data.max_clients = _read_byte(file)
-        server_data.multi = _read_byte(file)
-        server_data.map_name = _read_string(file)
+        server_data.protocol_version = _read_long(buffer)
+        server_data.max_clients = _read_byte(buffer)
+        server_data.multi = _read_byte(buffer)
+        server_data.map_name = _read_string(buffer)
 
-        model = _read_string(file)
+        model = _read_string(buffer)
         while model:
             server_data.models.append(model)
-            model = _read_string(file)
+            model = _read_string(buffer)
 
         server_data.models = tuple(server_data.models)
 
-        sound = _read_string(file)
+        sound = _read_string(buffer)
         while sound:
             server_data.sounds.append(sound)
-            sound = _read_string(file)
+            sound = _read_string(buffer)
 
         server_data.sounds = tuple(server_data.sounds)
 
         return server_data
 
 
-class LightStyle(object):
+class LightStyle(_Message):
     """Class for representing a LightStyle message
 
     Defines the style of a light. Usually happens shortly after level change.
@@ -632,22 +752,22 @@ class LightStyle(object):
         self.string = None
 
     @staticmethod
-    def write(file, light_style):
-        _write_byte(file, SVC_LIGHTSTYLE)
-        _write_byte(file, light_style.style)
-        _write_string(file, light_style.string)
+    def _write(buffer, light_style):
+        _write_byte(buffer, SVC_LIGHTSTYLE)
+        _write_byte(buffer, light_style.style)
+        _write_string(buffer, light_style.string)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_LIGHTSTYLE
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_LIGHTSTYLE
         light_style = LightStyle()
-        light_style.style = _read_byte(file)
-        light_style.string = _read_string(file)
+        light_style.style = _read_byte(buffer)
+        light_style.string = _read_string(buffer)
 
         return light_style
 
 
-class UpdateName(object):
+class UpdateName(_Message):
     """Class for representing UpdateName messages
 
     Sets the player's name.
@@ -668,22 +788,22 @@ class UpdateName(object):
         self.name = None
 
     @staticmethod
-    def write(file, update_name):
-        _write_byte(file, SVC_UPDATENAME)
-        _write_byte(file, update_name.player)
-        _write_string(file, update_name.name)
+    def _write(buffer, update_name):
+        _write_byte(buffer, SVC_UPDATENAME)
+        _write_byte(buffer, update_name.player)
+        _write_string(buffer, update_name.name)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_UPDATENAME
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_UPDATENAME
         update_name = UpdateName()
-        update_name.player = _read_byte(file)
-        update_name.name = _read_string(file)
+        update_name.player = _read_byte(buffer)
+        update_name.name = _read_string(buffer)
 
         return update_name
 
 
-class UpdateFrags(object):
+class UpdateFrags(_Message):
     """Class for representing UpdateFrags messages
 
     Sets the player's frag count.
@@ -703,17 +823,17 @@ class UpdateFrags(object):
         self.frags = None
 
     @staticmethod
-    def write(file, update_frags):
-        _write_byte(file, SVC_UPDATEFRAGS)
-        _write_byte(file, update_frags.player)
-        _write_short(file, update_frags.frags)
+    def _write(buffer, update_frags):
+        _write_byte(buffer, SVC_UPDATEFRAGS)
+        _write_byte(buffer, update_frags.player)
+        _write_short(buffer, update_frags.frags)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_UPDATEFRAGS
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_UPDATEFRAGS
         update_frags = UpdateFrags()
-        update_frags.player = _read_byte(file)
-        update_frags.frags = _read_short(file)
+        update_frags.player = _read_byte(buffer)
+        update_frags.frags = _read_short(buffer)
 
         return update_frags
 
@@ -734,8 +854,48 @@ SU_WEAPONFRAME = 0b0001000000000000
 SU_ARMOR = 0b0010000000000000
 SU_WEAPON = 0b0100000000000000
 
+_SU_PUNCH_VELOCITY = SU_PUNCH1 | SU_PUNCH2 | SU_PUNCH3 | SU_VELOCITY1 | SU_VELOCITY2 | SU_VELOCITY3
+
+_client_data_structs = {}
+
+
+def _client_data_struct(bit_mask):
+    """Returns a Struct for the fields that follow the bit mask of a
+    ClientData message. Structs are cached per bit mask.
+    """
+
+    fmt = '<'
+
+    for bit, code in ((SU_VIEWHEIGHT, 'b'),
+                      (SU_IDEALPITCH, 'b'),
+                      (SU_PUNCH1, 'b'),
+                      (SU_VELOCITY1, 'b'),
+                      (SU_PUNCH2, 'b'),
+                      (SU_VELOCITY2, 'b'),
+                      (SU_PUNCH3, 'b'),
+                      (SU_VELOCITY3, 'b')):
+        if bit_mask & bit:
+            fmt += code
 
-class ClientData(object):
+    # Item bit mask
+    fmt += 'l'
+
+    for bit, code in ((SU_WEAPONFRAME, 'B'),
+                      (SU_ARMOR, 'B'),
+                      (SU_WEAPON, 'B')):
+        if bit_mask & bit:
+            fmt += code
+
+    # Health, active ammo, ammo counts and active weapon
+    fmt += 'h6B'
+
+    fields_struct = struct.Struct(fmt)
+    _client_data_structs[bit_mask] = fields_struct
+
+    return fields_struct
+
+
+class ClientData(_Message):
     """Class for representing ClientData messages
 
     Server information about this client.
@@ -809,125 +969,77 @@ class ClientData(object):
         self.active_weapon = None
 
     @staticmethod
-    def write(file, client_data):
-        _write_byte(file, SVC_CLIENTDATA)
-
+    def _write(buffer, client_data):
         if client_data.on_ground:
             client_data.bit_mask |= SU_ONGROUND
 
         if client_data.in_water:
             client_data.bit_mask |= SU_INWATER
 
-        _write_short(file, client_data.bit_mask)
-
-        if client_data.bit_mask & SU_VIEWHEIGHT:
-            _write_char(file, client_data.view_height)
+        bit_mask = client_data.bit_mask
+        buffer.append(SVC_CLIENTDATA)
+        buffer += _short_struct.pack(bit_mask)
 
-        if client_data.bit_mask & SU_IDEALPITCH:
-            _write_char(file, client_data.ideal_pitch)
+        fields_struct = _client_data_structs.get(bit_mask)
 
-        if client_data.bit_mask & SU_PUNCH1:
-            pa = client_data.punch_angle
-            _write_angle(file, pa[0])
+        if fields_struct is None:
+            fields_struct = _client_data_struct(bit_mask)
 
-        if client_data.bit_mask & SU_VELOCITY1:
-            ve = client_data.velocity
-            _write_char(file, ve[0] // 16)
+        values = []
 
-        if client_data.bit_mask & SU_PUNCH2:
-            pa = client_data.punch_angle
-            _write_angle(file, pa[1])
+        if bit_mask & SU_VIEWHEIGHT:
+            values.append(int(client_data.view_height))
 
-        if client_data.bit_mask & SU_VELOCITY2:
-            ve = client_data.velocity
-            _write_char(file, ve[1] // 16)
+        if bit_mask & SU_IDEALPITCH:
+            values.append(int(client_data.ideal_pitch))
 
-        if client_data.bit_mask & SU_PUNCH3:
+        if bit_mask & _SU_PUNCH_VELOCITY:
             pa = client_data.punch_angle
-            _write_angle(file, pa[2])
-
-        if client_data.bit_mask & SU_VELOCITY3:
             ve = client_data.velocity
-            _write_char(file, ve[2] // 16)
-
-        _write_long(file, client_data.item_bit_mask)
-
-        if client_data.bit_mask & SU_WEAPONFRAME:
-            _write_byte(file, client_data.weapon_frame)
-
-        if client_data.bit_mask & SU_ARMOR:
-            _write_byte(file, client_data.armor)
-
-        if client_data.bit_mask & SU_WEAPON:
-            _write_byte(file, client_data.weapon)
-
-        _write_short(file, client_data.health)
-        _write_byte(file, client_data.active_ammo)
-        _write_byte(file, client_data.ammo[0])
-        _write_byte(file, client_data.ammo[1])
-        _write_byte(file, client_data.ammo[2])
-        _write_byte(file, client_data.ammo[3])
-        _write_byte(file, client_data.active_weapon)
-
-
-    @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_CLIENTDATA
-        client_data = ClientData()
-        client_data.bit_mask = _read_short(file)
-        client_data.on_ground = client_data.bit_mask & SU_ONGROUND != 0
-        client_data.in_water = client_data.bit_mask & SU_INWATER != 0
-
-        if client_data.bit_mask & SU_VIEWHEIGHT:
-            client_data.view_height = _read_char(file)
-
-        if client_data.bit_mask & SU_IDEALPITCH:
-            client_data.ideal_pitch = _read_char(file)
-
-        if client_data.bit_mask & SU_PUNCH1:
-            pa = client_data.punch_angle
-            client_data.punch_angle = _read_angle(file), pa[1], pa[2]
 
-        if client_data.bit_mask & SU_VELOCITY1:
-            ve = client_data.velocity
-            client_data.velocity = _read_char(file) * 16, ve[1], ve[2]
+            for i, punch_bit, velocity_bit in ((0, SU_PUNCH1, SU_VELOCITY1),
+                                               (1, SU_PUNCH2, SU_VELOCITY2),
+                                               (2, SU_PUNCH3, SU_VELOCITY3)):
+                if bit_mask & punch_bit:
+                    values.append(int(pa[i] * 256 / 360))
 
-        if client_data.bit_mask & SU_PUNCH2:
-            pa = client_data.punch_angle
-            client_data.punch_angle = pa[0], _read_angle(file), pa[2]
+                if bit_mask & velocity_bit:
+                    values.append(int(ve[i] // 16))
 
-        if client_data.bit_mask & SU_VELOCITY2:
-            ve = client_data.velocity
-            client_data.velocity = ve[0], _read_char(file) * 16, ve[2]
+        values.append(int(client_data.item_bit_mask))
 
-        if client_data.bit_mask & SU_PUNCH3:
-            pa = client_data.punch_angle
-            client_data.punch_angle = pa[0], pa[1], _read_angle(file)
+        if bit_mask & SU_WEAPONFRAME:
+            values.append(int(client_data.weapon_frame))
 
-        if client_data.bit_mask & SU_VELOCITY3:
-            ve = client_data.velocity
-            client_data.velocity = ve[0], ve[1], _read_char(file) * 16
+        if bit_mask & SU_ARMOR:
+            values.append(int(client_data.armor))
 
-        client_data.item_bit_mask = _read_long(file)
+        if bit_mask & SU_WEAPON:
+            values.append(int(client_data.weapon))
 
-        if client_data.bit_mask & SU_WEAPONFRAME:
-            client_data.weapon_frame = _read_byte(file)
+        ammo = client_data.ammo
+        values += (int(client_data.health),
+                   int(client_data.active_ammo),
+                   int(ammo[0]), int(ammo[1]), int(ammo[2]), int(ammo[3]),
+                   int(client_data.active_weapon))
 
-        if client_data.bit_mask & SU_ARMOR:
-            client_data.armor = _read_byte(file)
+        buffer += fields_struct.pack(*values)
 
-        if client_data.bit_mask & SU_WEAPON:
-            client_data.weapon = _read_byte(file)
+    @staticmethod
+    def _read(buffer):
+        data = buffer.data
+        position = buffer.position
+        assert data[position] == SVC_CLIENTDATA
+        bit_mask = _short_struct.unpack_from(data, position + 1)[0]
+        reader = _client_data_readers.get(bit_mask)
 
-        client_data.health = _read_short(file)
-        client_data.active_ammo = _read_byte(file)
-        client_data.ammo = _read_byte(file), _read_byte(file), _read_byte(file), _read_byte(file)
-        client_data.active_weapon = _read_byte(file)
+        if reader is None:
+            reader = _client_data_decoder(bit_mask, compact=False)
 
-        return client_data
+        return reader(buffer, data, position + 3)
 
 
-class StopSound(object):
+class StopSound(_Message):
     """Class for representing StopSound messages
 
     Stops a playing sound.
@@ -947,16 +1059,16 @@ class StopSound(object):
         self.channel = None
 
     @staticmethod
-    def write(file, stop_sound):
-        _write_byte(file, SVC_STOPSOUND)
+    def _write(buffer, stop_sound):
+        _write_byte(buffer, SVC_STOPSOUND)
         data = stop_sound.entity << 3 | (stop_sound.channel & 0x07)
-        _write_short(file, data)
+        _write_short(buffer, data)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_STOPSOUND
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_STOPSOUND
         stop_sound = StopSound()
-        data = _read_short(file)
+        data = _read_short(buffer)
 
         stop_sound.channel = data & 0x07
         stop_sound.entity = data >> 3
@@ -964,7 +1076,7 @@ class StopSound(object):
         return stop_sound
 
 
-class UpdateColors(object):
+class UpdateColors(_Message):
     """Class for representing UpdateColors messages
 
     Sets the player's colors.
@@ -984,22 +1096,22 @@ class UpdateColors(object):
         self.colors = None
 
     @staticmethod
-    def write(file, update_colors):
-        _write_byte(file, SVC_UPDATECOLORS)
-        _write_byte(file, update_colors.player)
-        _write_byte(file, update_colors.colors)
+    def _write(buffer, update_colors):
+        _write_byte(buffer, SVC_UPDATECOLORS)
+        _write_byte(buffer, update_colors.player)
+        _write_byte(buffer, update_colors.colors)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_UPDATECOLORS
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_UPDATECOLORS
         update_colors = UpdateColors()
-        update_colors.player = _read_byte(file)
-        update_colors.colors = _read_byte(file)
+        update_colors.player = _read_byte(buffer)
+        update_colors.colors = _read_byte(buffer)
 
         return update_colors
 
 
-class Particle(object):
+class Particle(_Message):
     """Class for representing Particle messages
 
     Creates particle effects
@@ -1028,28 +1140,28 @@ class Particle(object):
         self.color = None
 
     @staticmethod
-    def write(file, particle):
-        _write_byte(file, SVC_PARTICLE)
-        _write_coords(file, particle.origin)
-        _write_char(file, particle.direction[0] * 16)
-        _write_char(file, particle.direction[1] * 16)
-        _write_char(file, particle.direction[2] * 16)
-        _write_byte(file, particle.count)
-        _write_byte(file, particle.color)
+    def _write(buffer, particle):
+        _write_byte(buffer, SVC_PARTICLE)
+        _write_coords(buffer, particle.origin)
+        _write_char(buffer, particle.direction[0] * 16)
+        _write_char(buffer, particle.direction[1] * 16)
+        _write_char(buffer, particle.direction[2] * 16)
+        _write_byte(buffer, particle.count)
+        _write_byte(buffer, particle.color)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_PARTICLE
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_PARTICLE
         particle = Particle()
-        particle.origin = _read_coords(file)
-        particle.direction = _read_char(file) / 16, _read_char(file) / 16, _read_char(file) / 16,
-        particle.count = _read_byte(file)
-        particle.color = _read_byte(file)
+        particle.origin = _read_coords(buffer)
+        particle.direction = _read_char(buffer) / 16, _read_char(buffer) / 16, _read_char(buffer) / 16,
+        particle.count = _read_byte(buffer)
+        particle.color = _read_byte(buffer)
 
         return particle
 
 
-class Damage(object):
+class Damage(_Message):
     """Class for representing Damage messages
 
     Damage information
@@ -1074,24 +1186,24 @@ class Damage(object):
         self.origin = None
 
     @staticmethod
-    def write(file, damage):
-        _write_byte(file, SVC_DAMAGE)
-        _write_byte(file, damage.armor)
-        _write_byte(file, damage.blood)
-        _write_coords(file, damage.origin)
+    def _write(buffer, damage):
+        _write_byte(buffer, SVC_DAMAGE)
+        _write_byte(buffer, damage.armor)
+        _write_byte(buffer, damage.blood)
+        _write_coords(buffer, damage.origin)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_DAMAGE
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_DAMAGE
         damage = Damage()
-        damage.armor = _read_byte(file)
-        damage.blood = _read_byte(file)
-        damage.origin = _read_coords(file)
+        damage.armor = _read_byte(buffer)
+        damage.blood = _read_byte(buffer)
+        damage.origin = _read_coords(buffer)
 
         return damage
 
 
-class SpawnStatic(object):
+class SpawnStatic(_Message):
     """Class for representing SpawnStatic messages
 
     Creates a static entity
@@ -1128,30 +1240,30 @@ class SpawnStatic(object):
         self.angles = None
 
     @staticmethod
-    def write(file, spawn_static):
-        _write_byte(file, SVC_SPAWNSTATIC)
-        _write_byte(file, spawn_static.model_index)
-        _write_byte(file, spawn_static.frame)
-        _write_byte(file, spawn_static.color_map)
-        _write_byte(file, spawn_static.skin)
-        _write_coords(file, spawn_static.origin)
-        _write_angles(file, spawn_static.angles)
+    def _write(buffer, spawn_static):
+        _write_byte(buffer, SVC_SPAWNSTATIC)
+        _write_byte(buffer, spawn_static.model_index)
+        _write_byte(buffer, spawn_static.frame)
+        _write_byte(buffer, spawn_static.color_map)
+        _write_byte(buffer, spawn_static.skin)
+        _write_coords(buffer, spawn_static.origin)
+        _write_angles(buffer, spawn_static.angles)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SPAWNSTATIC
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SPAWNSTATIC
         spawn_static = SpawnStatic()
-        spawn_static.model_index = _read_byte(file)
-        spawn_static.frame = _read_byte(file)
-        spawn_static.color_map = _read_byte(file)
-        spawn_static.skin = _read_byte(file)
-        spawn_static.origin = _read_coords(file)
-        spawn_static.angles = _read_angles(file)
+        spawn_static.model_index = _read_byte(buffer)
+        spawn_static.frame = _read_byte(buffer)
+        spawn_static.color_map = _read_byte(buffer)
+        spawn_static.skin = _read_byte(buffer)
+        spawn_static.origin = _read_coords(buffer)
+        spawn_static.angles = _read_angles(buffer)
 
         return spawn_static
 
 
-class SpawnBinary(object):
+class SpawnBinary(_Message):
     """Class for representing SpawnBinary messages
 
     This is a deprecated message.
@@ -1160,15 +1272,15 @@ class SpawnBinary(object):
     __slots__ = ()
 
     @staticmethod
-    def write(file):
+    def _write(buffer, spawn_binary=None):
         raise BadDemFile('SpawnBinary message obsolete')
 
     @staticmethod
-    def read(file):
+    def _read(buffer):
         raise BadDemFile('SpawnBinary message obsolete')
 
 
-class SpawnBaseline(object):
+class SpawnBaseline(_Message):
     """Class for representing SpawnBaseline messages
 
     Creates a dynamic entity
@@ -1209,27 +1321,27 @@ class SpawnBaseline(object):
         self.angles = None
 
     @staticmethod
-    def write(file, spawn_baseline):
-        _write_byte(file, SVC_SPAWNBASELINE)
-        _write_short(file, spawn_baseline.entity)
-        _write_byte(file, spawn_baseline.model_index)
-        _write_byte(file, spawn_baseline.frame)
-        _write_byte(file, spawn_baseline.color_map)
-        _write_byte(file, spawn_baseline.skin)
-        _write_coords(file, spawn_baseline.origin)
-        _write_angles(file, spawn_baseline.angles)
+    def _write(buffer, spawn_baseline):
+        _write_byte(buffer, SVC_SPAWNBASELINE)
+        _write_short(buffer, spawn_baseline.entity)
+        _write_byte(buffer, spawn_baseline.model_index)
+        _write_byte(buffer, spawn_baseline.frame)
+        _write_byte(buffer, spawn_baseline.color_map)
+        _write_byte(buffer, spawn_baseline.skin)
+        _write_coords(buffer, spawn_baseline.origin)
+        _write_angles(buffer, spawn_baseline.angles)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SPAWNBASELINE
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SPAWNBASELINE
         spawn_baseline = SpawnBaseline()
-        spawn_baseline.entity = _read_short(file)
-        spawn_baseline.model_index = _read_byte(file)
-        spawn_baseline.frame = _read_byte(file)
-        spawn_baseline.color_map = _read_byte(file)
-        spawn_baseline.skin = _read_byte(file)
-        spawn_baseline.origin = _read_coords(file)
-        spawn_baseline.angles = _read_angles(file)
+        spawn_baseline.entity = _read_short(buffer)
+        spawn_baseline.model_index = _read_byte(buffer)
+        spawn_baseline.frame = _read_byte(buffer)
+        spawn_baseline.color_map = _read_byte(buffer)
+        spawn_baseline.skin = _read_byte(buffer)
+        spawn_baseline.origin = _read_coords(buffer)
+        spawn_baseline.angles = _read_angles(buffer)
 
         return spawn_baseline
 
@@ -1250,7 +1362,7 @@ TE_EXPLOSION2 = 12
 TE_BEAM = 13
 
 
-class TempEntity(object):
+class TempEntity(_Message):
     """Class for representing TempEntity messages
 
     Creates a temporary entity. The attributes of the message depend on the
@@ -1264,9 +1376,9 @@ class TempEntity(object):
         self.type = None
 
     @staticmethod
-    def write(file, temp_entity):
-        _write_byte(file, SVC_TEMP_ENTITY)
-        _write_byte(file, temp_entity.type)
+    def _write(buffer, temp_entity):
+        _write_byte(buffer, SVC_TEMP_ENTITY)
+        _write_byte(buffer, temp_entity.type)
 
         if temp_entity.type == TE_WIZSPIKE or \
                         temp_entity.type == TE_KNIGHTSPIKE or \
@@ -1278,30 +1390,30 @@ class TempEntity(object):
                         temp_entity.type == TE_LAVASPLASH or \
                         temp_entity.type == TE_TELEPORT:
 
-            _write_coords(file, temp_entity.origin)
+            _write_coords(buffer, temp_entity.origin)
 
         elif temp_entity.type == TE_LIGHTNING1 or \
                         temp_entity.type == TE_LIGHTNING2 or \
                         temp_entity.type == TE_LIGHTNING3 or \
                         temp_entity.type == TE_BEAM:
 
-            _write_short(file, temp_entity.entity)
-            _write_coords(file, temp_entity.start)
-            _write_coords(file, temp_entity.end)
+            _write_short(buffer, temp_entity.entity)
+            _write_coords(buffer, temp_entity.start)
+            _write_coords(buffer, temp_entity.end)
 
         elif temp_entity.type == TE_EXPLOSION2:
-            _write_coords(file, temp_entity.origin)
-            _write_byte(file, temp_entity.color_start)
-            _write_byte(file, temp_entity.color_length)
+            _write_coords(buffer, temp_entity.origin)
+            _write_byte(buffer, temp_entity.color_start)
+            _write_byte(buffer, temp_entity.color_length)
 
         else:
             raise BadDemFile('Invalid Temporary Entity type: %r' % temp_entity.type)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_TEMP_ENTITY
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_TEMP_ENTITY
         temp_entity = TempEntity()
-        temp_entity.type = _read_byte(file)
+        temp_entity.type = _read_byte(buffer)
 
         if temp_entity.type == TE_WIZSPIKE or \
                         temp_entity.type == TE_KNIGHTSPIKE or \
@@ -1313,21 +1425,21 @@ class TempEntity(object):
                         temp_entity.type == TE_LAVASPLASH or \
                         temp_entity.type == TE_TELEPORT:
 
-            temp_entity.origin = _read_coords(file)
+            temp_entity.origin = _read_coords(buffer)
 
         elif temp_entity.type == TE_LIGHTNING1 or \
                         temp_entity.type == TE_LIGHTNING2 or \
                         temp_entity.type == TE_LIGHTNING3 or \
                         temp_entity.type == TE_BEAM:
 
-            temp_entity.entity = _read_short(file)
-            temp_entity.start = _read_coords(file)
-            temp_entity.end = _read_coords(file)
+            temp_entity.entity = _read_short(buffer)
+            temp_entity.start = _read_coords(buffer)
+            temp_entity.end = _read_coords(buffer)
 
         elif temp_entity.type == TE_EXPLOSION2:
-            temp_entity.origin = _read_coords(file)
-            temp_entity.color_start = _read_byte(file)
-            temp_entity.color_length = _read_byte(file)
+            temp_entity.origin = _read_coords(buffer)
+            temp_entity.color_start = _read_byte(buffer)
+            temp_entity.color_length = _read_byte(buffer)
 
         else:
             raise BadDemFile('Invalid Temporary Entity type: %r' % temp_entity.type)
@@ -1335,7 +1447,7 @@ class TempEntity(object):
         return temp_entity
 
 
-class SetPause(object):
+class SetPause(_Message):
     """Class for representing SetPause messages
 
     Sets the pause state
@@ -1352,20 +1464,20 @@ class SetPause(object):
         self.paused = None
 
     @staticmethod
-    def write(file, set_pause):
-        _write_byte(file, SVC_SETPAUSE)
-        _write_byte(file, set_pause.paused)
+    def _write(buffer, set_pause):
+        _write_byte(buffer, SVC_SETPAUSE)
+        _write_byte(buffer, set_pause.paused)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SETPAUSE
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SETPAUSE
         set_pause = SetPause()
-        set_pause.paused = _read_byte(file)
+        set_pause.paused = _read_byte(buffer)
 
         return set_pause
 
 
-class SignOnNum(object):
+class SignOnNum(_Message):
     """Class for representing SignOnNum messages
 
     This message represents the client state.
@@ -1382,20 +1494,20 @@ class SignOnNum(object):
         self.sign_on = None
 
     @staticmethod
-    def write(file, sign_on_num):
-        _write_byte(file, SVC_SIGNONNUM)
-        _write_byte(file, sign_on_num.sign_on)
+    def _write(buffer, sign_on_num):
+        _write_byte(buffer, SVC_SIGNONNUM)
+        _write_byte(buffer, sign_on_num.sign_on)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SIGNONNUM
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SIGNONNUM
         sign_on_num = SignOnNum()
-        sign_on_num.sign_on = _read_byte(file)
+        sign_on_num.sign_on = _read_byte(buffer)
 
         return sign_on_num
 
 
-class CenterPrint(object):
+class CenterPrint(_Message):
     """Class for representing CenterPrint messages
 
     Prints text in the center of the screen.
@@ -1412,20 +1524,20 @@ class CenterPrint(object):
         self.text = None
 
     @staticmethod
-    def write(file, center_print):
-        _write_byte(file, SVC_CENTERPRINT)
-        _write_string(file, center_print.text)
+    def _write(buffer, center_print):
+        _write_byte(buffer, SVC_CENTERPRINT)
+        _write_string(buffer, center_print.text)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_CENTERPRINT
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_CENTERPRINT
         center_print = CenterPrint()
-        center_print.text = _read_string(file)
+        center_print.text = _read_string(buffer)
 
         return center_print
 
 
-class KilledMonster(object):
+class KilledMonster(_Message):
     """Class for representing KilledMonster messages
 
     Indicates the death of a monster.
@@ -1434,16 +1546,16 @@ class KilledMonster(object):
     __slots__ = ()
 
     @staticmethod
-    def write(file, killed_monster=None):
-        _write_byte(file, SVC_KILLEDMONSTER)
+    def _write(buffer, killed_monster=None):
+        _write_byte(buffer, SVC_KILLEDMONSTER)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_KILLEDMONSTER
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_KILLEDMONSTER
         return KilledMonster()
 
 
-class FoundSecret(object):
+class FoundSecret(_Message):
     """Class for representing FoundSecret messages
 
     Indicates a secret has been found.
@@ -1452,16 +1564,16 @@ class FoundSecret(object):
     __slots__ = ()
 
     @staticmethod
-    def write(file, found_secret=None):
-        _write_byte(file, SVC_FOUNDSECRET)
+    def _write(buffer, found_secret=None):
+        _write_byte(buffer, SVC_FOUNDSECRET)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_FOUNDSECRET
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_FOUNDSECRET
         return FoundSecret()
 
 
-class SpawnStaticSound(object):
+class SpawnStaticSound(_Message):
     """Class for representing SpawnStaticSound messages
 
     Creates a static sound
@@ -1490,26 +1602,26 @@ class SpawnStaticSound(object):
         self.attenuation = None
 
     @staticmethod
-    def write(file, spawn_static_sound):
-        _write_byte(file, SVC_SPAWNSTATICSOUND)
-        _write_coords(file, spawn_static_sound.origin)
-        _write_byte(file, spawn_static_sound.sound_number)
-        _write_byte(file, spawn_static_sound.volume * 256)
-        _write_byte(file, spawn_static_sound.attenuation * 64)
+    def _write(buffer, spawn_static_sound):
+        _write_byte(buffer, SVC_SPAWNSTATICSOUND)
+        _write_coords(buffer, spawn_static_sound.origin)
+        _write_byte(buffer, spawn_static_sound.sound_number)
+        _write_byte(buffer, spawn_static_sound.volume * 256)
+        _write_byte(buffer, spawn_static_sound.attenuation * 64)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SPAWNSTATICSOUND
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SPAWNSTATICSOUND
         spawn_static_sound = SpawnStaticSound()
-        spawn_static_sound.origin = _read_coords(file)
-        spawn_static_sound.sound_number = _read_byte(file)
-        spawn_static_sound.volume = _read_byte(file) / 256
-        spawn_static_sound.attenuation = _read_byte(file) / 64
+        spawn_static_sound.origin = _read_coords(buffer)
+        spawn_static_sound.sound_number = _read_byte(buffer)
+        spawn_static_sound.volume = _read_byte(buffer) / 256
+        spawn_static_sound.attenuation = _read_byte(buffer) / 64
 
         return spawn_static_sound
 
 
-class Intermission(object):
+class Intermission(_Message):
     """Class for representing Intermission messages
 
     Displays the level end screen.
@@ -1518,16 +1630,16 @@ class Intermission(object):
     __slots__ = ()
 
     @staticmethod
-    def write(file, intermission=None):
-        _write_byte(file, SVC_INTERMISSION)
+    def _write(buffer, intermission=None):
+        _write_byte(buffer, SVC_INTERMISSION)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_INTERMISSION
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_INTERMISSION
         return Intermission()
 
 
-class Finale(object):
+class Finale(_Message):
     """Class for representing Finale messages
 
     Displays the episode end screen.
@@ -1544,20 +1656,20 @@ class Finale(object):
         self.text = None
 
     @staticmethod
-    def write(file, finale):
-        _write_byte(file, SVC_FINALE)
-        _write_string(file, finale.text)
+    def _write(buffer, finale):
+        _write_byte(buffer, SVC_FINALE)
+        _write_string(buffer, finale.text)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_FINALE
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_FINALE
         finale = Finale()
-        finale.text = _read_string(file)
+        finale.text = _read_string(buffer)
 
         return finale
 
 
-class CdTrack(object):
+class CdTrack(_Message):
     """Class for representing CdTrack messages
 
     Selects the cd track
@@ -1578,22 +1690,22 @@ class CdTrack(object):
         self.to_track = None
 
     @staticmethod
-    def write(file, cd_track):
-        _write_byte(file, SVC_CDTRACK)
-        _write_byte(file, cd_track.from_track)
-        _write_byte(file, cd_track.to_track)
+    def _write(buffer, cd_track):
+        _write_byte(buffer, SVC_CDTRACK)
+        _write_byte(buffer, cd_track.from_track)
+        _write_byte(buffer, cd_track.to_track)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_CDTRACK
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_CDTRACK
         cd_track = CdTrack()
-        cd_track.from_track = _read_byte(file)
-        cd_track.to_track = _read_byte(file)
+        cd_track.from_track = _read_byte(buffer)
+        cd_track.to_track = _read_byte(buffer)
 
         return cd_track
 
 
-class SellScreen(object):
+class SellScreen(_Message):
     """Class for representing SellScreen messages
 
     Displays the help and sell screen.
@@ -1602,16 +1714,16 @@ class SellScreen(object):
     __slots__ = ()
 
     @staticmethod
-    def write(file, sell_screen=None):
-        _write_byte(file, SVC_SELLSCREEN)
+    def _write(buffer, sell_screen=None):
+        _write_byte(buffer, SVC_SELLSCREEN)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_SELLSCREEN
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_SELLSCREEN
         return SellScreen()
 
 
-class CutScene(object):
+class CutScene(_Message):
     """Class for representing CutScene messages
 
     Displays end screen and text.
@@ -1628,15 +1740,15 @@ class CutScene(object):
         self.text = None
 
     @staticmethod
-    def write(file, cut_scene):
-        _write_byte(file, SVC_CUTSCENE)
-        _write_string(file, cut_scene.text)
+    def _write(buffer, cut_scene):
+        _write_byte(buffer, SVC_CUTSCENE)
+        _write_string(buffer, cut_scene.text)
 
     @staticmethod
-    def read(file):
-        assert _read_byte(file) == SVC_CUTSCENE
+    def _read(buffer):
+        assert _read_byte(buffer) == SVC_CUTSCENE
         cut_scene = CutScene()
-        cut_scene.text = _read_string(file)
+        cut_scene.text = _read_string(buffer)
 
         return cut_scene
 
@@ -1666,8 +1778,44 @@ U_SKIN = 0b0001000000000000
 U_EFFECTS = 0b0010000000000000
 U_LONGENTITY = 0b0100000000000000
 
+_U_ORIGIN_ANGLES = U_ORIGIN1 | U_ORIGIN2 | U_ORIGIN3 | U_ANGLE1 | U_ANGLE2 | U_ANGLE3
+
+# The optional fields of an UpdateEntity message in the order they are sent
+_update_entity_fields = (
+    (U_MODEL, 'B'),
+    (U_FRAME, 'B'),
+    (U_COLORMAP, 'B'),
+    (U_SKIN, 'B'),
+    (U_EFFECTS, 'B'),
+    (U_ORIGIN1, 'h'),
+    (U_ANGLE1, 'b'),
+    (U_ORIGIN2, 'h'),
+    (U_ANGLE2, 'b'),
+    (U_ORIGIN3, 'h'),
+    (U_ANGLE3, 'b')
+)
+
+_update_entity_structs = {}
+
+
+def _update_entity_struct(bit_mask):
+    """Returns a Struct for the fields that follow the bit mask of an
+    UpdateEntity message. Structs are cached per bit mask.
+    """
+
+    fmt = '<h' if bit_mask & U_LONGENTITY else '<B'
+
+    for bit, code in _update_entity_fields:
+        if bit_mask & bit:
+            fmt += code
+
+    fields_struct = struct.Struct(fmt)
+    _update_entity_structs[bit_mask] = fields_struct
+
+    return fields_struct
 
-class UpdateEntity(object):
+
+class UpdateEntity(_Message):
     """Class for representing UpdateEntity messages
 
     Updates an entity.
@@ -1716,100 +1864,595 @@ class UpdateEntity(object):
         self.angles = None, None, None
 
     @staticmethod
-    def write(file, update_entity):
-        _write_byte(file, update_entity.bit_mask & 0xFF | 0x80)
+    def _write(buffer, update_entity):
+        bit_mask = update_entity.bit_mask
+        buffer.append(bit_mask & 0xFF | 0x80)
 
-        if update_entity.bit_mask & U_MOREBITS:
-            _write_byte(file, update_entity.bit_mask >> 8 & 0xFF)
+        if bit_mask & U_MOREBITS:
+            buffer.append(bit_mask >> 8 & 0xFF)
 
-        if update_entity.bit_mask & U_LONGENTITY:
-            _write_short(file, update_entity.entity)
+        # The high bit of the first byte only marks the message type
+        bit_mask &= 0xFF7F
+        fields_struct = _update_entity_structs.get(bit_mask)
 
-        else:
-            _write_byte(file, update_entity.entity)
+        if fields_struct is None:
+            fields_struct = _update_entity_struct(bit_mask)
+
+        values = [int(update_entity.entity)]
+
+        if bit_mask & U_MODEL:
+            values.append(int(update_entity.model_index))
 
-        if update_entity.bit_mask & U_MODEL:
-            _write_byte(file, update_entity.model_index)
+        if bit_mask & U_FRAME:
+            values.append(int(update_entity.frame))
 
-        if update_entity.bit_mask & U_FRAME:
-            _write_byte(file, update_entity.frame)
+        if bit_mask & U_COLORMAP:
+            values.append(int(update_entity.colormap))
 
-        if update_entity.bit_mask & U_COLORMAP:
-            _write_byte(file, update_entity.colormap)
+        if bit_mask & U_SKIN:
+            values.append(int(update_entity.skin))
 
-        if update_entity.bit_mask & U_SKIN:
-            _write_byte(file, update_entity.skin)
+        if bit_mask & U_EFFECTS:
+            values.append(int(update_entity.effects))
 
-        if update_entity.bit_mask & U_EFFECTS:
-            _write_byte(file, update_entity.effects)
+        if bit_mask & _U_ORIGIN_ANGLES:
+            origin = update_entity.origin
+            angles = update_entity.angles
 
-        if update_entity.bit_mask & U_ORIGIN1:
-            _write_coord(file, update_entity.origin[0])
+            if bit_mask & U_ORIGIN1:
+                values.append(int(origin[0] / 0.125))
 
-        if update_entity.bit_mask & U_ANGLE1:
-            _write_angle(file, update_entity.angles[0])
+            if bit_mask & U_ANGLE1:
+                values.append(int(angles[0] * 256 / 360))
 
-        if update_entity.bit_mask & U_ORIGIN2:
-            _write_coord(file, update_entity.origin[1])
+            if bit_mask & U_ORIGIN2:
+                values.append(int(origin[1] / 0.125))
 
-        if update_entity.bit_mask & U_ANGLE2:
-            _write_angle(file, update_entity.angles[1])
+            if bit_mask & U_ANGLE2:
+                values.append(int(angles[1] * 256 / 360))
 
-        if update_entity.bit_mask & U_ORIGIN3:
-            _write_coord(file, update_entity.origin[2])
+            if bit_mask & U_ORIGIN3:
+                values.append(int(origin[2] / 0.125))
 
-        if update_entity.bit_mask & U_ANGLE3:
-            _write_angle(file, update_entity.angles[2])
+            if bit_mask & U_ANGLE3:
+                values.append(int(angles[2] * 256 / 360))
+
+        buffer += fields_struct.pack(*values)
 
     @staticmethod
-    def read(file):
-        update_entity = UpdateEntity()
-        b = _read_byte(file)
-        update_entity.bit_mask = b & 0x7F
+    def _read(buffer):
+        data = buffer.data
+        position = buffer.position
+        bit_mask = data[position] & 0x7F
+
+        if bit_mask & U_MOREBITS:
+            bit_mask |= data[position + 1] << 8
+            position += 2
+
+        else:
+            position += 1
+
+        reader = _update_entity_readers.get(bit_mask)
+
+        if reader is None:
+            reader = _update_entity_decoder(bit_mask, compact=False)
+
+        return reader(buffer, data, position)
+
+
+def _read_invalid(buffer):
+    raise BadDemFile('Invalid message id: %r' % buffer.data[buffer.position])
+
+
+# Message decoders indexed by the first byte of the message. Any byte with
+# the high bit set starts an UpdateEntity message.
+_message_readers = [_read_invalid] * 256
+_message_readers[:len(_messages)] = [m._read for m in _messages]
+_message_readers[128:] = [UpdateEntity._read] * 128
+
+
+def _skip_fixed(size):
+    def skip(buffer):
+        buffer.position += size
+
+    return skip
+
+
+def _skip_string(size_before_string, terminal_byte=b'\x00'):
+    def skip(buffer):
+        position = buffer.position + size_before_string
+        end = buffer.data.find(terminal_byte, position)
+
+        if end < 0:
+            raise BadDemFile('Unterminated string at offset %i' % (buffer.base + position))
+
+        buffer.position = end + 1
+
+    return skip
+
+
+def _skip_sound(buffer):
+    bit_mask = buffer.data[buffer.position + 1]
+    size = 11
+
+    if bit_mask & SND_VOLUME:
+        size += 1
+
+    if bit_mask & SND_ATTENUATION:
+        size += 1
+
+    buffer.position += size
+
+
+def _skip_server_info(buffer):
+    data = buffer.data
+
+    # Message id, protocol version, max clients and multi
+    position = buffer.position + 7
+
+    # Map name
+    position = _end_of_string(buffer, position)
+
+    # Model and sound tables each end with an empty string
+    for _ in range(2):
+        while data[position] != 0:
+            position = _end_of_string(buffer, position)
+
+        position += 1
+
+    buffer.position = position
+
+
+def _end_of_string(buffer, position):
+    end = buffer.data.find(b'\x00', position)
+
+    if end < 0:
+        raise BadDemFile('Unterminated string at offset %i' % (buffer.base + position))
+
+    return end + 1
+
+
+def _skip_client_data(buffer):
+    bit_mask = _short_struct.unpack_from(buffer.data, buffer.position + 1)[0]
+    fields_struct = _client_data_structs.get(bit_mask)
+
+    if fields_struct is None:
+        fields_struct = _client_data_struct(bit_mask)
+
+    buffer.position += 3 + fields_struct.size
+
+
+def _skip_temp_entity(buffer):
+    temp_entity_type = buffer.data[buffer.position + 1]
+    size = _temp_entity_sizes.get(temp_entity_type)
+
+    if size is None:
+        raise BadDemFile('Invalid Temporary Entity type: %r' % temp_entity_type)
+
+    buffer.position += size
+
+
+def _skip_update_entity(buffer):
+    data = buffer.data
+    position = buffer.position
+    bit_mask = data[position] & 0x7F
+
+    if bit_mask & U_MOREBITS:
+        bit_mask |= data[position + 1] << 8
+        position += 2
+
+    else:
+        position += 1
+
+    fields_struct = _update_entity_structs.get(bit_mask)
 
-        if update_entity.bit_mask & U_MOREBITS:
-            update_entity.bit_mask |= _read_byte(file) << 8
+    if fields_struct is None:
+        fields_struct = _update_entity_struct(bit_mask)
 
-        if update_entity.bit_mask & U_LONGENTITY:
-            update_entity.entity = _read_short(file)
+    buffer.position = position + fields_struct.size
+
+
+# The size of each kind of TempEntity message
+_temp_entity_sizes = {}
+_temp_entity_sizes.update(dict.fromkeys((TE_WIZSPIKE, TE_KNIGHTSPIKE, TE_SPIKE, TE_SUPERSPIKE, TE_GUNSHOT,
+                                         TE_EXPLOSION, TE_TAREXPLOSION, TE_LAVASPLASH, TE_TELEPORT), 8))
+_temp_entity_sizes.update(dict.fromkeys((TE_LIGHTNING1, TE_LIGHTNING2, TE_LIGHTNING3, TE_BEAM), 16))
+_temp_entity_sizes[TE_EXPLOSION2] = 10
+
+# Functions that step over a message without decoding it, indexed by the
+# first byte of the message.
+_message_skippers = [_read_invalid] * 256
+_message_skippers[:len(_messages)] = [
+    _skip_fixed(1),             # Bad
+    _skip_fixed(1),             # Nop
+    _skip_fixed(1),             # Disconnect
+    _skip_fixed(6),             # UpdateStat
+    _skip_fixed(5),             # Version
+    _skip_fixed(3),             # SetView
+    _skip_sound,                # Sound
+    _skip_fixed(5),             # Time
+    _skip_string(1),            # Print
+    _skip_string(1, b'\n'),     # StuffText
+    _skip_fixed(4),             # SetAngle
+    _skip_server_info,          # ServerInfo
+    _skip_string(2),            # LightStyle
+    _skip_string(2),            # UpdateName
+    _skip_fixed(4),             # UpdateFrags
+    _skip_client_data,          # ClientData
+    _skip_fixed(3),             # StopSound
+    _skip_fixed(3),             # UpdateColors
+    _skip_fixed(12),            # Particle
+    _skip_fixed(9),             # Damage
+    _skip_fixed(14),            # SpawnStatic
+    SpawnBinary._read,          # SpawnBinary
+    _skip_fixed(16),            # SpawnBaseline
+    _skip_temp_entity,          # TempEntity
+    _skip_fixed(2),             # SetPause
+    _skip_fixed(2),             # SignOnNum
+    _skip_string(1),            # CenterPrint
+    _skip_fixed(1),             # KilledMonster
+    _skip_fixed(1),             # FoundSecret
+    _skip_fixed(10),            # SpawnStaticSound
+    _skip_fixed(1),             # Intermission
+    _skip_string(1),            # Finale
+    _skip_fixed(3),             # CdTrack
+    _skip_fixed(1),             # SellScreen
+    _skip_string(1)             # CutScene
+]
+_message_skippers[128:] = [_skip_update_entity] * 128
+
+# Field names of the records returned in compact mode, by record tag. Records
+# of other messages hold the message attributes in the order of the class'
+# __slots__, and TempEntity records hold the type followed by the attributes
+# for that type.
+COMPACT_FIELDS = {
+    U_SIGNAL: ('bit_mask', 'entity', 'model_index', 'frame', 'colormap',
+               'skin', 'effects', 'x', 'y', 'z', 'pitch', 'yaw', 'roll'),
+    SVC_CLIENTDATA: ('bit_mask', 'view_height', 'ideal_pitch', 'punch_x',
+                     'punch_y', 'punch_z', 'velocity_x', 'velocity_y',
+                     'velocity_z', 'item_bit_mask', 'on_ground', 'in_water',
+                     'weapon_frame', 'armor', 'weapon', 'health',
+                     'active_ammo', 'shells', 'nails', 'rockets', 'cells',
+                     'active_weapon')
+}
+
+for _message_type in _messages:
+    if _message_type is not ClientData and '__slots__' in _message_type.__dict__:
+        _names = _message_type.__slots__
+        COMPACT_FIELDS[_messages.index(_message_type)] = (_names,) if isinstance(_names, str) else tuple(_names)
+
+
+def _compile_decoder(name, source, namespace):
+    exec(source, namespace)
+    return namespace[name]
+
+
+_update_entity_decoders = {}
+_update_entity_readers = {}
+
+
+def _update_entity_decoder(bit_mask, compact=True):
+    """Returns a function that decodes the fields of an UpdateEntity message
+    with the given bit mask into a record, or into an UpdateEntity object if
+    compact is False. Each bit mask gets its own function, generated once and
+    cached.
+    """
+
+    fields_struct = _update_entity_struct(bit_mask)
+    names = ['entity']
+    outputs = dict.fromkeys(COMPACT_FIELDS[U_SIGNAL][1:], 'None')
+    outputs['entity'] = 'entity'
+
+    for (bit, _), name, conversion in zip(_update_entity_fields,
+                                          ('model_index', 'frame', 'colormap', 'skin', 'effects', 'x', 'pitch', 'y', 'yaw', 'z', 'roll'),
+                                          ('', '', '', '', '', ' * 0.125', ' / 256 * 360', ' * 0.125', ' / 256 * 360', ' * 0.125', ' / 256 * 360')):
+        if bit_mask & bit:
+            names.append(name)
+            outputs[name] = name + conversion
+
+    if compact:
+        source = (
+            'def decode(buffer, data, position):\n'
+            '    {names}, = unpack_from(data, position)\n'
+            '    buffer.position = position + {size}\n'
+            '    return ({tag}, {bit_mask}, {outputs})\n'
+        ).format(names=', '.join(names),
+                 size=fields_struct.size,
+                 tag=U_SIGNAL,
+                 bit_mask=bit_mask,
+                 outputs=', '.join(outputs.values()))
+
+    else:
+        # Every slot is assigned, so __init__ is skipped
+        source = (
+            'def decode(buffer, data, position):\n'
+            '    {names}, = unpack_from(data, position)\n'
+            '    buffer.position = position + {size}\n'
+            '    update_entity = new(UpdateEntity)\n'
+            '    update_entity.bit_mask = {bit_mask}\n'
+            '    update_entity.entity = entity\n'
+            '    update_entity.model_index = {model_index}\n'
+            '    update_entity.frame = {frame}\n'
+            '    update_entity.colormap = {colormap}\n'
+            '    update_entity.skin = {skin}\n'
+            '    update_entity.effects = {effects}\n'
+            '    update_entity.origin = {x}, {y}, {z}\n'
+            '    update_entity.angles = {pitch}, {yaw}, {roll}\n'
+            '    return update_entity\n'
+        ).format(names=', '.join(names),
+                 size=fields_struct.size,
+                 bit_mask=bit_mask,
+                 **outputs)
+
+    decoder = _compile_decoder('decode', source, {'unpack_from': fields_struct.unpack_from,
+                                                  'new': object.__new__,
+                                                  'UpdateEntity': UpdateEntity})
+    decoders = _update_entity_decoders if compact else _update_entity_readers
+    decoders[bit_mask] = decoder
+
+    return decoder
+
+
+def _read_update_entity_compact(buffer):
+    data = buffer.data
+    position = buffer.position
+    bit_mask = data[position] & 0x7F
+
+    if bit_mask & U_MOREBITS:
+        bit_mask |= data[position + 1] << 8
+        position += 2
+
+    else:
+        position += 1
+
+    decoder = _update_entity_decoders.get(bit_mask)
+
+    if decoder is None:
+        decoder = _update_entity_decoder(bit_mask)
+
+    return decoder(buffer, data, position)
+
+
+_client_data_decoders = {}
+_client_data_readers = {}
+
+
+def _client_data_decoder(bit_mask, compact=True):
+    """Returns a function that decodes the fields of a ClientData message
+    with the given bit mask into a record, or into a ClientData object if
+    compact is False. Unsent fields get the same defaults as a ClientData
+    object.
+    """
+
+    fields_struct = _client_data_struct(bit_mask)
+    names = []
+    outputs = {
+        'view_height': '22',
+        'ideal_pitch': '0',
+        'punch_x': '0', 'punch_y': '0', 'punch_z': '0',
+        'velocity_x': '0', 'velocity_y': '0', 'velocity_z': '0',
+        'item_bit_mask': 'item_bit_mask',
+        'on_ground': str(bit_mask & SU_ONGROUND != 0),
+        'in_water': str(bit_mask & SU_INWATER != 0),
+        'weapon_frame': '0',
+        'armor': '0',
+        'weapon': 'None'
+    }
+
+    for bit, name, conversion in ((SU_VIEWHEIGHT, 'view_height', ''),
+                                  (SU_IDEALPITCH, 'ideal_pitch', ''),
+                                  (SU_PUNCH1, 'punch_x', ' / 256 * 360'),
+                                  (SU_VELOCITY1, 'velocity_x', ' * 16'),
+                                  (SU_PUNCH2, 'punch_y', ' / 256 * 360'),
+                                  (SU_VELOCITY2, 'velocity_y', ' * 16'),
+                                  (SU_PUNCH3, 'punch_z', ' / 256 * 360'),
+                                  (SU_VELOCITY3, 'velocity_z', ' * 16')):
+        if bit_mask & bit:
+            names.append(name)
+            outputs[name] = name + conversion
+
+    names.append('item_bit_mask')
+
+    for bit, name in ((SU_WEAPONFRAME, 'weapon_frame'),
+                      (SU_ARMOR, 'armor'),
+                      (SU_WEAPON, 'weapon')):
+        if bit_mask & bit:
+            names.append(name)
+            outputs[name] = name
+
+    for name in COMPACT_FIELDS[SVC_CLIENTDATA][15:]:
+        names.append(name)
+        outputs[name] = name
+
+    if compact:
+        source = (
+            'def decode(buffer, data, position):\n'
+            '    {names}, = unpack_from(data, position)\n'
+            '    buffer.position = position + {size}\n'
+            '    return ({tag}, {bit_mask}, {outputs})\n'
+        ).format(names=', '.join(names),
+                 size=fields_struct.size,
+                 tag=SVC_CLIENTDATA,
+                 bit_mask=bit_mask,
+                 outputs=', '.join(outputs[n] for n in COMPACT_FIELDS[SVC_CLIENTDATA][1:]))
+
+    else:
+        # Every slot is assigned, so __init__ is skipped
+        source = (
+            'def decode(buffer, data, position):\n'
+            '    {names}, = unpack_from(data, position)\n'
+            '    buffer.position = position + {size}\n'
+            '    client_data = new(ClientData)\n'
+            '    client_data.bit_mask = {bit_mask}\n'
+            '    client_data.view_height = {view_height}\n'
+            '    client_data.ideal_pitch = {ideal_pitch}\n'
+            '    client_data.punch_angle = {punch_x}, {punch_y}, {punch_z}\n'
+            '    client_data.velocity = {velocity_x}, {velocity_y}, {velocity_z}\n'
+            '    client_data.item_bit_mask = item_bit_mask\n'
+            '    client_data.on_ground = {on_ground}\n'
+            '    client_data.in_water = {in_water}\n'
+            '    client_data.weapon_frame = {weapon_frame}\n'
+            '    client_data.armor = {armor}\n'
+            '    client_data.weapon = {weapon}\n'
+            '    client_data.health = health\n'
+            '    client_data.active_ammo = active_ammo\n'
+            '    client_data.ammo = shells, nails, rockets, cells\n'
+            '    client_data.active_weapon = active_weapon\n'
+            '    return client_data\n'
+        ).format(names=', '.join(names),
+                 size=fields_struct.size,
+                 bit_mask=bit_mask,
+                 **outputs)
+
+    decoder = _compile_decoder('decode', source, {'unpack_from': fields_struct.unpack_from,
+                                                  'new': object.__new__,
+                                                  'ClientData': ClientData})
+    decoders = _client_data_decoders if compact else _client_data_readers
+    decoders[bit_mask] = decoder
+
+    return decoder
+
+
+def _read_client_data_compact(buffer):
+    data = buffer.data
+    position = buffer.position
+    bit_mask = _short_struct.unpack_from(data, position + 1)[0]
+    decoder = _client_data_decoders.get(bit_mask)
+
+    if decoder is None:
+        decoder = _client_data_decoder(bit_mask)
+
+    return decoder(buffer, data, position + 3)
+
+
+def _read_time_compact(buffer):
+    position = buffer.position
+    buffer.position = position + 5
+    return SVC_TIME, _float_struct.unpack_from(buffer.data, position + 1)[0]
+
+
+def _compact_reader(message_type):
+    """Returns a reader that decodes a message and flattens it into a
+    record.
+    """
+
+    message_id = _messages.index(message_type)
+    read = message_type._read
+    names = COMPACT_FIELDS.get(message_id)
+
+    if names is None:
+        def reader(buffer):
+            return (message_id,) + tuple(vars(read(buffer)).values())
+
+    elif not names:
+        def reader(buffer):
+            read(buffer)
+            return message_id,
+
+    else:
+        get_values = operator.attrgetter(*names)
+
+        if len(names) == 1:
+            def reader(buffer):
+                return message_id, get_values(read(buffer))
 
         else:
-            update_entity.entity = _read_byte(file)
+            def reader(buffer):
+                return (message_id,) + get_values(read(buffer))
+
+    return reader
+
+
+# Compact mode readers indexed by the first byte of the message
+_compact_message_readers = [_read_invalid] * 256
+_compact_message_readers[:len(_messages)] = [_compact_reader(m) for m in _messages]
+_compact_message_readers[SVC_TIME] = _read_time_compact
+_compact_message_readers[SVC_CLIENTDATA] = _read_client_data_compact
+_compact_message_readers[128:] = [_read_update_entity_compact] * 128
+
+_filtered_message_readers = {}
+
+
+def _message_readers_for(types, compact=False):
+    """Returns a message reader table that decodes only the given message
+    types and skips all others. Tables are cached per set of types.
+    """
+
+    all_readers = _compact_message_readers if compact else _message_readers
+
+    if types is None:
+        return all_readers
+
+    types = frozenset(types)
+    readers = _filtered_message_readers.get((types, compact))
+
+    if readers is None:
+        readers = list(_message_skippers)
+
+        for message_type in types:
+            if message_type is UpdateEntity:
+                readers[128:] = all_readers[128:]
+
+            elif message_type in _messages:
+                message_id = _messages.index(message_type)
+                readers[message_id] = all_readers[message_id]
+
+            else:
+                raise ValueError('Not a message type: %r' % message_type)
+
+        _filtered_message_readers[types, compact] = readers
+
+    return readers
+
+
+def _message_state(message):
+    """Returns the attribute values of a message. Compared against the values
+    it was read with to tell if a message was changed.
+    """
+
+    getter = _message_state_getters.get(type(message))
+
+    if getter is None:
+        getter = _message_state_getter(type(message))
+
+    return getter(message)
 
-        if update_entity.bit_mask & U_MODEL:
-            update_entity.model_index = _read_byte(file)
 
-        if update_entity.bit_mask & U_FRAME:
-            update_entity.frame = _read_byte(file)
+_message_state_getters = {}
 
-        if update_entity.bit_mask & U_COLORMAP:
-            update_entity.colormap = _read_byte(file)
 
-        if update_entity.bit_mask & U_SKIN:
-            update_entity.skin = _read_byte(file)
+def _message_state_getter(message_type):
+    names = message_type.__dict__.get('__slots__')
 
-        if update_entity.bit_mask & U_EFFECTS:
-            update_entity.effects = _read_byte(file)
+    if isinstance(names, str):
+        names = names,
 
-        if update_entity.bit_mask & U_ORIGIN1:
-            update_entity.origin = _read_coord(file), update_entity.origin[1], update_entity.origin[2]
+    if names is None:
+        # Messages without slots such as TempEntity
+        def getter(message):
+            return tuple(sorted((k, _frozen(v)) for k, v in vars(message).items()))
 
-        if update_entity.bit_mask & U_ANGLE1:
-            update_entity.angles = _read_angle(file), update_entity.angles[1], update_entity.angles[2]
+    elif not names:
+        def getter(message):
+            return ()
 
-        if update_entity.bit_mask & U_ORIGIN2:
-            update_entity.origin = update_entity.origin[0], _read_coord(file), update_entity.origin[2]
+    elif message_type is ServerInfo:
+        # The model and sound tables are lists that can be changed in place
+        get_values = operator.attrgetter(*names)
 
-        if update_entity.bit_mask & U_ANGLE2:
-            update_entity.angles = update_entity.angles[0], _read_angle(file), update_entity.angles[2]
+        def getter(message):
+            return tuple(_frozen(v) for v in get_values(message))
 
-        if update_entity.bit_mask & U_ORIGIN3:
-            update_entity.origin = update_entity.origin[0], update_entity.origin[1], _read_coord(file)
+    else:
+        getter = operator.attrgetter(*names)
 
-        if update_entity.bit_mask & U_ANGLE3:
-            update_entity.angles = update_entity.angles[0], update_entity.angles[1], _read_angle(file)
+    _message_state_getters[message_type] = getter
 
-        return update_entity
+    return getter
+
+
+def _frozen(value):
+    return tuple(value) if type(value) is list else value
 
 
 class MessageBlock(object):
@@ -1823,194 +2466,1166 @@ class MessageBlock(object):
 
     __slots__ = (
         'view_angles',
-        'messages'
+        'messages',
+        '_raw'
     )
 
     def __init__(self):
         self.view_angles = None
         self.messages = []
 
+        # Set when read in raw mode to the bytes of the block, the messages
+        # and their states as read, and the span of each message as
+        # (message, start, end, state). Skipped messages have a message and
+        # state of None.
+        self._raw = None
+
     @staticmethod
     def write(file, message_block):
-        start_of_block = file.tell()
-        _write_long(file, 0)
-        _write_float(file, message_block.view_angles[0])
-        _write_float(file, message_block.view_angles[1])
-        _write_float(file, message_block.view_angles[2])
-        start_of_messages = file.tell()
-
-        for message in message_block.messages:
-            message.__class__.write(file, message)
-
-        end_of_messages = file.tell()
-        block_size = end_of_messages - start_of_messages
+        """Writes a message block to a file-like object with a single write.
+        The file does not need to be seekable.
+        """
 
-        file.seek(start_of_block)
-        _write_long(file, block_size)
-        file.seek(end_of_messages )
+        buffer = bytearray()
+        MessageBlock._write(buffer, message_block)
+        file.write(buffer)
 
     @staticmethod
-    def read(file):
-        message_block = MessageBlock()
-        blocksize = _read_long(file)
-        message_block.view_angles = _read_float(file), _read_float(file), _read_float(file)
-        message_block_data = file.read(blocksize)
+    def _write(buffer, message_block):
+        start_of_block = len(buffer)
+        buffer += _empty_block_header
 
-        buff = io.BufferedReader(io.BytesIO(message_block_data))
-        message_id = buff.peek(1)[:1]
+        if message_block._raw is not None:
+            MessageBlock._write_raw(buffer, message_block)
 
-        while message_id != b'':
-            message_id = struct.unpack('<B', message_id)[0]
+        else:
+            for message in message_block.messages:
+                message.__class__._write(buffer, message)
 
-            if message_id < 128:
-                message = _messages[message_id].read(buff)
+        block_size = len(buffer) - start_of_block - _block_header_struct.size
+        view_angles = message_block.view_angles
+        _block_header_struct.pack_into(buffer, start_of_block, block_size, view_angles[0], view_angles[1], view_angles[2])
 
-            else:
-                message = UpdateEntity.read(buff)
+    @staticmethod
+    def _write_raw(buffer, message_block):
+        """Writes the messages of a block read in raw mode. Messages that are
+        unchanged and skipped messages are copied from the original bytes,
+        only changed and new messages are encoded.
+        """
 
-            if message:
-                message_block.messages.append(message)
+        data, messages, states, spans = message_block._raw
 
-            message_id = buff.peek(1)[:1]
+        # Unchanged blocks are copied whole
+        if tuple(message_block.messages) == messages and list(map(_message_state, messages)) == states:
+            buffer += data[_block_header_struct.size:]
+            return
 
-        buff.close()
+        span_numbers = {id(span[0]): number for number, span in enumerate(spans) if span[0] is not None}
+        last = -1
 
-        return message_block
+        for message in message_block.messages:
+            number = span_numbers.get(id(message))
 
+            if number is None:
+                message.__class__._write(buffer, message)
+                continue
 
-class Dem(object):
-    """Class for working with Dem files
+            # Skipped messages stay between the messages they were read with
+            if number > last:
+                for skipped, start, end, _ in spans[last + 1:number]:
+                    if skipped is None:
+                        buffer += data[start:end]
 
-    Example:
-        d = Dem.open(file)
+                last = number
 
-    Attributes:
-        cd_track: The number of the cd track to play. The track will be '-1' if
-            no music.
+            _, start, end, state = spans[number]
 
-        message_blocks: A sequence of Message objects
-    """
+            if _message_state(message) == state:
+                buffer += data[start:end]
 
-    def __init__(self):
-        self.fp = None
-        self.mode = None
-        self._did_modify = False
+            else:
+                message.__class__._write(buffer, message)
 
-        self.cd_track = '-1'
-        self.message_blocks = []
+        for skipped, start, end, _ in spans[last + 1:]:
+            if skipped is None:
+                buffer += data[start:end]
 
     @staticmethod
-    def open(file, mode='r'):
-        """Returns a Dem object
+    def read(file, types=None):
+        """Reads a message block from a file-like object. Only the bytes of
+        the block are read, so the file does not need to be seekable.
 
         Args:
-            file: Either the path to the file, a file-like object, or bytes.
+            file: A file-like object.
 
-            mode: An optional string that indicates which mode to open the file
+            types: Optional. A collection of message classes to decode. All
+                other messages are skipped without being decoded.
+        """
 
-        Returns:
-            An Lmp object constructed from the information read from the
-            file-like object.
+        # Offsets in errors are relative to the block if the file can not
+        # tell its position, e.g. a pipe
+        try:
+            offset = file.tell()
 
-        Raises:
-            ValueError: If an invalid file mode is given.
-        """
+        except OSError:
+            offset = 0
 
-        if mode not in ('r', 'w', 'a'):
-            raise ValueError("invalid mode: '%s'" % mode)
+        data = _read_block_data(file)
 
-        filemode = {'r': 'rb', 'w': 'w+b', 'a': 'r+b'}[mode]
+        if not data:
+            raise BadDemFile('Incomplete message block header at offset %i' % offset)
 
-        if isinstance(file, str):
-            file = io.open(file, filemode)
+        return MessageBlock._read(_MessageBuffer(data, base=offset), _message_readers_for(types))
 
-        elif isinstance(file, bytes):
-            file = io.BytesIO(file)
+    @staticmethod
+    def _read(buffer, readers=_message_readers, raw=False):
+        data = buffer.data
+        position = buffer.position
+        start_of_block = position
+        message_block = MessageBlock()
 
-        elif not hasattr(file, 'read'):
-            raise RuntimeError("Dem.open() requires 'file' to be a path, a file-like object, or bytes")
+        if position + _block_header_struct.size > len(data):
+            raise BadDemFile('Incomplete message block header at offset %i' % (buffer.base + position))
 
-        # Read
-        if mode == 'r':
-            return Dem._read_file(file, mode)
+        blocksize, pitch, yaw, roll = _block_header_struct.unpack_from(data, position)
+        message_block.view_angles = pitch, yaw, roll
 
-        # Write
-        elif mode == 'w':
-            dem = Dem()
-            dem.fp = file
-            dem.mode = 'w'
-            dem._did_modify = True
+        position += _block_header_struct.size
+        end_of_block = position + blocksize
 
-            return dem
+        if end_of_block > len(data):
+            raise BadDemFile('Incomplete message block at offset %i' % (buffer.base + start_of_block))
 
-        # Append
-        else:
-            dem = Dem._read_file(file, mode)
-            dem._did_modify = True
+        buffer.position = position
+        append = message_block.messages.append
 
-            return dem
+        # Fields are unpacked without checking the length first, so a
+        # message cut off by the end of the data is caught here instead
+        try:
+            if raw:
+                spans = []
 
-    @staticmethod
-    def _read_file(file, mode):
-        dem = Dem()
-        dem.mode = mode
-        dem.fp = file
+                while buffer.position < end_of_block:
+                    start = buffer.position
+                    message = readers[data[start]](buffer)
+                    state = None
 
-        # CD Track
-        dem.cd_track = _read_string(file, b'\n')
+                    if message is not None:
+                        append(message)
+                        state = _message_state(message)
 
-        # Message Blocks
-        while file.peek(4)[:4] != b'':
-            message_block = MessageBlock.read(file)
-            dem.message_blocks.append(message_block)
+                    spans.append((message, start - start_of_block, buffer.position - start_of_block, state))
 
-        return dem
+                messages = tuple(message_block.messages)
+                states = [span[3] for span in spans if span[0] is not None]
+                message_block._raw = bytes(data[start_of_block:end_of_block]), messages, states, spans
 
-    @staticmethod
-    def _write_file(file, dem):
-        _write_string(file, dem.cd_track, b'\n')
+            elif readers is _message_readers:
+                while buffer.position < end_of_block:
+                    append(readers[data[buffer.position]](buffer))
 
-        for message_block in dem.message_blocks:
-            MessageBlock.write(file, message_block)
+            else:
+                # Skipped messages return None
+                while buffer.position < end_of_block:
+                    message = readers[data[buffer.position]](buffer)
 
-    @staticmethod
-    def write(file, dem):
-        return Dem._write_file(file, dem)
+                    if message is not None:
+                        append(message)
 
-    def save(self, file):
-        """Writes Dem data to file
+        except (struct.error, IndexError):
+            raise BadDemFile('Truncated message in block at offset %i' % (buffer.base + start_of_block)) from None
 
-        Args:
-            file: Either the path to the file, or a file-like object, or bytes.
+        if buffer.position != end_of_block:
+            raise BadDemFile('Message overran the end of its block at offset %i' % (buffer.base + end_of_block))
 
-        Raises:
-            RuntimeError: If file argument is not a file-like object.
-        """
+        return message_block
 
-        should_close = False
 
-        if isinstance(file, str):
-            file = io.open(file, 'r+b')
-            should_close = True
+def _read_block_data(file):
+    """Returns the header and messages of the next message block in the given
+    file-like object, or empty bytes at the end of the file. The data is cut
+    short if the file ends inside the block, which MessageBlock._read()
+    reports.
+    """
 
-        elif isinstance(file, bytes):
-            file = io.BytesIO(file)
-            should_close = True
+    data = file.read(_block_header_struct.size)
 
-        elif not hasattr(file, 'write'):
-            raise RuntimeError(
-                "Dem.open() requires 'file' to be a path, a file-like object, "
-                "or bytes")
+    if len(data) < _block_header_struct.size:
+        return data
 
-        Dem._write_file(file, self)
+    block_size = _long_struct.unpack_from(data)[0]
 
-        if should_close:
-            file.close()
+    # A negative size is left for MessageBlock._read() to report
+    return data + file.read(max(block_size, 0))
 
-    def __enter__(self):
-        return self
 
-    def __exit__(self, type, value, traceback):
+def _map_demo(file):
+    """Returns the entire contents of a demo as a bytes-like object and a
+    function to release it. Real files are memory mapped so only the pages
+    that are touched get read.
+
+    Args:
+        file: Either the path to the file, a file-like object, or bytes.
+    """
+
+    if isinstance(file, (bytes, bytearray)):
+        return file, lambda: None
+
+    should_close = False
+
+    if isinstance(file, str):
+        file = io.open(file, 'rb')
+        should_close = True
+
+    elif not hasattr(file, 'read'):
+        raise RuntimeError("Expected 'file' to be a path, a file-like object, or bytes")
+
+    try:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        file.seek(0)
+        data = file.read()
+
+    if should_close:
+        file.close()
+
+    if isinstance(data, mmap.mmap):
+        return data, data.close
+
+    return data, lambda: None
+
+
+_index_header_struct = struct.Struct('<4s2IQ')
+
+
+class DemIndex(object):
+    """Class for representing a seek index of a demo
+
+    Records where each message block starts along with its time and the
+    client sign on state so that a demo can be entered at any block without
+    decoding the blocks before it. An index is built in a single pass that
+    only looks at block headers and Time messages, and can be saved next to
+    the demo as a sidecar file.
+
+    Example:
+        index = DemIndex.build('demo1.dem')
+        index.save('demo1.dem.idx')
+
+    Attributes:
+        size: The size in bytes of the indexed demo.
+
+        offsets: An array of the byte offset of each message block.
+
+        times: An array of the time of each message block. Blocks without a
+            Time message have the time of the previous block. Times restart
+            from zero with each level, see levels().
+
+        sign_ons: An array of the client sign on state after each block.
+    """
+
+    __slots__ = (
+        'size',
+        'offsets',
+        'times',
+        'sign_ons',
+        '_level_starts'
+    )
+
+    identity = b'IDEM'
+    version = 1
+
+    def __init__(self):
+        self.size = 0
+        self.offsets = array.array('q')
+        self.times = array.array('f')
+        self.sign_ons = array.array('B')
+        self._level_starts = [0]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @staticmethod
+    def build(file):
+        """Returns a DemIndex for the given demo
+
+        Args:
+            file: Either the path to the file, a file-like object, or bytes.
+
+        Raises:
+            BadDemFile: If the demo is truncated or malformed.
+        """
+
+        data, release = _map_demo(file)
+
+        try:
+            return DemIndex._build(data)
+
+        finally:
+            release()
+
+    @staticmethod
+    def _build(data):
+        index = DemIndex()
+        index.size = size = len(data)
+        offsets = index.offsets
+        times = index.times
+        sign_ons = index.sign_ons
+
+        position = data.find(b'\n') + 1
+
+        if not position:
+            raise BadDemFile('Missing cd track')
+
+        time = 0.0
+        sign_on = 0
+        readers = _message_readers_for((Time, SignOnNum, ServerInfo, UpdateEntity))
+
+        while position < size:
+            if position + _block_header_struct.size > size:
+                raise BadDemFile('Incomplete message block header at offset %i' % position)
+
+            start_of_messages = position + _block_header_struct.size
+            end_of_block = start_of_messages + _long_struct.unpack_from(data, position)[0]
+
+            if end_of_block > size:
+                raise BadDemFile('Incomplete message block at offset %i' % position)
+
+            # Connected clients receive a Time message at the start of every
+            # datagram, so there is nothing else to learn from these blocks.
+            if sign_on >= SIGNONS - 1 and end_of_block > start_of_messages and data[start_of_messages] == SVC_TIME:
+                time = _float_struct.unpack_from(data, start_of_messages + 1)[0]
+                sign_on = SIGNONS
+
+            else:
+                message_block = MessageBlock._read(_MessageBuffer(data, position), readers)
+
+                for message in message_block.messages:
+                    if isinstance(message, Time):
+                        time = message.time
+
+                    elif isinstance(message, SignOnNum):
+                        sign_on = message.sign_on
+
+                    elif isinstance(message, ServerInfo):
+                        sign_on = 0
+                        time = 0.0
+
+                    # The first entity update is the final sign on stage
+                    elif isinstance(message, UpdateEntity) and sign_on == SIGNONS - 1:
+                        sign_on = SIGNONS
+
+            offsets.append(position)
+            times.append(time)
+            sign_ons.append(sign_on)
+
+            position = end_of_block
+
+        index._find_levels()
+
+        return index
+
+    def _find_levels(self):
+        """Finds the first block of each level. A level starts wherever the
+        sign on state drops, which happens when a ServerInfo message is
+        received.
+        """
+
+        sign_ons = self.sign_ons
+        starts = [0]
+
+        for number in range(1, len(sign_ons)):
+            if sign_ons[number] < sign_ons[number - 1]:
+                starts.append(number)
+
+        self._level_starts = starts
+
+    def levels(self):
+        """Returns a list of the number of the first block of each level.
+        See _find_levels().
+        """
+
+        return list(self._level_starts)
+
+    def level_blocks(self, level=0):
+        """Returns the first block and the block just past the last block of
+        the given level.
+
+        Raises:
+            IndexError: If the demo has no such level.
+        """
+
+        starts = self._level_starts
+
+        if not 0 <= level < len(starts):
+            raise IndexError('Level %i is not in the demo' % level)
+
+        if level + 1 < len(starts):
+            return starts[level], starts[level + 1]
+
+        return starts[level], len(self)
+
+    def find(self, time, level=0):
+        """Returns the number of the first block at the given time. If no
+        block has exactly that time, the closest preceding block is used.
+
+        Args:
+            time: The time in seconds.
+
+            level: Optional. The number of the level, counting from zero.
+                Times restart with each level, so the same time can occur
+                once in every level.
+        """
+
+        times = self.times
+        first, end = self.level_blocks(level)
+        number = bisect.bisect_right(times, time, first, end) - 1
+
+        if number <= first:
+            return first
+
+        return bisect.bisect_left(times, times[number], first, number)
+
+    @staticmethod
+    def open(file):
+        """Returns a DemIndex object
+
+        Args:
+            file: Either the path to the file, a file-like object, or bytes.
+
+        Raises:
+            BadDemFile: If the file is not a valid index.
+        """
+
+        if isinstance(file, str):
+            with io.open(file, 'rb') as fp:
+                return DemIndex._read_file(fp)
+
+        elif isinstance(file, bytes):
+            return DemIndex._read_file(io.BytesIO(file))
+
+        elif not hasattr(file, 'read'):
+            raise RuntimeError("DemIndex.open() requires 'file' to be a path, a file-like object, or bytes")
+
+        return DemIndex._read_file(file)
+
+    @staticmethod
+    def _read_file(file):
+        data = file.read(_index_header_struct.size)
+
+        if len(data) < _index_header_struct.size:
+            raise BadDemFile('Incomplete index header')
+
+        identity, version, count, size = _index_header_struct.unpack(data)
+
+        if identity != DemIndex.identity or version != DemIndex.version:
+            raise BadDemFile('Bad index identity or version: %r %r' % (identity, version))
+
+        index = DemIndex()
+        index.size = size
+
+        try:
+            for column in index.offsets, index.times, index.sign_ons:
+                column.fromfile(file, count)
+
+        except EOFError:
+            raise BadDemFile('Incomplete index')
+
+        if sys.byteorder == 'big':
+            index.offsets.byteswap()
+            index.times.byteswap()
+
+        index._find_levels()
+
+        return index
+
+    def save(self, file):
+        """Writes the index to file
+
+        Args:
+            file: Either the path to the file, or a file-like object.
+        """
+
+        if isinstance(file, str):
+            with io.open(file, 'wb') as fp:
+                self._write_file(fp)
+
+        elif hasattr(file, 'write'):
+            self._write_file(file)
+
+        else:
+            raise RuntimeError("DemIndex.save() requires 'file' to be a path or a file-like object")
+
+    def _write_file(self, file):
+        header = _index_header_struct.pack(DemIndex.identity,
+                                           DemIndex.version,
+                                           len(self),
+                                           self.size)
+        file.write(header)
+
+        for column in self.offsets, self.times, self.sign_ons:
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column = array.array(column.typecode, column)
+                column.byteswap()
+
+            file.write(column.tobytes())
+
+
+def _demo_chunks(file, chunk_count):
+    """Splits the message blocks of a demo into about chunk_count runs of
+    roughly equal size and returns a source and a byte range for each, as
+    passed to _read_message_blocks().
+
+    Args:
+        file: A file-like object. Its read position will be changed.
+
+        chunk_count: The number of chunks to aim for.
+    """
+
+    # Block boundaries come from the size prefixes alone, nothing else is
+    # looked at since this pass is not shared between the workers
+    data, release = _map_demo(file)
+
+    try:
+        size = len(data)
+        position = data.find(b'\n') + 1
+        offsets = []
+
+        if not position:
+            raise BadDemFile('Missing cd track')
+
+        while position + _block_header_struct.size <= size:
+            offsets.append(position)
+            block_size = _long_struct.unpack_from(data, position)[0]
+
+            if block_size < 0:
+                raise BadDemFile('Bad message block size at offset %i' % position)
+
+            position += _block_header_struct.size + block_size
+
+    finally:
+        release()
+
+    # A truncated last block is left for the worker to report
+    if position < size:
+        offsets.append(position)
+
+    # Workers read their range from the file directly when possible
+    # rather than having the data sent to them.
+    name = getattr(file, 'name', None)
+    source = name if isinstance(name, str) and os.path.isfile(name) else None
+
+    if source is None:
+        file.seek(0)
+        data = file.read()
+
+    block_count = len(offsets)
+    offsets.append(size)
+    chunk_count = min(block_count, chunk_count)
+    chunk_size = size / max(chunk_count, 1)
+
+    ranges = []
+    first = 0
+
+    for i in range(1, chunk_count + 1):
+        last = bisect.bisect_left(offsets, offsets[0] + i * chunk_size, first + 1)
+        last = min(last, block_count)
+
+        if last > first:
+            ranges.append((offsets[first], offsets[last]))
+            first = last
+
+    if source is None:
+        sources = [data[start:end] for start, end in ranges]
+
+    else:
+        sources = [source] * len(ranges)
+
+    return sources, ranges
+
+
+def _read_message_blocks(source, start, end, types=None, raw=False, compact=False, function=None):
+    """Returns the message blocks in the given byte range, or the result
+    of function called with them. Used by worker processes when decoding in
+    parallel.
+
+    Args:
+        source: Either the path to the demo, or the bytes of the range.
+
+        start: The offset of the first block.
+
+        end: The offset just past the last block.
+
+        types: Optional. A collection of message classes to decode.
+
+        raw: If True, the bytes of each block are kept.
+
+        compact: If True, messages are decoded into tuples.
+
+        function: Optional. A function to call with the message blocks.
+    """
+
+    if isinstance(source, str):
+        with io.open(source, 'rb') as file:
+            file.seek(start)
+            source = file.read(end - start)
+
+    buffer = _MessageBuffer(source, base=start)
+    readers = _message_readers_for(types, compact)
+    message_blocks = []
+
+    while buffer.position < len(source):
+        message_blocks.append(MessageBlock._read(buffer, readers, raw))
+
+    if function is not None:
+        return function(message_blocks)
+
+    return message_blocks
+
+
+class _DemFollower(object):
+    """Iterator over the message blocks of a demo that is still being
+    written. See Dem.follow().
+    """
+
+    def __init__(self, file, types=None, interval=0.005, timeout=None):
+        self._should_close = False
+
+        if isinstance(file, str):
+            file = io.open(file, 'rb')
+            self._should_close = True
+
+        elif not hasattr(file, 'read'):
+            raise RuntimeError("Dem.follow() requires 'file' to be a path or a file-like object")
+
+        self.file = file
+        self.cd_track = None
+        self.interval = interval
+        self.timeout = timeout
+
+        # The Disconnect that ends a demo is always decoded so the end of the
+        # recording can be seen, but it is only kept if it was asked for.
+        self._keep_disconnect = types is None or Disconnect in types
+        self._readers = _message_readers_for(None if types is None else set(types) | {Disconnect})
+
+        self._data = bytearray()
+        self._position = 0
+        self._finished = False
+        self._last_data_time = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the file if it was opened from a path."""
+
+        if self._should_close and not self.file.closed:
+            self.file.close()
+
+        self._finished = True
+
+    def _read_available(self):
+        """Appends any newly written bytes. Returns True if there were any."""
+
+        data = self.file.read()
+
+        if not data:
+            return False
+
+        self._last_data_time = time.monotonic()
+
+        if self._position:
+            del self._data[:self._position]
+            self._position = 0
+
+        self._data += data
+
+        return True
+
+    def _next_block(self):
+        """Returns the next complete message block or None."""
+
+        data = self._data
+        position = self._position
+
+        if self.cd_track is None:
+            end = data.find(b'\n', position)
+
+            if end < 0:
+                return None
+
+            self.cd_track = data[position:end].decode('ascii')
+            self._position = position = end + 1
+
+        if len(data) - position < _block_header_struct.size:
+            return None
+
+        end_of_block = position + _block_header_struct.size + _long_struct.unpack_from(data, position)[0]
+
+        if end_of_block > len(data):
+            return None
+
+        message_block = MessageBlock._read(_MessageBuffer(data, position), self._readers)
+        self._position = end_of_block
+
+        if any(type(m) is Disconnect for m in message_block.messages):
+            self._finished = True
+
+            if not self._keep_disconnect:
+                message_block.messages = [m for m in message_block.messages if type(m) is not Disconnect]
+
+        return message_block
+
+    def _wait(self):
+        """Returns the next message block, the number of seconds to wait
+        before trying again, or raises StopIteration once no new data has
+        arrived for timeout seconds.
+        """
+
+        message_block = self._next_block()
+
+        if message_block is not None:
+            return message_block, 0
+
+        if self._finished:
+            self.close()
+            raise StopIteration
+
+        if self._read_available():
+            return None, 0
+
+        if self.timeout is not None and time.monotonic() - self._last_data_time >= self.timeout:
+            self.close()
+            raise StopIteration
+
+        return None, self.interval
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            message_block, delay = self._wait()
+
+            if message_block is not None:
+                return message_block
+
+            if delay:
+                time.sleep(delay)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        import asyncio
+
+        while True:
+            try:
+                message_block, delay = self._wait()
+
+            except StopIteration:
+                raise StopAsyncIteration
+
+            if message_block is not None:
+                return message_block
+
+            if delay:
+                await asyncio.sleep(delay)
+
+
+class Dem(object):
+    """Class for working with Dem files
+
+    Example:
+        d = Dem.open(file)
+
+    Attributes:
+        cd_track: The number of the cd track to play. The track will be '-1' if
+            no music.
+
+        message_blocks: A sequence of Message objects
+
+        index: A DemIndex used by seek(). One is built from the file on first
+            use if not given.
+
+        checkpoints: A demstate.Checkpoints used by state_at(). One is built
+            from the file on first use if not given.
+    """
+
+    def __init__(self):
+        self.fp = None
+        self.mode = None
+        self._did_modify = False
+
+        self.cd_track = '-1'
+        self.message_blocks = []
+        self.index = None
+        self.checkpoints = None
+
+    @staticmethod
+    def open(file, mode='r', lazy=False, types=None, processes=None, raw=False, compact=False):
+        """Returns a Dem object
+
+        Args:
+            file: Either the path to the file, a file-like object, or bytes.
+
+            mode: An optional string that indicates which mode to open the file
+
+            lazy: If True, message blocks are not read when opening. Use
+                seek() and iter_message_blocks() to decode them on demand.
+                Only supported in 'r' mode.
+
+            types: Optional. A collection of message classes to decode. All
+                other messages are skipped without being decoded. Only
+                supported in 'r' and 'a' modes. In 'a' mode the skipped
+                messages are written back unchanged.
+
+            processes: Optional. The number of worker processes used to
+                decode message blocks. By default blocks are decoded in this
+                process. Requires compact or types and mode 'r'. Every
+                decoded message is sent back to this process, and rebuilding
+                message objects costs more than decoding them, so workers
+                only help when they return far fewer objects than a full
+                decode: compact tuples take about half the time of decoding
+                and bound the speedup near 2x, and types only pay off when
+                they skip most messages. Use map_message_blocks() to reduce
+                the blocks in the workers instead, which scales with the
+                number of processes.
+
+            raw: If True, the bytes of each message block are kept so that
+                messages which are not changed are written back byte for
+                byte instead of being encoded again. Always on in 'a' mode.
+
+            compact: If True, messages are decoded into flat tuples instead
+                of message objects. The first item of each tuple is the
+                message id, or U_SIGNAL for UpdateEntity, and COMPACT_FIELDS
+                names the items that follow. Demos read this way can not be
+                written. Only supported in 'r' mode.
+
+        Returns:
+            An Lmp object constructed from the information read from the
+            file-like object.
+
+        Raises:
+            ValueError: If an invalid file mode or combination of options
+                is given.
+        """
+
+        if mode not in ('r', 'w', 'a'):
+            raise ValueError("invalid mode: '%s'" % mode)
+
+        if lazy and mode != 'r':
+            raise ValueError("lazy requires mode 'r'")
+
+        if types is not None and mode == 'w':
+            raise ValueError("types requires mode 'r' or 'a'")
+
+        if raw and mode == 'w':
+            raise ValueError("raw requires mode 'r' or 'a'")
+
+        if compact and mode != 'r':
+            raise ValueError("compact requires mode 'r'")
+
+        if compact and raw:
+            raise ValueError("compact can not be used with raw")
+
+        if processes is not None and mode != 'r':
+            raise ValueError("processes requires mode 'r'")
+
+        if processes is not None and not compact and types is None:
+            raise ValueError("processes requires compact or types")
+
+        # Reject unknown message types before a file is opened
+        if types is not None:
+            _message_readers_for(types, compact)
+
+        filemode = {'r': 'rb', 'w': 'w+b', 'a': 'r+b'}[mode]
+        opened = isinstance(file, str)
+
+        if opened:
+            file = io.open(file, filemode)
+
+        elif isinstance(file, bytes):
+            file = io.BytesIO(file)
+
+        elif not hasattr(file, 'read'):
+            raise RuntimeError("Dem.open() requires 'file' to be a path, a file-like object, or bytes")
+
+        try:
+            # Read
+            if mode == 'r':
+                if lazy:
+                    return Dem._read_header(file, mode)
+
+                if processes and processes > 1:
+                    return Dem._read_file_parallel(file, mode, types, processes, raw, compact)
+
+                return Dem._read_file(file, mode, types, raw, compact)
+
+            # Write
+            elif mode == 'w':
+                dem = Dem()
+                dem.fp = file
+                dem.mode = 'w'
+                dem._did_modify = True
+
+                return dem
+
+            # Append
+            else:
+                dem = Dem._read_file(file, mode, types, True)
+                dem._did_modify = True
+
+                return dem
+
+        except:
+            # Only close the file if it was opened here
+            if opened:
+                file.close()
+
+            raise
+
+    @staticmethod
+    def _read_file(file, mode, types=None, raw=False, compact=False):
+        dem = Dem()
+        dem.mode = mode
+        dem.fp = file
+
+        base = file.tell()
+        buffer = _MessageBuffer(file.read(), base=base)
+        end_of_data = len(buffer.data)
+
+        # CD Track
+        dem.cd_track = _read_string(buffer, b'\n')
+
+        # Message Blocks
+        readers = _message_readers_for(types, compact)
+
+        while buffer.position < end_of_data:
+            message_block = MessageBlock._read(buffer, readers, raw)
+            dem.message_blocks.append(message_block)
+
+        return dem
+
+    @staticmethod
+    def _read_file_parallel(file, mode, types, processes, raw=False, compact=False):
+        dem = Dem._read_header(file, mode)
+        sources, ranges = _demo_chunks(file, processes * 4)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            chunks = executor.map(_read_message_blocks,
+                                  sources,
+                                  [start for start, _ in ranges],
+                                  [end for _, end in ranges],
+                                  [types] * len(ranges),
+                                  [raw] * len(ranges),
+                                  [compact] * len(ranges))
+
+            for message_blocks in chunks:
+                dem.message_blocks.extend(message_blocks)
+
+        return dem
+
+    @staticmethod
+    def _read_header(file, mode):
+        dem = Dem()
+        dem.mode = mode
+        dem.fp = file
+
+        # CD Track
+        cd_track = file.readline()
+
+        if not cd_track.endswith(b'\n'):
+            raise BadDemFile('Missing cd track')
+
+        dem.cd_track = cd_track[:-1].decode('ascii')
+
+        return dem
+
+    def _get_index(self):
+        if self.index is None:
+            self.index = DemIndex.build(self.fp)
+
+        return self.index
+
+    def seek(self, time, level=0):
+        """Moves the read position to the first message block at the given
+        time.
+
+        Args:
+            time: The time in seconds.
+
+            level: Optional. The number of the level, counting from zero.
+
+        Returns:
+            The number of the block.
+        """
+
+        number = self._get_index().find(time, level)
+        self.seek_block(number)
+
+        return number
+
+    def seek_block(self, number):
+        """Moves the read position to the start of the given message block.
+
+        Args:
+            number: The number of the block.
+
+        Raises:
+            BadDemFile: If the index was not built from this file.
+        """
+
+        index = self._get_index()
+        self.fp.seek(0, io.SEEK_END)
+
+        if self.fp.tell() != index.size:
+            raise BadDemFile('Index does not match the demo file')
+
+        self.fp.seek(index.offsets[number])
+
+    def state_at(self, time, level=0):
+        """Returns the state of the world at the given time. At most one
+        checkpoint interval of message blocks is decoded.
+
+        Args:
+            time: The time in seconds.
+
+            level: Optional. The number of the level, counting from zero.
+
+        Returns:
+            A demstate.WorldState object.
+        """
+
+        from . import demstate
+
+        if self.checkpoints is None:
+            self.checkpoints = demstate.Checkpoints.build(self)
+
+        if self.index is None:
+            self.index = self.checkpoints.index
+
+        return self.checkpoints.state_at(self, time, level)
+
+    @staticmethod
+    def follow(file, types=None, interval=0.005, timeout=None):
+        """Returns an iterator over the message blocks of a demo that is still
+        being recorded. Each block is decoded as soon as all of its bytes have
+        been written, and a partial block waits until the rest of it arrives.
+        The file is never read from the start again.
+
+        The iterator also supports async for, which waits with asyncio.sleep()
+        instead of blocking. Iteration ends after the block with the final
+        Disconnect message, or once no new data has arrived for timeout
+        seconds.
+
+        Example:
+            for message_block in Dem.follow('demo1.dem'):
+                ...
+
+        Args:
+            file: Either the path to the file, or a file-like object.
+
+            types: Optional. A collection of message classes to decode. All
+                other messages are skipped without being decoded.
+
+            interval: The number of seconds to wait between checks for new
+                data.
+
+            timeout: Optional. The number of seconds to wait for new data
+                before giving up. Defaults to waiting forever.
+        """
+
+        return _DemFollower(file, types, interval, timeout)
+
+    def iter_message_blocks(self, types=None, raw=False, compact=False):
+        """Yields MessageBlock objects decoded from the current read position
+        to the end of the file.
+
+        Args:
+            types: Optional. A collection of message classes to decode. All
+                other messages are skipped without being decoded.
+
+            raw: If True, the bytes of each block are kept so unchanged
+                messages are written back byte for byte.
+
+            compact: If True, messages are decoded into tuples. See
+                Dem.open().
+
+        Raises:
+            BadDemFile: If a message block is truncated.
+        """
+
+        fp = self.fp
+        readers = _message_readers_for(types, compact)
+        offset = fp.tell()
+
+        while True:
+            data = _read_block_data(fp)
+
+            if not data:
+                return
+
+            yield MessageBlock._read(_MessageBuffer(data, base=offset), readers, raw)
+            offset += len(data)
+
+    @staticmethod
+    def _write_file(file, dem):
+        buffer = bytearray()
+        _write_string(buffer, dem.cd_track, b'\n')
+
+        # One buffer is reused for every block, flushed once it is large
+        # enough to make the write worthwhile.
+        for message_block in dem.message_blocks:
+            MessageBlock._write(buffer, message_block)
+
+            if len(buffer) >= _write_buffer_size:
+                file.write(buffer)
+                del buffer[:]
+
+        file.write(buffer)
+
+    @staticmethod
+    def write(file, dem):
+        return Dem._write_file(file, dem)
+
+    def save(self, file):
+        """Writes Dem data to file
+
+        Args:
+            file: Either the path to the file, or a file-like object, or bytes.
+
+        Raises:
+            RuntimeError: If file argument is not a file-like object.
+        """
+
+        should_close = False
+
+        if isinstance(file, str):
+            file = io.open(file, 'r+b')
+            should_close = True
+
+        elif isinstance(file, bytes):
+            file = io.BytesIO(file)
+            should_close = True
+
+        elif not hasattr(file, 'write'):
+            raise RuntimeError(
+                "Dem.open() requires 'file' to be a path, a file-like object, "
+                "or bytes")
+
+        Dem._write_file(file, self)
+
+        if should_close:
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
         self.close()
 
     def close(self):
@@ -2027,3 +3642,352 @@ class Dem(object):
         file_object = self.fp
         self.fp = None
         file_object.close()
+
+
+def map_message_blocks(file, function, processes=None, types=None, compact=False):
+    """Calls function with the message blocks of each chunk of a demo in a
+    worker process and returns the results in the order of the chunks.
+
+    The demo is split into chunks of whole blocks without decoding it. Only
+    the results of function are sent back, so unlike
+    Dem.open(processes=...) this keeps scaling with the number of processes.
+    Each call only sees the blocks of one chunk, so function should compute
+    something that can be combined afterwards, like a count.
+
+    Example:
+        counts = map_message_blocks('demo1.dem', len)
+        block_count = sum(counts)
+
+    Args:
+        file: Either the path to the file, a file-like object, or bytes.
+
+        function: A function that takes a list of MessageBlock objects. It
+            must be picklable, so a module level function.
+
+        processes: Optional. The number of worker processes. Defaults to the
+            number of CPUs.
+
+        types: Optional. A collection of message classes to decode. All
+            other messages are skipped without being decoded.
+
+        compact: If True, messages are decoded into tuples. See Dem.open().
+
+    Raises:
+        BadDemFile: If a demo is truncated or malformed.
+    """
+
+    # Reject unknown message types before a file is opened
+    if types is not None:
+        _message_readers_for(types, compact)
+
+    processes = processes or os.cpu_count() or 1
+
+    if isinstance(file, str):
+        with io.open(file, 'rb') as fp:
+            sources, ranges = _demo_chunks(fp, processes * 4)
+
+    elif isinstance(file, bytes):
+        sources, ranges = _demo_chunks(io.BytesIO(file), processes * 4)
+
+    elif hasattr(file, 'read'):
+        sources, ranges = _demo_chunks(file, processes * 4)
+
+    else:
+        raise RuntimeError("map_message_blocks() requires 'file' to be a path, a file-like object, or bytes")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_read_message_blocks,
+                                 sources,
+                                 [start for start, _ in ranges],
+                                 [end for _, end in ranges],
+                                 [types] * len(ranges),
+                                 [False] * len(ranges),
+                                 [compact] * len(ranges),
+                                 [function] * len(ranges)))
+
+
+def _demo_segments(data, index):
+    """Returns the sign on blocks and gameplay blocks of the first level of
+    a demo as (sign_on_end, gameplay_start, gameplay_end) block numbers. The
+    sign on blocks are [0, sign_on_end). A trailing Disconnect block is not
+    counted as gameplay.
+    """
+
+    sign_ons = index.sign_ons
+    count = len(index)
+    sign_on_end = 0
+
+    while sign_on_end < count and sign_ons[sign_on_end] < SIGNONS:
+        sign_on_end += 1
+
+    gameplay_end = sign_on_end
+
+    while gameplay_end < count and sign_ons[gameplay_end] == SIGNONS:
+        gameplay_end += 1
+
+    if gameplay_end > sign_on_end and _block_starts_with(data, index, gameplay_end - 1, SVC_DISCONNECT):
+        gameplay_end -= 1
+
+    return sign_on_end, sign_on_end, gameplay_end
+
+
+# Time between demos joined by splice() when neither has two gameplay blocks
+# with different times. The default cl_maxfps is 72.
+_default_frame_interval = 1 / 72
+
+
+def _frame_interval(times, first, last):
+    """Returns the last positive time between consecutive gameplay blocks
+    in [first, last), or None if there is none."""
+
+    for number in range(last - 1, first, -1):
+        interval = times[number] - times[number - 1]
+
+        if interval > 0:
+            return interval
+
+    return None
+
+
+def _block_end(index, number):
+    if number + 1 < len(index):
+        return index.offsets[number + 1]
+
+    return index.size
+
+
+def _block_starts_with(data, index, number, message_id):
+    start_of_messages = index.offsets[number] + _block_header_struct.size
+    return start_of_messages < _block_end(index, number) and data[start_of_messages] == message_id
+
+
+class _DemoWriter(object):
+    """Copies raw message blocks to a file-like object, optionally shifting
+    their times, through one reused buffer.
+    """
+
+    __slots__ = ('file', 'buffer', 'view_angles')
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = bytearray()
+        self.view_angles = 0, 0, 0
+
+    def write_cd_track(self, data):
+        self.buffer += data[:data.find(b'\n') + 1]
+
+    def copy(self, data, index, first, last, time_offset=0.0):
+        """Copies blocks [first, last) and subtracts time_offset from their
+        Time messages.
+        """
+
+        if first >= last:
+            return
+
+        buffer = self.buffer
+        offsets = index.offsets
+        header_size = _block_header_struct.size
+        self.view_angles = _block_header_struct.unpack_from(data, offsets[last - 1])[1:]
+
+        if not time_offset:
+            buffer += data[offsets[first]:_block_end(index, last - 1)]
+            self.flush()
+            return
+
+        for number in range(first, last):
+            start = offsets[number]
+            end = offsets[number + 1] if number + 1 < len(offsets) else index.size
+            start_of_messages = len(buffer) + header_size
+
+            # Blocks sent while connected begin with a Time message, which
+            # can be patched in place.
+            if start + header_size < end and data[start + header_size] == SVC_TIME:
+                buffer += data[start:end]
+                time = _float_struct.unpack_from(buffer, start_of_messages + 1)[0]
+                _float_struct.pack_into(buffer, start_of_messages + 1, time - time_offset)
+
+            else:
+                message_block = MessageBlock._read(_MessageBuffer(data, start))
+
+                for message in message_block.messages:
+                    if isinstance(message, Time):
+                        message.time -= time_offset
+
+                MessageBlock._write(buffer, message_block)
+
+            if len(buffer) >= _write_buffer_size:
+                self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        del self.buffer[:]
+
+    def close(self):
+        """Ends the demo with a Disconnect block."""
+
+        message_block = MessageBlock()
+        message_block.view_angles = self.view_angles
+        message_block.messages.append(Disconnect())
+        MessageBlock._write(self.buffer, message_block)
+        self.flush()
+
+
+def _open_output(output, files=()):
+    if isinstance(output, str):
+        # Truncating a demo that is memory mapped for reading can crash the
+        # process or copy garbage
+        for file in files:
+            if isinstance(file, str) and os.path.exists(output) and os.path.samefile(file, output):
+                raise ValueError('Can not write over the input demo %r' % file)
+
+        return io.open(output, 'wb'), True
+
+    if not hasattr(output, 'write'):
+        raise RuntimeError("Expected 'output' to be a path or a file-like object")
+
+    return output, False
+
+
+def cut(file, output, start=0.0, end=None):
+    """Writes the part of a demo between two times to a new demo.
+
+    The sign on blocks, which hold the server info, baselines and static
+    entities, are kept. Gameplay blocks outside of the range are dropped and
+    the times of the kept blocks are shifted so the clip starts right after
+    sign on. Blocks are copied as raw bytes without being decoded.
+
+    Only the first level of a demo is cut.
+
+    Args:
+        file: Either the path to the demo, a file-like object, or bytes.
+
+        output: Either the path to the new demo or a writable file-like
+            object. The file does not need to be seekable.
+
+        start: The time of the first gameplay block to keep.
+
+        end: Optional. The time of the last gameplay block to keep. Defaults
+            to the end of the demo.
+
+    Raises:
+        BadDemFile: If the demo is truncated or malformed.
+
+        ValueError: If output is the same file as file.
+    """
+
+    data, release = _map_demo(file)
+    should_close = False
+
+    try:
+        output, should_close = _open_output(output, (file,))
+        index = DemIndex._build(data)
+        sign_on_end, first, last = _demo_segments(data, index)
+        times = index.times
+
+        while first < last and times[first] < start:
+            first += 1
+
+        if end is not None:
+            while last > first and times[last - 1] > end:
+                last -= 1
+
+        writer = _DemoWriter(output)
+        writer.write_cd_track(data)
+        writer.copy(data, index, 0, sign_on_end)
+
+        if first < last:
+            writer.copy(data, index, first, last, times[first] - times[sign_on_end])
+
+        writer.close()
+
+    finally:
+        release()
+
+        if should_close:
+            output.close()
+
+
+def splice(files, output):
+    """Joins demos of the same map into one demo.
+
+    The sign on blocks of the first demo are kept and the gameplay blocks of
+    every demo follow in order, with times shifted so each demo continues
+    one frame after the previous one ended. Blocks are copied as raw bytes
+    without being decoded.
+
+    Args:
+        files: A sequence of paths, file-like objects, or bytes.
+
+        output: Either the path to the new demo or a writable file-like
+            object. The file does not need to be seekable.
+
+    Raises:
+        BadDemFile: If a demo is truncated or malformed.
+
+        ValueError: If the demos are not of the same map, or output is the
+            same file as one of them.
+    """
+
+    files = list(files)
+    output, should_close = _open_output(output, files)
+
+    try:
+        writer = _DemoWriter(output)
+        server_info = None
+        time = None
+        interval = None
+
+        for number, file in enumerate(files):
+            data, release = _map_demo(file)
+
+            try:
+                index = DemIndex._build(data)
+                sign_on_end, first, last = _demo_segments(data, index)
+                info = _server_info(data, index, sign_on_end)
+
+                if server_info is None:
+                    server_info = info
+                    writer.write_cd_track(data)
+                    writer.copy(data, index, 0, sign_on_end)
+
+                elif info != server_info:
+                    raise ValueError('Demo %i is not of map %r' % (number, server_info[0]))
+
+                if first < last:
+                    times = index.times
+                    time_offset = 0.0
+
+                    # Leave a frame between the demos so time keeps increasing
+                    if time is not None:
+                        interval = interval or _frame_interval(times, first, last) or _default_frame_interval
+                        time_offset = times[first] - (time + interval)
+
+                    writer.copy(data, index, first, last, time_offset)
+                    time = times[last - 1] - time_offset
+                    interval = _frame_interval(times, first, last)
+
+            finally:
+                release()
+
+        if server_info is None:
+            raise ValueError('No demos to splice')
+
+        writer.close()
+
+    finally:
+        if should_close:
+            output.close()
+
+
+def _server_info(data, index, sign_on_end):
+    """Returns the map name and model table of the first level."""
+
+    readers = _message_readers_for((ServerInfo,))
+
+    for number in range(sign_on_end):
+        message_block = MessageBlock._read(_MessageBuffer(data, index.offsets[number]), readers)
+
+        for message in message_block.messages:
+            return message.map_name, tuple(message.models)
+
+    raise BadDemFile('Missing server info')
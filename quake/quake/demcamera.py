@@ -0,0 +1,355 @@
+"""This module provides camera path extraction for Quake DEM demo files.
+
+Example:
+    with dem.Dem.open('demo1.dem', types=demcamera.CameraPath.types) as dem_file:
+        path = demcamera.CameraPath.build(dem_file.message_blocks)
+
+    keys = path.resample(24).simplify(1.0, 0.5)
+
+References:
+    Quake Source
+    - id Software
+    - https://github.com/id-Software/Quake
+"""
+
+import array
+import math
+
+from . import dem
+from . import demstate
+
+
+__all__ = ['CameraPath']
+
+
+# The view height used by the client when ClientData does not send one
+DEFAULT_VIEWHEIGHT = 22
+
+
+class CameraPath(object):
+    """Class for representing the camera path of a demo
+
+    The path has a row for each frame of a level in which the view entity
+    was sent, in increasing time order. Every column is a typed array which can be wrapped
+    without copying, e.g. numpy.frombuffer(path.origin, dtype='f4'). Origins
+    and angles are interleaved x, y, z and pitch, yaw, roll triples.
+
+    Example:
+        path = CameraPath.build(dem_file.message_blocks)
+        path = path.resample(30).simplify(0.5)
+
+    Attributes:
+        time: The time of the frame.
+
+        origin: The eye position, which is the origin of the view entity
+            raised by the view height.
+
+        angles: The view angles in degrees.
+    """
+
+    # The message types needed to build a CameraPath
+    types = demstate.WorldState.types + (dem.ClientData,)
+
+    __slots__ = (
+        'time',
+        'origin',
+        'angles'
+    )
+
+    def __init__(self):
+        self.time = array.array('f')
+        self.origin = array.array('f')
+        self.angles = array.array('f')
+
+    def __len__(self):
+        return len(self.time)
+
+    @staticmethod
+    def build(message_blocks, world_state=None, level=0):
+        """Returns the CameraPath of a level for the given message blocks.
+        See build_levels() for how frames are chosen.
+
+        Args:
+            message_blocks: An iterable of MessageBlock objects.
+
+            world_state: Optional. The WorldState to apply the blocks to.
+
+            level: Optional. The number of the level, counting from zero.
+
+        Raises:
+            IndexError: If the blocks have no such level.
+        """
+
+        paths = CameraPath.build_levels(message_blocks, world_state)
+
+        if not 0 <= level < len(paths):
+            raise IndexError('Level %i is not in the demo' % level)
+
+        return paths[level]
+
+    @staticmethod
+    def build_levels(message_blocks, world_state=None):
+        """Returns a list of CameraPath objects for the given message blocks,
+        one for each level. A level starts with each ServerInfo message after
+        the first block, and times restart from zero with it.
+
+        Frames with a time not after the previous frame of the level are
+        dropped, as are frames the view entity was not sent in. View angles
+        that are not finite are replaced by the previous ones.
+
+        Args:
+            message_blocks: An iterable of MessageBlock objects.
+
+            world_state: Optional. The WorldState to apply the blocks to.
+        """
+
+        path = CameraPath()
+        paths = [path]
+
+        if world_state is None:
+            world_state = demstate.WorldState()
+
+        view_height = DEFAULT_VIEWHEIGHT
+        angles = 0.0, 0.0, 0.0
+        last_time = -math.inf
+        first = 0
+
+        for number, message_block in enumerate(message_blocks):
+            world_state.apply(message_block)
+
+            for message in message_block.messages:
+                message_type = type(message)
+
+                if message_type is dem.ClientData:
+                    view_height = message.view_height if message.bit_mask & dem.SU_VIEWHEIGHT else DEFAULT_VIEWHEIGHT
+
+                elif message_type is dem.ServerInfo and number > first:
+                    first = number
+                    path = CameraPath()
+                    paths.append(path)
+                    view_height = DEFAULT_VIEWHEIGHT
+                    last_time = -math.inf
+
+            if all(map(math.isfinite, message_block.view_angles)):
+                angles = message_block.view_angles
+
+            entity = world_state.view_entity
+
+            if world_state.time <= last_time or entity not in world_state.updated:
+                continue
+
+            x, y, z = world_state.entities.origin[3 * entity:3 * entity + 3]
+            path.append(world_state.time, (x, y, z + view_height), angles)
+            last_time = world_state.time
+
+        return paths
+
+    def append(self, time, origin, angles):
+        """Adds a row to the end of the path.
+
+        Args:
+            time: The time of the frame. Must be after the last row.
+
+            origin: The eye position as an x, y, z triple.
+
+            angles: The view angles as a pitch, yaw, roll triple.
+        """
+
+        self.time.append(time)
+        self.origin.extend(origin)
+        self.angles.extend(angles)
+
+    def unwrap(self):
+        """Returns a copy of the path with continuous angles.
+
+        Each angle is moved by a multiple of 360 degrees so that it is within
+        180 degrees of the previous one. This keeps interpolation from
+        spinning the long way around when the yaw wraps from 359 to 0.
+        """
+
+        path = self._copy()
+        angles = path.angles
+
+        for i in range(3, len(angles)):
+            delta = angles[i] - angles[i - 3]
+
+            if delta > 180 or delta < -180:
+                angles[i] -= 360 * round(delta / 360)
+
+        return path
+
+    def resample(self, rate, start=None, end=None):
+        """Returns the path sampled at a fixed frame rate.
+
+        Rows are linearly interpolated between the surrounding frames, with
+        angles unwrapped first.
+
+        Args:
+            rate: The number of samples per second.
+
+            start: Optional. The time of the first sample. Defaults to the
+                time of the first row.
+
+            end: Optional. The time after which to stop. Defaults to the
+                time of the last row.
+        """
+
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        source = self.unwrap()
+        path = CameraPath()
+
+        if not len(source):
+            return path
+
+        times = source.time
+        origin = source.origin
+        angles = source.angles
+        start = times[0] if start is None else start
+        end = times[-1] if end is None else end
+        last = len(times) - 1
+        i = 0
+
+        for n in range(int(math.floor((end - start) * rate + 1e-6)) + 1):
+            time = start + n / rate
+
+            while i < last and times[i + 1] <= time:
+                i += 1
+
+            if i == last or time <= times[i]:
+                j = i
+                t = 0.0
+
+            else:
+                j = i + 1
+                t = (time - times[i]) / (times[j] - times[i])
+
+            a = 3 * i
+            b = 3 * j
+
+            path.time.append(time)
+            path.origin.extend((origin[a] + (origin[b] - origin[a]) * t,
+                                origin[a + 1] + (origin[b + 1] - origin[a + 1]) * t,
+                                origin[a + 2] + (origin[b + 2] - origin[a + 2]) * t))
+            path.angles.extend((angles[a] + (angles[b] - angles[a]) * t,
+                                angles[a + 1] + (angles[b + 1] - angles[a + 1]) * t,
+                                angles[a + 2] + (angles[b + 2] - angles[a + 2]) * t))
+
+        return path
+
+    def simplify(self, tolerance, angle_tolerance=None, window=512):
+        """Returns the path reduced to keyframes with Douglas-Peucker.
+
+        A row is dropped if linear interpolation in time between the kept
+        rows around it reproduces it within the given error bounds, so
+        keyframes can be interpolated linearly to recover the path. Angles
+        should be unwrapped first, which resample() already does.
+
+        The path is reduced in windows of at most window rows whose ends are
+        always kept. This bounds the cost of paths with many cuts, which
+        would otherwise split one row at a time.
+
+        Args:
+            tolerance: The largest allowed distance from the original eye
+                position in world units.
+
+            angle_tolerance: Optional. The largest allowed difference in any
+                view angle in degrees. Defaults to tolerance.
+
+            window: Optional. The most rows reduced at once. Must be at
+                least 2.
+        """
+
+        if angle_tolerance is None:
+            angle_tolerance = tolerance
+
+        if tolerance <= 0 or angle_tolerance <= 0:
+            raise ValueError('tolerances must be positive')
+
+        if window < 2:
+            raise ValueError('window must be at least 2')
+
+        count = len(self)
+
+        if count < 3:
+            return self._copy()
+
+        times = self.time
+
+        # Scale the columns so that an error above one exceeds the bounds
+        scale = 1 / tolerance
+        angle_scale = 1 / angle_tolerance
+        xs = [v * scale for v in self.origin[0::3]]
+        ys = [v * scale for v in self.origin[1::3]]
+        zs = [v * scale for v in self.origin[2::3]]
+        ps = [v * angle_scale for v in self.angles[0::3]]
+        ws = [v * angle_scale for v in self.angles[1::3]]
+        rs = [v * angle_scale for v in self.angles[2::3]]
+
+        keep = bytearray(count)
+        stack = [(i, min(i + window, count - 1)) for i in range(0, count - 1, window)]
+
+        while stack:
+            first, last = stack.pop()
+            keep[first] = keep[last] = 1
+
+            if last - first < 2:
+                continue
+
+            t0 = times[first]
+            duration = times[last] - t0
+            inverse = 1 / duration if duration else 0.0
+            x0, y0, z0, p0, w0, r0 = xs[first], ys[first], zs[first], ps[first], ws[first], rs[first]
+            vx = (xs[last] - x0) * inverse
+            vy = (ys[last] - y0) * inverse
+            vz = (zs[last] - z0) * inverse
+            vp = (ps[last] - p0) * inverse
+            vw = (ws[last] - w0) * inverse
+            vr = (rs[last] - r0) * inverse
+            worst = 1.0
+            split = None
+            k = first
+
+            for t, x, y, z, p, w, r in zip(times[first + 1:last],
+                                           xs[first + 1:last],
+                                           ys[first + 1:last],
+                                           zs[first + 1:last],
+                                           ps[first + 1:last],
+                                           ws[first + 1:last],
+                                           rs[first + 1:last]):
+                k += 1
+                t -= t0
+                dx = x0 + vx * t - x
+                dy = y0 + vy * t - y
+                dz = z0 + vz * t - z
+                dp = p0 + vp * t - p
+                dw = w0 + vw * t - w
+                dr = r0 + vr * t - r
+                error = max(dx * dx + dy * dy + dz * dz, dp * dp, dw * dw, dr * dr)
+
+                if error > worst:
+                    worst = error
+                    split = k
+
+            if split is not None:
+                stack.append((split, last))
+                stack.append((first, split))
+
+        path = CameraPath()
+        origin = self.origin
+        angles = self.angles
+
+        for k in range(count):
+            if keep[k]:
+                path.append(times[k], origin[3 * k:3 * k + 3], angles[3 * k:3 * k + 3])
+
+        return path
+
+    def _copy(self):
+        path = CameraPath()
+        path.time = array.array('f', self.time)
+        path.origin = array.array('f', self.origin)
+        path.angles = array.array('f', self.angles)
+
+        return path
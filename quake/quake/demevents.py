@@ -0,0 +1,462 @@
+"""This module provides an event timeline index for Quake DEM demo files.
+
+Example:
+    with dem.Dem.open('demo1.dem', types=demevents.EventIndex.types) as dem_file:
+        events = demevents.EventIndex.build(dem_file.message_blocks)
+
+    frags = events.query(dem.UpdateFrags, key=3, start=60, end=120, level=0)
+
+References:
+    Quake Source
+    - id Software
+    - https://github.com/id-Software/Quake
+"""
+
+import array
+import bisect
+import io
+import struct
+import sys
+
+from . import dem
+
+
+__all__ = ['EventIndex']
+
+
+# The message types recorded as events and how each one is keyed. Text
+# messages are keyed by their text, the others by a number with an optional
+# value.
+_text_events = (dem.Print, dem.CenterPrint, dem.StuffText)
+_event_types = _text_events + (dem.Sound, dem.UpdateFrags, dem.KilledMonster, dem.FoundSecret)
+
+_event_ids = {t: i for i, t in enumerate(_event_types)}
+
+# The key stored for events that are not keyed by a number
+_NO_KEY = -1
+
+_event_index_header_struct = struct.Struct('<4sIII')
+
+
+class _GroupTimes(object):
+    """A sequence view of the times of a run of events in sorted order, so
+    that the run can be searched with bisect. A run never spans more than
+    one level, so its times never restart.
+    """
+
+    __slots__ = ('times', 'order', 'start', 'end')
+
+    def __init__(self, times, order, start, end):
+        self.times = times
+        self.order = order
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        return self.times[self.order[self.start + index]]
+
+
+class EventIndex(object):
+    """Class for representing a timeline of demo events
+
+    Records a row for each Print, CenterPrint, StuffText, Sound, UpdateFrags,
+    KilledMonster and FoundSecret message. Every column is a typed array in
+    level and time order, and a second ordering by level, event type, key
+    and time lets queries for a single type or key skip straight to their
+    events.
+
+    Events are keyed as follows:
+        Print, CenterPrint, StuffText: The text.
+
+        Sound: The sound number. The value is the entity.
+
+        UpdateFrags: The player number. The value is the frag count.
+
+        KilledMonster, FoundSecret: No key.
+
+    Attributes:
+        level: The number of the level, counting from zero. A level starts
+            with each ServerInfo message after the first block.
+
+        time: The time of the frame. Times restart from zero with each
+            level.
+
+        block: The number of the message block.
+
+        event_type: The number of the message type, see event_types.
+
+        key: The numeric key, or -1 for text and unkeyed events.
+
+        value: The value for Sound and UpdateFrags events, otherwise 0.
+    """
+
+    # The message types recorded as events, numbered by position
+    event_types = _event_types
+
+    # The message types needed to build an EventIndex
+    types = (dem.Time, dem.ServerInfo) + _event_types
+
+    identity = b'EDEM'
+    version = 2
+
+    __slots__ = (
+        'level',
+        'time',
+        'block',
+        'event_type',
+        'key',
+        'value',
+        '_text_offsets',
+        '_text',
+        '_order',
+        '_ranges'
+    )
+
+    def __init__(self):
+        self.level = array.array('H')
+        self.time = array.array('f')
+        self.block = array.array('I')
+        self.event_type = array.array('B')
+        self.key = array.array('i')
+        self.value = array.array('i')
+        self._text_offsets = array.array('I', [0])
+        self._text = bytearray()
+        self._order = None
+        self._ranges = None
+
+    def __len__(self):
+        return len(self.block)
+
+    def __getitem__(self, number):
+        """Returns an event as a (time, block, message_type, key, value)
+        tuple.
+        """
+
+        message_type = _event_types[self.event_type[number]]
+
+        if message_type in _text_events:
+            key = self.text(number)
+
+        else:
+            key = self.key[number] if self.key[number] != _NO_KEY else None
+
+        return self.time[number], self.block[number], message_type, key, self.value[number]
+
+    def text(self, number):
+        """Returns the text of an event, or an empty string."""
+
+        start = self._text_offsets[number]
+        end = self._text_offsets[number + 1]
+
+        return self._text[start:end].decode('ascii')
+
+    @staticmethod
+    def build(message_blocks):
+        """Returns an EventIndex for the given message blocks
+
+        Args:
+            message_blocks: An iterable of MessageBlock objects. Other
+                messages are ignored, so the blocks can be decoded with
+                types=EventIndex.types.
+        """
+
+        events = EventIndex()
+        level = 0
+        first = 0
+        time = 0.0
+
+        for number, message_block in enumerate(message_blocks):
+            for message in message_block.messages:
+                message_type = type(message)
+
+                if message_type is dem.Time:
+                    time = message.time
+
+                elif message_type is dem.ServerInfo:
+                    if number > first:
+                        level += 1
+                        first = number
+
+                    time = 0.0
+
+                elif message_type in _event_ids:
+                    events.append(number, time, message, level)
+
+        return events
+
+    def append(self, block, time, message, level=0):
+        """Adds an event for the given message. Events must be added in
+        level and time order.
+
+        Args:
+            block: The number of the message block.
+
+            time: The time of the frame.
+
+            message: A message of one of the event types.
+
+            level: Optional. The number of the level.
+        """
+
+        message_type = type(message)
+        key = _NO_KEY
+        value = 0
+
+        if message_type in _text_events:
+            self._text += message.text.encode('ascii')
+
+        elif message_type is dem.Sound:
+            key = message.sound_number
+            value = message.entity
+
+        elif message_type is dem.UpdateFrags:
+            key = message.player
+            value = message.frags
+
+        self.level.append(level)
+        self.time.append(time)
+        self.block.append(block)
+        self.event_type.append(_event_ids[message_type])
+        self.key.append(key)
+        self.value.append(value)
+        self._text_offsets.append(len(self._text))
+
+        self._order = None
+        self._ranges = None
+
+    def _sort(self):
+        """Builds the ordering by level, event type, key and time."""
+
+        level = self.level
+        event_type = self.event_type
+        key = self.key
+
+        # Rows are already in time order and the sort is stable
+        self._order = array.array('I', sorted(range(len(self)), key=lambda i: (level[i], event_type[i], key[i])))
+        self._find_ranges()
+
+    def _find_ranges(self):
+        """Finds where each level, event type and key starts and ends in
+        the ordering.
+        """
+
+        ranges = {}
+        previous = None
+
+        for position, number in enumerate(self._order):
+            group = self.level[number], self.event_type[number], self.key[number]
+
+            if group != previous:
+                if previous is not None:
+                    ranges[previous] = ranges[previous], position
+
+                ranges[group] = position
+                previous = group
+
+        if previous is not None:
+            ranges[previous] = ranges[previous], len(self._order)
+
+        self._ranges = ranges
+
+    def levels(self):
+        """Returns the number of levels with events."""
+
+        return self.level[-1] + 1 if len(self) else 0
+
+    def query(self, message_type=None, key=None, start=None, end=None, contains=None, level=None):
+        """Returns the events matching all of the given conditions in level
+        and time order. See __getitem__() for the layout of each event.
+
+        Args:
+            message_type: Optional. Only events of this message class.
+
+            key: Optional. Only events with this key. Requires message_type.
+
+            start: Optional. Only events at or after this time.
+
+            end: Optional. Only events at or before this time.
+
+            contains: Optional. Only events whose text contains this string.
+
+            level: Optional. Only events in this level, counting from zero.
+                Times restart with each level, so start and end apply to
+                every level when no level is given.
+        """
+
+        return [self[n] for n in self.select(message_type, key, start, end, contains, level)]
+
+    def select(self, message_type=None, key=None, start=None, end=None, contains=None, level=None):
+        """Returns the row numbers of the events matching all of the given
+        conditions in level and time order. See query() for the arguments.
+        """
+
+        if key is not None and message_type is None:
+            raise ValueError('key requires message_type')
+
+        levels = range(self.levels()) if level is None else [level]
+
+        if message_type is None:
+            times = self.time
+            numbers = []
+
+            for level in levels:
+                level_start = bisect.bisect_left(self.level, level)
+                level_end = bisect.bisect_right(self.level, level)
+
+                first = level_start if start is None else bisect.bisect_left(times, start, level_start, level_end)
+                last = level_end if end is None else bisect.bisect_right(times, end, level_start, level_end)
+                numbers.extend(range(first, last))
+
+        else:
+            if message_type not in _event_ids:
+                raise ValueError('Not an event type: %r' % message_type)
+
+            if self._order is None:
+                self._sort()
+
+            event_type = _event_ids[message_type]
+            text_key = None
+
+            if message_type in _text_events:
+                text_key, key = key, None
+
+            if key is not None:
+                groups = [(level, event_type, key) for level in levels]
+
+            else:
+                groups = sorted(g for g in self._ranges if g[1] == event_type and g[0] in levels)
+
+            numbers = []
+
+            for group in groups:
+                if group not in self._ranges:
+                    continue
+
+                group_start, group_end = self._ranges[group]
+                times = _GroupTimes(self.time, self._order, group_start, group_end)
+                first = 0 if start is None else bisect.bisect_left(times, start)
+                last = len(times) if end is None else bisect.bisect_right(times, end)
+                numbers.extend(self._order[group_start + first:group_start + last])
+
+            if len(groups) > 1:
+                numbers.sort()
+
+            if text_key is not None:
+                numbers = [n for n in numbers if self.text(n) == text_key]
+
+        if contains is not None:
+            numbers = [n for n in numbers if contains in self.text(n)]
+
+        return list(numbers)
+
+    @staticmethod
+    def open(file):
+        """Returns an EventIndex object
+
+        Args:
+            file: Either the path to the file, a file-like object, or bytes.
+
+        Raises:
+            BadDemFile: If the file is not a valid event index.
+        """
+
+        if isinstance(file, str):
+            with io.open(file, 'rb') as fp:
+                return EventIndex._read_file(fp)
+
+        elif isinstance(file, bytes):
+            return EventIndex._read_file(io.BytesIO(file))
+
+        elif not hasattr(file, 'read'):
+            raise RuntimeError("EventIndex.open() requires 'file' to be a path, a file-like object, or bytes")
+
+        return EventIndex._read_file(file)
+
+    @staticmethod
+    def _read_file(file):
+        data = file.read(_event_index_header_struct.size)
+
+        if len(data) < _event_index_header_struct.size:
+            raise dem.BadDemFile('Incomplete event index header')
+
+        identity, version, count, text_size = _event_index_header_struct.unpack(data)
+
+        if identity != EventIndex.identity or version != EventIndex.version:
+            raise dem.BadDemFile('Bad event index identity or version: %r %r' % (identity, version))
+
+        events = EventIndex()
+        events._order = array.array('I')
+        events._text_offsets = array.array('I')
+
+        for column, size in ((events.level, count),
+                             (events.time, count),
+                             (events.block, count),
+                             (events.event_type, count),
+                             (events.key, count),
+                             (events.value, count),
+                             (events._text_offsets, count + 1),
+                             (events._order, count)):
+            data = file.read(size * column.itemsize)
+
+            if len(data) < size * column.itemsize:
+                raise dem.BadDemFile('Incomplete event index')
+
+            column.frombytes(data)
+
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column.byteswap()
+
+        events._text = bytearray(file.read(text_size))
+
+        if len(events._text) < text_size:
+            raise dem.BadDemFile('Incomplete event index text')
+
+        events._find_ranges()
+
+        return events
+
+    def save(self, file):
+        """Writes the event index to file
+
+        Args:
+            file: Either the path to the file, or a file-like object.
+        """
+
+        if isinstance(file, str):
+            with io.open(file, 'wb') as fp:
+                self._write_file(fp)
+
+        elif hasattr(file, 'write'):
+            self._write_file(file)
+
+        else:
+            raise RuntimeError("EventIndex.save() requires 'file' to be a path or a file-like object")
+
+    def _write_file(self, file):
+        if self._order is None:
+            self._sort()
+
+        header = _event_index_header_struct.pack(EventIndex.identity,
+                                                 EventIndex.version,
+                                                 len(self),
+                                                 len(self._text))
+        file.write(header)
+
+        for column in (self.level,
+                       self.time,
+                       self.block,
+                       self.event_type,
+                       self.key,
+                       self.value,
+                       self._text_offsets,
+                       self._order):
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column = array.array(column.typecode, column)
+                column.byteswap()
+
+            file.write(column.tobytes())
+
+        file.write(self._text)
@@ -0,0 +1,897 @@
+"""This module provides entity state reconstruction for Quake DEM demo files.
+
+Example:
+    with dem.Dem.open('demo1.dem') as dem_file:
+        history = demstate.EntityHistory.build(dem_file.message_blocks)
+
+References:
+    Quake Source
+    - id Software
+    - https://github.com/id-Software/Quake
+"""
+
+import array
+import bisect
+import io
+import struct
+import sys
+import zlib
+
+from . import dem
+
+
+__all__ = ['EntityState', 'WorldState', 'EntityHistory', 'ClientTelemetry',
+           'Checkpoints']
+
+
+# The default number of entity slots. Grown on demand.
+MAX_EDICTS = 600
+
+
+class EntityState(object):
+    """Class for representing the state of every entity at a point in time
+
+    Each attribute is a typed array indexed by entity number. Origins and
+    angles are stored as interleaved x, y, z triples, so the values for
+    entity n are at [3 * n:3 * n + 3].
+
+    Attributes:
+        visible: Nonzero if the entity was sent in the current frame.
+
+        model_index: The number of the model in the model table.
+
+        frame: The frame number of the model.
+
+        color_map: The color map used to display the model.
+
+        skin: The skin number of the model.
+
+        effects: A bit field indicating special effects.
+
+        origin: The positions of the entities.
+
+        angles: The orientations of the entities.
+    """
+
+    __slots__ = (
+        'visible',
+        'model_index',
+        'frame',
+        'color_map',
+        'skin',
+        'effects',
+        'origin',
+        'angles'
+    )
+
+    def __init__(self, size=MAX_EDICTS):
+        self.visible = array.array('B', bytes(size))
+        self.model_index = array.array('B', bytes(size))
+        self.frame = array.array('B', bytes(size))
+        self.color_map = array.array('B', bytes(size))
+        self.skin = array.array('B', bytes(size))
+        self.effects = array.array('B', bytes(size))
+        self.origin = array.array('f', bytes(12 * size))
+        self.angles = array.array('f', bytes(12 * size))
+
+    def __len__(self):
+        return len(self.visible)
+
+    def resize(self, size):
+        """Grows the arrays to hold at least size entities."""
+
+        grow = size - len(self)
+
+        if grow <= 0:
+            return
+
+        for column in (self.visible, self.model_index, self.frame,
+                       self.color_map, self.skin, self.effects):
+            column.frombytes(bytes(grow))
+
+        self.origin.frombytes(bytes(12 * grow))
+        self.angles.frombytes(bytes(12 * grow))
+
+    def copy(self):
+        """Returns a copy of this EntityState."""
+
+        entity_state = EntityState(0)
+
+        for name in EntityState.__slots__:
+            setattr(entity_state, name, array.array(getattr(self, name).typecode, getattr(self, name)))
+
+        return entity_state
+
+
+class WorldState(object):
+    """Class for applying demo messages to a world state
+
+    Entity updates are resolved the way the client does it: any field not
+    sent in an UpdateEntity message is taken from the entity's baseline.
+
+    Example:
+        world_state = WorldState()
+
+        for message_block in dem_file.message_blocks:
+            world_state.apply(message_block)
+            snapshot = world_state.snapshot()
+
+    Attributes:
+        time: The time of the current frame.
+
+        view_entity: The number of the entity the camera is attached to.
+
+        baseline: An EntityState of the baselines sent with SpawnBaseline.
+
+        entities: An EntityState of the current frame.
+
+        updated: A sequence of entity numbers updated by the last block.
+    """
+
+    # The message types that affect a WorldState
+    types = (dem.Time, dem.UpdateEntity, dem.SpawnBaseline, dem.SetView, dem.ServerInfo)
+
+    __slots__ = (
+        'time',
+        'view_entity',
+        'baseline',
+        'entities',
+        'updated',
+        '_hidden'
+    )
+
+    def __init__(self, size=MAX_EDICTS):
+        self.time = 0.0
+        self.view_entity = 0
+        self.baseline = EntityState(size)
+        self.entities = EntityState(size)
+        self.updated = []
+        self._hidden = array.array('B', bytes(size))
+
+    def _resize(self, size):
+        size = max(size, 2 * len(self.entities))
+        self.baseline.resize(size)
+        self.entities.resize(size)
+        self._hidden = array.array('B', bytes(size))
+
+    def reset(self):
+        """Clears all entities and baselines."""
+
+        size = len(self.entities)
+        self.time = 0.0
+        self.view_entity = 0
+        self.baseline = EntityState(size)
+        self.entities = EntityState(size)
+        self.updated = []
+
+    def apply(self, message_block):
+        """Applies the messages of the given block.
+
+        Args:
+            message_block: A MessageBlock object.
+        """
+
+        self.updated = []
+
+        for message in message_block.messages:
+            message_type = type(message)
+
+            if message_type is dem.UpdateEntity:
+                self._apply_update_entity(message)
+
+            elif message_type is dem.Time:
+                # Entities not sent in a frame are not drawn
+                self.time = message.time
+                self.entities.visible[:] = self._hidden
+
+            elif message_type is dem.SpawnBaseline:
+                self._apply_spawn_baseline(message)
+
+            elif message_type is dem.SetView:
+                self.view_entity = message.entity
+
+            elif message_type is dem.ServerInfo:
+                self.reset()
+
+    def _apply_spawn_baseline(self, spawn_baseline):
+        number = spawn_baseline.entity
+
+        if number >= len(self.baseline):
+            self._resize(number + 1)
+
+        for entity_state in self.baseline, self.entities:
+            entity_state.model_index[number] = spawn_baseline.model_index
+            entity_state.frame[number] = spawn_baseline.frame
+            entity_state.color_map[number] = spawn_baseline.color_map
+            entity_state.skin[number] = spawn_baseline.skin
+            entity_state.effects[number] = 0
+            entity_state.origin[3 * number:3 * number + 3] = array.array('f', spawn_baseline.origin)
+            entity_state.angles[3 * number:3 * number + 3] = array.array('f', spawn_baseline.angles)
+
+    def _apply_update_entity(self, update_entity):
+        number = update_entity.entity
+
+        if number >= len(self.entities):
+            self._resize(number + 1)
+
+        baseline = self.baseline
+        entities = self.entities
+        bit_mask = update_entity.bit_mask
+
+        entities.visible[number] = 1
+        entities.model_index[number] = update_entity.model_index if bit_mask & dem.U_MODEL else baseline.model_index[number]
+        entities.frame[number] = update_entity.frame if bit_mask & dem.U_FRAME else baseline.frame[number]
+        entities.color_map[number] = update_entity.colormap if bit_mask & dem.U_COLORMAP else baseline.color_map[number]
+        entities.skin[number] = update_entity.skin if bit_mask & dem.U_SKIN else baseline.skin[number]
+        entities.effects[number] = update_entity.effects if bit_mask & dem.U_EFFECTS else baseline.effects[number]
+
+        i = 3 * number
+        origin = update_entity.origin
+        angles = update_entity.angles
+        base_origin = baseline.origin
+        base_angles = baseline.angles
+
+        entities.origin[i] = base_origin[i] if origin[0] is None else origin[0]
+        entities.origin[i + 1] = base_origin[i + 1] if origin[1] is None else origin[1]
+        entities.origin[i + 2] = base_origin[i + 2] if origin[2] is None else origin[2]
+        entities.angles[i] = base_angles[i] if angles[0] is None else angles[0]
+        entities.angles[i + 1] = base_angles[i + 1] if angles[1] is None else angles[1]
+        entities.angles[i + 2] = base_angles[i + 2] if angles[2] is None else angles[2]
+
+        self.updated.append(number)
+
+    def snapshot(self):
+        """Returns a copy of the current EntityState."""
+
+        return self.entities.copy()
+
+    def copy(self):
+        """Returns a copy of this WorldState."""
+
+        world_state = WorldState(0)
+        world_state.time = self.time
+        world_state.view_entity = self.view_entity
+        world_state.baseline = self.baseline.copy()
+        world_state.entities = self.entities.copy()
+        world_state.updated = list(self.updated)
+        world_state._hidden = array.array('B', self._hidden)
+
+        return world_state
+
+
+class EntityHistory(object):
+    """Class for representing the entity history of a demo as a table
+
+    The table has a row for each entity sent in each message block. Every
+    column is a typed array of equal length, which can be wrapped without
+    copying, e.g. numpy.frombuffer(history.time, dtype='f4'). Origins and
+    angles are interleaved x, y, z triples.
+
+    Example:
+        history = EntityHistory.build(dem_file.message_blocks)
+
+    Attributes:
+        block: The number of the message block.
+
+        time: The time of the frame.
+
+        entity: The number of the entity.
+
+        model_index: The number of the model in the model table.
+
+        frame: The frame number of the model.
+
+        color_map: The color map used to display the model.
+
+        skin: The skin number of the model.
+
+        effects: A bit field indicating special effects.
+
+        origin: The position of the entity.
+
+        angles: The orientation of the entity.
+    """
+
+    __slots__ = (
+        'block',
+        'time',
+        'entity',
+        'model_index',
+        'frame',
+        'color_map',
+        'skin',
+        'effects',
+        'origin',
+        'angles'
+    )
+
+    def __init__(self):
+        self.block = array.array('I')
+        self.time = array.array('f')
+        self.entity = array.array('H')
+        self.model_index = array.array('B')
+        self.frame = array.array('B')
+        self.color_map = array.array('B')
+        self.skin = array.array('B')
+        self.effects = array.array('B')
+        self.origin = array.array('f')
+        self.angles = array.array('f')
+
+    def __len__(self):
+        return len(self.entity)
+
+    @staticmethod
+    def build(message_blocks, world_state=None):
+        """Returns an EntityHistory for the given message blocks
+
+        Args:
+            message_blocks: A sequence of MessageBlock objects.
+
+            world_state: Optional. The WorldState to apply the blocks to.
+        """
+
+        history = EntityHistory()
+
+        if world_state is None:
+            world_state = WorldState()
+
+        for number, message_block in enumerate(message_blocks):
+            world_state.apply(message_block)
+            history.append(number, world_state)
+
+        return history
+
+    def append(self, block, world_state):
+        """Adds a row for each entity updated by the last applied block.
+
+        Args:
+            block: The number of the message block.
+
+            world_state: The WorldState the block was applied to.
+        """
+
+        entities = world_state.entities
+
+        for number in world_state.updated:
+            self.block.append(block)
+            self.time.append(world_state.time)
+            self.entity.append(number)
+            self.model_index.append(entities.model_index[number])
+            self.frame.append(entities.frame[number])
+            self.color_map.append(entities.color_map[number])
+            self.skin.append(entities.skin[number])
+            self.effects.append(entities.effects[number])
+            self.origin.extend(entities.origin[3 * number:3 * number + 3])
+            self.angles.extend(entities.angles[3 * number:3 * number + 3])
+
+    def select(self, entity):
+        """Returns the row numbers for the given entity."""
+
+        return [i for i, number in enumerate(self.entity) if number == entity]
+
+
+_telemetry_header_struct = struct.Struct('<4sII')
+
+
+class ClientTelemetry(object):
+    """Class for representing the ClientData of a demo as a table
+
+    The table has a row for each ClientData message. Every column is a typed
+    array which can be wrapped without copying, e.g.
+    numpy.frombuffer(telemetry.health, dtype='i2'). Punch angles, velocities
+    and ammo counts are interleaved, so the values for row n are at
+    [3 * n:3 * n + 3] or [4 * n:4 * n + 4].
+
+    Optional fields that are not sent are filled the way the client does it:
+    the view height falls back to 22 and every other field to zero.
+
+    Example:
+        dem_file = dem.Dem.open('demo1.dem', lazy=True)
+        telemetry = ClientTelemetry.build(dem_file.iter_message_blocks(ClientTelemetry.types))
+
+    Attributes:
+        block: The number of the message block.
+
+        time: The time of the frame.
+
+        view_height: The view offset from the origin along the z-axis.
+
+        ideal_pitch: The calculated angle for looking up/down slopes.
+
+        punch_angle: The camera shake as x, y, z triples.
+
+        velocity: The player velocity as x, y, z triples.
+
+        item_bit_mask: A bit field for player inventory.
+
+        on_ground: Nonzero if the player is on the ground.
+
+        in_water: Nonzero if the player is in a water volume.
+
+        weapon_frame: The animation frame of the weapon.
+
+        armor: The armor value.
+
+        weapon: The model number of the weapon in the model table.
+
+        health: The health value.
+
+        active_ammo: The ammo count of the active weapon.
+
+        ammo: The shells, nails, rockets and cells counts as quadruples.
+
+        active_weapon: The actively held weapon.
+    """
+
+    # The message types needed to build a ClientTelemetry
+    types = (dem.Time, dem.ClientData)
+
+    identity = b'CTEL'
+    version = 1
+
+    __slots__ = (
+        'block',
+        'time',
+        'view_height',
+        'ideal_pitch',
+        'punch_angle',
+        'velocity',
+        'item_bit_mask',
+        'on_ground',
+        'in_water',
+        'weapon_frame',
+        'armor',
+        'weapon',
+        'health',
+        'active_ammo',
+        'ammo',
+        'active_weapon'
+    )
+
+    def __init__(self):
+        self.block = array.array('I')
+        self.time = array.array('f')
+        self.view_height = array.array('b')
+        self.ideal_pitch = array.array('b')
+        self.punch_angle = array.array('f')
+        self.velocity = array.array('h')
+        self.item_bit_mask = array.array('i')
+        self.on_ground = array.array('B')
+        self.in_water = array.array('B')
+        self.weapon_frame = array.array('B')
+        self.armor = array.array('B')
+        self.weapon = array.array('B')
+        self.health = array.array('h')
+        self.active_ammo = array.array('B')
+        self.ammo = array.array('B')
+        self.active_weapon = array.array('B')
+
+    def __len__(self):
+        return len(self.block)
+
+    @staticmethod
+    def build(message_blocks):
+        """Returns a ClientTelemetry for the given message blocks
+
+        Args:
+            message_blocks: An iterable of MessageBlock objects. Messages other
+                than Time and ClientData are ignored, so the blocks can be
+                decoded with types=ClientTelemetry.types.
+        """
+
+        telemetry = ClientTelemetry()
+        time = 0.0
+
+        for number, message_block in enumerate(message_blocks):
+            for message in message_block.messages:
+                message_type = type(message)
+
+                if message_type is dem.Time:
+                    time = message.time
+
+                elif message_type is dem.ClientData:
+                    telemetry.append(number, time, message)
+
+        return telemetry
+
+    def append(self, block, time, client_data):
+        """Adds a row for the given ClientData message.
+
+        Args:
+            block: The number of the message block.
+
+            time: The time of the frame.
+
+            client_data: A ClientData object.
+        """
+
+        bit_mask = client_data.bit_mask
+
+        self.block.append(block)
+        self.time.append(time)
+        self.view_height.append(client_data.view_height if bit_mask & dem.SU_VIEWHEIGHT else 22)
+        self.ideal_pitch.append(client_data.ideal_pitch if bit_mask & dem.SU_IDEALPITCH else 0)
+        self.punch_angle.extend(client_data.punch_angle)
+        self.velocity.extend(client_data.velocity)
+        self.item_bit_mask.append(client_data.item_bit_mask)
+        self.on_ground.append(client_data.on_ground)
+        self.in_water.append(client_data.in_water)
+        self.weapon_frame.append(client_data.weapon_frame if bit_mask & dem.SU_WEAPONFRAME else 0)
+        self.armor.append(client_data.armor if bit_mask & dem.SU_ARMOR else 0)
+        self.weapon.append(client_data.weapon if bit_mask & dem.SU_WEAPON else 0)
+        self.health.append(client_data.health)
+        self.active_ammo.append(client_data.active_ammo)
+        self.ammo.extend(client_data.ammo)
+        self.active_weapon.append(client_data.active_weapon)
+
+    @staticmethod
+    def open(file):
+        """Returns a ClientTelemetry object
+
+        Args:
+            file: Either the path to the file, a file-like object, or bytes.
+
+        Raises:
+            BadDemFile: If the file is not a valid telemetry file.
+        """
+
+        if isinstance(file, str):
+            with io.open(file, 'rb') as fp:
+                return ClientTelemetry._read_file(fp)
+
+        elif isinstance(file, bytes):
+            return ClientTelemetry._read_file(io.BytesIO(file))
+
+        elif not hasattr(file, 'read'):
+            raise RuntimeError("ClientTelemetry.open() requires 'file' to be a path, a file-like object, or bytes")
+
+        return ClientTelemetry._read_file(file)
+
+    @staticmethod
+    def _read_file(file):
+        data = file.read(_telemetry_header_struct.size)
+
+        if len(data) < _telemetry_header_struct.size:
+            raise dem.BadDemFile('Incomplete telemetry header')
+
+        identity, version, count = _telemetry_header_struct.unpack(data)
+
+        if identity != ClientTelemetry.identity or version != ClientTelemetry.version:
+            raise dem.BadDemFile('Bad telemetry identity or version: %r %r' % (identity, version))
+
+        telemetry = ClientTelemetry()
+
+        for name in ClientTelemetry.__slots__:
+            column = getattr(telemetry, name)
+            size = count * column.itemsize * _telemetry_row_sizes.get(name, 1)
+            data = file.read(size)
+
+            if len(data) < size:
+                raise dem.BadDemFile('Incomplete telemetry column: %s' % name)
+
+            column.frombytes(data)
+
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column.byteswap()
+
+        return telemetry
+
+    def save(self, file):
+        """Writes the telemetry to file
+
+        Args:
+            file: Either the path to the file, or a file-like object.
+        """
+
+        if isinstance(file, str):
+            with io.open(file, 'wb') as fp:
+                self._write_file(fp)
+
+        elif hasattr(file, 'write'):
+            self._write_file(file)
+
+        else:
+            raise RuntimeError("ClientTelemetry.save() requires 'file' to be a path or a file-like object")
+
+    def _write_file(self, file):
+        header = _telemetry_header_struct.pack(ClientTelemetry.identity,
+                                               ClientTelemetry.version,
+                                               len(self))
+        file.write(header)
+
+        for name in ClientTelemetry.__slots__:
+            column = getattr(self, name)
+
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column = array.array(column.typecode, column)
+                column.byteswap()
+
+            file.write(column.tobytes())
+
+
+# Values per row of the interleaved columns
+_telemetry_row_sizes = {
+    'punch_angle': 3,
+    'velocity': 3,
+    'ammo': 4
+}
+
+
+_checkpoints_header_struct = struct.Struct('<4sIfII')
+_checkpoint_header_struct = struct.Struct('<IfHII')
+
+
+def _pack_world_state(world_state):
+    columns = []
+
+    for entity_state in world_state.baseline, world_state.entities:
+        for name in EntityState.__slots__:
+            column = getattr(entity_state, name)
+
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column = array.array(column.typecode, column)
+                column.byteswap()
+
+            columns.append(column.tobytes())
+
+    return zlib.compress(b''.join(columns))
+
+
+def _unpack_world_state(data, size):
+    world_state = WorldState(size)
+    data = zlib.decompress(data)
+    position = 0
+
+    for entity_state in world_state.baseline, world_state.entities:
+        for name in EntityState.__slots__:
+            column = getattr(entity_state, name)
+            column_size = len(column) * column.itemsize
+            column[:] = array.array(column.typecode, data[position:position + column_size])
+            position += column_size
+
+            if sys.byteorder == 'big' and column.itemsize > 1:
+                column.byteswap()
+
+    return world_state
+
+
+class Checkpoints(object):
+    """Class for representing periodic WorldState keyframes of a demo
+
+    Any point in a demo can be reconstructed by restoring the closest
+    preceding checkpoint and applying at most one interval of blocks. Closer
+    spacing uses more memory but answers queries faster. Checkpoints are
+    saved together with the demo's DemIndex as a compressed sidecar file.
+
+    Example:
+        checkpoints = Checkpoints.build(dem_file, seconds=5)
+        checkpoints.save('demo1.dem.ckpt')
+
+    Attributes:
+        seconds: The minimum time between checkpoints, or zero.
+
+        blocks: The minimum number of blocks between checkpoints, or zero.
+
+        index: The DemIndex of the demo.
+
+        block_numbers: An array of the number of the block each checkpoint
+            was taken after.
+
+        world_states: A sequence of WorldState objects, one per checkpoint.
+    """
+
+    __slots__ = (
+        'seconds',
+        'blocks',
+        'index',
+        'block_numbers',
+        'world_states'
+    )
+
+    identity = b'CDEM'
+    version = 1
+
+    def __init__(self, seconds=10.0, blocks=0):
+        self.seconds = seconds
+        self.blocks = blocks
+        self.index = None
+        self.block_numbers = array.array('I')
+        self.world_states = []
+
+    def __len__(self):
+        return len(self.world_states)
+
+    @staticmethod
+    def build(dem_file, seconds=10.0, blocks=0):
+        """Returns Checkpoints for the given demo
+
+        A checkpoint is taken after the first block, then whenever either
+        spacing has been exceeded. Time restarts with each level, so a
+        checkpoint is also taken whenever it goes backwards.
+
+        Args:
+            dem_file: A Dem object. Its read position will be changed.
+
+            seconds: The minimum time between checkpoints, or zero.
+
+            blocks: The minimum number of blocks between checkpoints, or zero.
+        """
+
+        if not seconds and not blocks:
+            raise ValueError('Checkpoints require a spacing in seconds or blocks')
+
+        checkpoints = Checkpoints(seconds, blocks)
+        dem_file.seek_block(0)
+        checkpoints.index = dem_file.index
+
+        world_state = WorldState()
+        last_block = None
+        last_time = 0.0
+
+        for number, message_block in enumerate(dem_file.iter_message_blocks(WorldState.types)):
+            world_state.apply(message_block)
+
+            if last_block is None or \
+                    (blocks and number - last_block >= blocks) or \
+                    (seconds and (world_state.time < last_time or world_state.time - last_time >= seconds)):
+                checkpoints.block_numbers.append(number)
+                checkpoints.world_states.append(world_state.copy())
+                last_block = number
+                last_time = world_state.time
+
+        return checkpoints
+
+    def state_at(self, dem_file, time, level=0):
+        """Returns the WorldState after every block of the given level at or
+        before the given time, or after the first block of the level if the
+        time is before it.
+
+        Args:
+            dem_file: The Dem object the checkpoints were built from. Its read
+                position will be changed.
+
+            time: The time in seconds.
+
+            level: Optional. The number of the level, counting from zero.
+                Times restart with each level.
+        """
+
+        first, end = self.index.level_blocks(level)
+
+        # A time before the first block of the level still gives a state in
+        # the level rather than the end of the previous one
+        target = max(bisect.bisect_right(self.index.times, time, first, end) - 1, first)
+
+        return self.state_after(dem_file, target)
+
+    def state_after(self, dem_file, number):
+        """Returns the WorldState after the given block.
+
+        Args:
+            dem_file: The Dem object the checkpoints were built from. Its read
+                position will be changed.
+
+            number: The number of the block, or -1 for the state before the
+                first block.
+        """
+
+        target = number
+        checkpoint = bisect.bisect_right(self.block_numbers, target) - 1
+
+        if checkpoint < 0:
+            world_state = WorldState()
+            number = 0
+
+        else:
+            world_state = self.world_states[checkpoint].copy()
+            number = self.block_numbers[checkpoint] + 1
+
+        if number <= target:
+            if dem_file.index is None:
+                dem_file.index = self.index
+
+            dem_file.seek_block(number)
+
+            for message_block in dem_file.iter_message_blocks(WorldState.types):
+                world_state.apply(message_block)
+                number += 1
+
+                if number > target:
+                    break
+
+        return world_state
+
+    @staticmethod
+    def open(file):
+        """Returns a Checkpoints object
+
+        Args:
+            file: Either the path to the file, a file-like object, or bytes.
+
+        Raises:
+            BadDemFile: If the file is not a valid checkpoints file.
+        """
+
+        if isinstance(file, str):
+            with io.open(file, 'rb') as fp:
+                return Checkpoints._read_file(fp)
+
+        elif isinstance(file, bytes):
+            return Checkpoints._read_file(io.BytesIO(file))
+
+        elif not hasattr(file, 'read'):
+            raise RuntimeError("Checkpoints.open() requires 'file' to be a path, a file-like object, or bytes")
+
+        return Checkpoints._read_file(file)
+
+    @staticmethod
+    def _read_file(file):
+        data = file.read(_checkpoints_header_struct.size)
+
+        if len(data) < _checkpoints_header_struct.size:
+            raise dem.BadDemFile('Incomplete checkpoints header')
+
+        identity, version, seconds, blocks, count = _checkpoints_header_struct.unpack(data)
+
+        if identity != Checkpoints.identity or version != Checkpoints.version:
+            raise dem.BadDemFile('Bad checkpoints identity or version: %r %r' % (identity, version))
+
+        checkpoints = Checkpoints(seconds, blocks)
+        checkpoints.index = dem.DemIndex.open(file)
+
+        for _ in range(count):
+            data = file.read(_checkpoint_header_struct.size)
+
+            if len(data) < _checkpoint_header_struct.size:
+                raise dem.BadDemFile('Incomplete checkpoint header')
+
+            number, time, view_entity, size, data_size = _checkpoint_header_struct.unpack(data)
+            data = file.read(data_size)
+
+            if len(data) < data_size:
+                raise dem.BadDemFile('Incomplete checkpoint')
+
+            world_state = _unpack_world_state(data, size)
+            world_state.time = time
+            world_state.view_entity = view_entity
+
+            checkpoints.block_numbers.append(number)
+            checkpoints.world_states.append(world_state)
+
+        return checkpoints
+
+    def save(self, file):
+        """Writes the checkpoints to file
+
+        Args:
+            file: Either the path to the file, or a file-like object.
+        """
+
+        if isinstance(file, str):
+            with io.open(file, 'wb') as fp:
+                self._write_file(fp)
+
+        elif hasattr(file, 'write'):
+            self._write_file(file)
+
+        else:
+            raise RuntimeError("Checkpoints.save() requires 'file' to be a path or a file-like object")
+
+    def _write_file(self, file):
+        header = _checkpoints_header_struct.pack(Checkpoints.identity,
+                                                 Checkpoints.version,
+                                                 self.seconds,
+                                                 self.blocks,
+                                                 len(self))
+        file.write(header)
+        self.index.save(file)
+
+        for number, world_state in zip(self.block_numbers, self.world_states):
+            data = _pack_world_state(world_state)
+            header = _checkpoint_header_struct.pack(number,
+                                                    world_state.time,
+                                                    world_state.view_entity,
+                                                    len(world_state.entities),
+                                                    len(data))
+            file.write(header)
+            file.write(data)
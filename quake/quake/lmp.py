@@ -16,6 +16,8 @@ References:
 import io
 import struct
 
+from .pak import _ViewFile
+
 __all__ = ['BadLmpFile', 'Lmp']
 
 
@@ -177,7 +179,8 @@ class Lmp(object):
         """Returns an Lmp object
         
         Args:
-            file: Either the path to the file, a file-like object, or bytes.
+            file: Either the path to the file, a file-like object, bytes, or
+                a memoryview.
 
             mode: An optional string that indicates which mode to open the file
 
@@ -202,6 +205,9 @@ class Lmp(object):
         elif isinstance(file, bytes):
             file = io.BytesIO(file)
 
+        elif isinstance(file, memoryview):
+            file = _ViewFile(file)
+
         elif not hasattr(file, 'read'):
             raise RuntimeError("Lmp.open() requires 'file' to be a path, a file-like object, or bytes")
 
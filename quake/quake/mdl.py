@@ -16,6 +16,8 @@ References:
 import io
 import struct
 
+from .pak import _ViewFile
+
 __all__ = ['BadMdlFile', 'is_mdlfile', 'BadMdlFile', 'default_palette',
            'vertex_normals','Skin', 'SkinGroup', 'StVertex', 'Triangle',
            'TriVertex', 'Frame', 'FrameGroup', 'Mesh', 'Image', 'Mdl']
@@ -893,7 +895,8 @@ class Mdl(object):
         """Returns an Mdl object
 
         Args:
-            file: Either the path to the file, a file-like object, or bytes.
+            file: Either the path to the file, a file-like object, bytes, or
+                a memoryview.
 
             mode: An optional string that indicates which mode to open the file
 
@@ -920,6 +923,9 @@ class Mdl(object):
         elif isinstance(file, bytes):
             file = io.BytesIO(file)
 
+        elif isinstance(file, memoryview):
+            file = _ViewFile(file)
+
         elif not hasattr(file, 'read'):
             raise RuntimeError(
                 "Mdl.open() requires 'file' to be a path, a file-like object, or bytes")
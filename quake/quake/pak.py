@@ -13,7 +13,11 @@ References:
     - http://www.gamers.org/dEngine/quake/spec/quake-spec34/qkspec_3.htm
 """
 
+import bisect
+import concurrent.futures
+import hashlib
 import io
+import mmap
 import os
 import shutil
 import stat
@@ -26,7 +30,8 @@ except ImportError:
     import dummy_threading as threading
 
 
-__all__ = ['BadPakFile', 'is_pakfile', 'PakInfo', 'PakFile']
+__all__ = ['BadPakFile', 'is_pakfile', 'PakInfo', 'PakFile', 'AccessTrace',
+           'count_seeks', 'repack']
 
 
 class BadPakFile(Exception):
@@ -53,6 +58,11 @@ _FILE_OFFSET = 1
 _FILE_SIZE = 2
 
 
+# Called as open_hook(pak_file, info) whenever a member is read through
+# PakFile.open(), PakFile.read() or PakFile.read_view()
+open_hook = None
+
+
 def _check_pakfile(fp):
     fp.seek(0)
     data = fp.read(struct.calcsize('<4s'))
@@ -111,25 +121,149 @@ class PakInfo(object):
         return info
 
 
+def _pread(fileno, n, position):
+    """Read up to n bytes at position without moving the file pointer."""
+
+    data = os.pread(fileno, n, position)
+
+    # A positional read can return fewer bytes than asked for before the end
+    # of the file, so keep reading until it is satisfied or hits the end.
+    if len(data) < n:
+        chunks = [data]
+        total = len(data)
+
+        while total < n:
+            chunk = os.pread(fileno, n - total, position + total)
+
+            if not chunk:
+                break
+
+            chunks.append(chunk)
+            total += len(chunk)
+
+        data = b''.join(chunks)
+
+    return data
+
+
+# Size of the chunks used to copy members when the copy can not be done by
+# the kernel
+_COPY_BUFFER_SIZE = 1 << 20
+
+
+def _copy_range(source, target, offset, size):
+    """Copies size bytes at offset of the source file descriptor to the
+    current position of the target file descriptor."""
+
+    position = offset
+    end = offset + size
+
+    # Let the kernel copy the bytes directly between the files when it can
+    for copy in ('copy_file_range', 'sendfile'):
+        if position >= end or not hasattr(os, copy):
+            continue
+
+        try:
+            while position < end:
+                if copy == 'copy_file_range':
+                    count = os.copy_file_range(source, target, end - position, position)
+
+                else:
+                    count = os.sendfile(target, source, position, end - position)
+
+                if not count:
+                    break
+
+                position += count
+
+        except OSError:
+            # Not supported between these files, fall back to the next method
+            continue
+
+    while position < end:
+        data = os.pread(source, min(_COPY_BUFFER_SIZE, end - position), position)
+
+        if not data:
+            raise EOFError
+
+        os.write(target, data)
+        position += len(data)
+
+
+def _sha1(file):
+    """Returns the SHA-1 digest of the rest of the file object."""
+
+    digest = hashlib.sha1()
+
+    for chunk in iter(lambda: file.read(_COPY_BUFFER_SIZE), b''):
+        digest.update(chunk)
+
+    return digest.digest()
+
+
+def _move_range(fp, source, target, size):
+    """Moves size bytes at source to target within the file object fp. The
+    target must not be after the source, so the bytes can be copied front to
+    back in large chunks without overwriting any that are still to be read."""
+
+    assert target <= source
+
+    position = 0
+
+    while position < size:
+        fp.seek(source + position)
+        data = fp.read(min(_COPY_BUFFER_SIZE, size - position))
+
+        if not data:
+            raise EOFError
+
+        fp.seek(target + position)
+        fp.write(data)
+        position += len(data)
+
+
+def _merge_spans(file_list):
+    """Returns a sorted list of [start, end] byte ranges covered by the
+    members in file_list, with overlapping and adjacent ranges merged."""
+
+    spans = []
+
+    for start, end in sorted((i.file_offset, i.file_offset + i.file_size) for i in file_list if i.file_size):
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+
+        else:
+            spans.append([start, end])
+
+    return spans
+
+
 class _SharedFile:
-    def __init__(self, file, position, size, close, lock):
+    def __init__(self, file, position, size, close, lock, fileno=None):
         self._file = file
         self._position = position
         self._start = position
         self._end = position + size
         self._close = close
         self._lock = lock
+        self._fileno = fileno
 
     def read(self, n=-1):
-        with self._lock:
-            self._file.seek(self._position)
+        if n < 0 or n > self._end - self._position:
+            n = self._end - self._position
 
-            if n < 0 or n > self._end:
-                n = self._end - self._position
+        # Positional reads do not share a file pointer, so any number of
+        # members can be read at once without taking the lock.
+        if self._fileno is not None:
+            data = _pread(self._fileno, n, self._position)
 
-            data = self._file.read(n)
-            self._position = self._file.tell()
-            return data
+        else:
+            with self._lock:
+                self._file.seek(self._position)
+                data = self._file.read(n)
+
+        self._position += len(data)
+        return data
 
     def close(self):
         if self._file is not None:
@@ -138,15 +272,15 @@ class _SharedFile:
             self._close(file_object)
 
     def seek(self, n):
-        n = min(self._start + n, self._end)
-        self._file.seek(n)
-        self._position = self._file.tell()
+        self._position = min(self._start + n, self._end)
 
 
 class PakExtFile(io.BufferedIOBase):
     """A file-like object for reading an entry.
 
-    It is returned by PakFile.open()
+    It is returned by PakFile.open(). It supports seek() and tell() relative
+    to the start of the entry, so it can be passed directly to parsers that
+    seek such as Bsp.open() and Mdl.open().
     """
 
     MAX_N = 1 << 31 - 1
@@ -157,7 +291,7 @@ class PakExtFile(io.BufferedIOBase):
         self._close_file_object = close_file_object
         self._bytes_left = pak_info.file_size
 
-        self._eof = False
+        self._eof = self._bytes_left <= 0
         self._readbuffer = b''
         self._offset = 0
         self._size = pak_info.file_size
@@ -165,6 +299,12 @@ class PakExtFile(io.BufferedIOBase):
         self.mode = mode
         self.name = pak_info.filename
 
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
     def read(self, n=-1):
         """Read and return up to n bytes.
 
@@ -173,25 +313,25 @@ class PakExtFile(io.BufferedIOBase):
         """
 
         if n is None or n < 0:
-            buffer = self._readbuffer[self._offset:]
+            chunks = [self._readbuffer[self._offset:]]
             self._readbuffer = b''
             self._offset = 0
 
             while not self._eof:
-                buffer += self._read_internal(self.MAX_N)
+                chunks.append(self._read_internal(self._bytes_left))
 
-            return buffer
+            return b''.join(chunks)
 
         end = n + self._offset
 
-        if end < len(self._readbuffer):
+        if end <= len(self._readbuffer):
             buffer = self._readbuffer[self._offset:end]
             self._offset = end
 
             return buffer
 
         n = end - len(self._readbuffer)
-        buffer = self._readbuffer[self._offset:]
+        chunks = [self._readbuffer[self._offset:]]
         self._readbuffer = b''
         self._offset = 0
 
@@ -201,13 +341,23 @@ class PakExtFile(io.BufferedIOBase):
             if n < len(data):
                 self._readbuffer = data
                 self._offset = n
-                buffer += data[:n]
+                chunks.append(data[:n])
                 break
 
-            buffer += data
+            chunks.append(data)
             n -= len(data)
 
-        return buffer
+        return b''.join(chunks)
+
+    def readinto(self, b):
+        """Read bytes into a pre-allocated, writable bytes-like object b and
+        return the number of bytes read."""
+
+        view = memoryview(b).cast('B')
+        data = self.read(len(view))
+        view[:len(data)] = data
+
+        return len(data)
 
     def _read_internal(self, n):
         """Read up to n bytes with at most one read() system call"""
@@ -216,13 +366,12 @@ class PakExtFile(io.BufferedIOBase):
             return b''
 
         # Read from file.
-        n = max(n, self.MIN_READ_SIZE)
+        n = min(max(n, self.MIN_READ_SIZE), self._bytes_left)
         data = self._file_object.read(n)
 
         if not data:
             raise EOFError
 
-        data = data[:self._bytes_left]
         self._bytes_left -= len(data)
 
         if self._bytes_left <= 0:
@@ -244,11 +393,48 @@ class PakExtFile(io.BufferedIOBase):
         # Return up to 512 bytes to reduce allocation overhead for tight loops.
         return self._readbuffer[self._offset: self._offset + 512]
 
-    def seek(self, n):
-        self._file_object.seek(n)
+    def tell(self):
+        """Return the current position within the entry."""
+
+        return self._size - self._bytes_left - (len(self._readbuffer) - self._offset)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Change the position within the entry and return it. Positions past
+        the end of the entry are clamped to the end."""
+
+        if whence == io.SEEK_SET:
+            position = offset
+
+        elif whence == io.SEEK_CUR:
+            position = self.tell() + offset
+
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+
+        else:
+            raise ValueError('Invalid whence: %r' % whence)
+
+        if position < 0:
+            raise ValueError('Negative seek position %d' % position)
+
+        position = min(position, self._size)
+
+        # Stay within the read buffer if possible
+        buffer_start = self._size - self._bytes_left - len(self._readbuffer)
+
+        if buffer_start <= position <= buffer_start + len(self._readbuffer):
+            self._offset = position - buffer_start
+
+            return position
+
+        self._file_object.seek(position)
+        self._bytes_left = self._size - position
+        self._eof = self._bytes_left <= 0
         self._readbuffer = b''
         self._offset = 0
 
+        return position
+
     def close(self):
         try:
             if self._close_file_object:
@@ -258,11 +444,15 @@ class PakExtFile(io.BufferedIOBase):
 
 
 class _PakWriteFile(io.BufferedIOBase):
-    def __init__(self, pak_file, pak_info):
+    def __init__(self, pak_file, pak_info, digest=None):
         self._pak_info = pak_info
         self._pak_file = pak_file
         self._file_size = 0
 
+        # The data is hashed as it is written unless its digest is given
+        self._digest = digest
+        self._hash = hashlib.sha1() if pak_file.dedup and digest is None else None
+
     @property
     def _fileobj(self):
         return self._pak_file.fp
@@ -275,35 +465,124 @@ class _PakWriteFile(io.BufferedIOBase):
         self._file_size += number_of_bytes
         self._fileobj.write(data)
 
+        if self._hash is not None:
+            self._hash.update(data)
+
         return number_of_bytes
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def abort(self):
+        """Closes the handle without adding the member. The archive is left
+        as it was before the member was opened, and the bytes written are
+        overwritten by the next member or the directory."""
+
+        if not self.closed:
+            super().close()
+            self._pak_file._writing = False
+
     def close(self):
+        if self.closed:
+            return
+
         super().close()
 
-        self._pak_file.start_of_directory = self._fileobj.tell()
+        # Record the bytes actually written, the source may have changed size
+        # since it was stat'ed
+        self._pak_info.file_size = self._file_size
         self._pak_file._writing = False
-        self._pak_file.file_list.append(self._pak_info)
-        self._pak_file.NameToInfo[self._pak_info.filename] = self._pak_info
+        end_of_member = self._fileobj.tell()
+
+        # A duplicate is pointed at the bytes already in the archive and the
+        # copy just written is overwritten by the next member or directory
+        if self._hash is not None:
+            self._digest = self._hash.digest()
+
+        if self._digest is None or not self._pak_file._deduplicate(self._pak_info, self._digest):
+            self._pak_file.start_of_directory = end_of_member
+
+        self._pak_file._add_info(self._pak_info)
+
+
+class _ViewFile(object):
+    """A read-only file-like object over a memoryview, such as a member
+    returned by PakFile.read_view().
+
+    Reads return slices of the view instead of copies, so a member of a
+    memory mapped archive can be parsed in place. The slices are only valid
+    while the view is.
+    """
+
+    def __init__(self, view):
+        self._view = view.cast('B')
+        self._position = 0
+
+    def read(self, n=-1):
+        start = self._position
+        end = len(self._view) if n is None or n < 0 else min(start + n, len(self._view))
+        self._position = max(start, end)
+
+        return self._view[start:end]
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+
+        self._position = max(offset, 0)
+
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._view.release()
 
 
 class PakFile(object):
     """Class with methods to open, read, close, and list pak files.
 
-     p = PakFile(file, mode='r')
+     p = PakFile(file, mode='r', mmap=False, dedup=False)
 
     file: Either the path to the file, or a file-like object. If it is a path,
         the file will be opened and closed by PakFile.
 
-    mode: Currently the only supported mode is 'r'
+    mode: 'r' to read an existing file, 'w' to write a new one, or 'a' to
+        update an existing file in place. Members written in mode 'a' are
+        appended after the end of the file and the directory is written
+        after them, so an update costs the size of the new members plus the
+        directory. The header is written last, so an update that is
+        interrupted leaves the previous contents readable. The previous
+        directory and replaced and removed members leave unused space
+        behind until compact() is called.
+
+    mmap: If True the archive is memory mapped and read_view() can return
+        members without copying them. Requires mode 'r' and a file with a
+        file descriptor.
+
+    dedup: If True members written with identical bytes are stored once, and
+        the directory entries of the duplicates point at the same bytes. The
+        number of duplicates and the bytes they saved are counted in
+        duplicate_count and duplicate_size.
     """
 
     fp = None
     _windows_illegal_name_trans_table = None
 
-    def __init__(self, file, mode='r'):
+    def __init__(self, file, mode='r', mmap=False, dedup=False):
         if mode not in ('r', 'w', 'a'):
             raise RuntimeError("PakFile requires mode 'r', 'w', or 'a'")
 
+        if mmap and mode != 'r':
+            raise ValueError("mmap requires mode 'r'")
+
         self.NameToInfo = {}
         self.file_list = []
         self.mode = mode
@@ -312,6 +591,14 @@ class PakFile(object):
         self._file_reference_count = 1
         self._lock = threading.RLock()
         self._writing = False
+        self._fileno = None
+        self._mmap = None
+
+        self.dedup = dedup
+        self.duplicate_count = 0
+        self.duplicate_size = 0
+        self._digests = {}
+        self._unhashed = {}
 
         filemode = {'r': 'rb', 'w': 'w+b', 'a': 'r+b'}[mode]
 
@@ -328,6 +615,10 @@ class PakFile(object):
         try:
             if mode == 'r':
                 self._read_archive_content()
+                self._fileno = self._positional_fileno()
+
+                if mmap:
+                    self._map()
 
             elif mode =='w':
                 self._did_modify = True
@@ -342,7 +633,11 @@ class PakFile(object):
             elif mode == 'a':
                 try:
                     self._read_archive_content()
-                    self.fp.seek(self.start_of_directory)
+
+                    # Nothing is written over the previous directory, which
+                    # stays in use until the header points past it
+                    self.start_of_directory = self.fp.seek(0, io.SEEK_END)
+                    self._reset_digests()
 
                 except BadPakFile:
                     raise
@@ -359,6 +654,30 @@ class PakFile(object):
     def __enter__(self):
         return self
 
+    def _map(self):
+        """Memory maps the archive."""
+
+        try:
+            fileno = self.fp.fileno()
+
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            raise ValueError('mmap requires a file with a file descriptor')
+
+        self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+    def _positional_fileno(self):
+        """Returns the file descriptor to use for positional reads, or None
+        if reads have to go through the shared file object."""
+
+        if not hasattr(os, 'pread'):
+            return None
+
+        try:
+            return self.fp.fileno()
+
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+
     def __exit__(self, type, value, traceback):
         self.close()
 
@@ -408,6 +727,7 @@ class PakFile(object):
 
             self.fp.write(data)
 
+        end_of_directory = self.fp.tell()
         directory_size = len(self.file_list) * local_file_size
 
         header_data = struct.pack(header_struct,
@@ -415,10 +735,37 @@ class PakFile(object):
                                   self.start_of_directory,
                                   directory_size)
 
+        # The members and the directory are written before the header that
+        # points at them
+        self.fp.flush()
         self.fp.seek(0)
         self.fp.write(header_data)
         self.fp.flush()
 
+        # The directory can end before a previous one did after members were
+        # removed or the archive was compacted
+        try:
+            self.fp.truncate(end_of_directory)
+
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+
+    def _add_info(self, info):
+        """Adds info to the directory, replacing the entry of the member with
+        the same name if there is one."""
+
+        old_info = self.NameToInfo.get(info.filename)
+
+        # Quake uses the first entry with a name, so the old entry can not
+        # stay in the directory. Its bytes are left unused until compact().
+        if old_info is not None:
+            self.file_list[self.file_list.index(old_info)] = info
+
+        else:
+            self.file_list.append(info)
+
+        self.NameToInfo[info.filename] = info
+
     def namelist(self):
         """Return a list of file names in the pak file."""
 
@@ -441,13 +788,66 @@ class PakFile(object):
         return info
 
     def read(self, name):
-        """Return file bytes (as a string) for 'name'."""
+        """Return file bytes (as a string) for 'name'.
+
+        Raises:
+            EOFError: If the member extends past the end of the archive.
+        """
 
         info = self.getinfo(name)
 
+        # Reads that do not go through open() are recorded here
+        if open_hook is not None and (self._mmap is not None or self._fileno is not None) and self.fp:
+            open_hook(self, info)
+
+        if self._mmap is not None and self.fp:
+            end = info.file_offset + info.file_size
+
+            if end > len(self._mmap):
+                raise EOFError('Member %r extends past the end of the archive' % info.filename)
+
+            return self._mmap[info.file_offset:end]
+
+        if self._fileno is not None and self.fp:
+            data = _pread(self._fileno, info.file_size, info.file_offset)
+
+            if len(data) != info.file_size:
+                raise EOFError('Member %r extends past the end of the archive' % info.filename)
+
+            return data
+
         with self.open(name, 'r') as fp:
             return fp.read(info.file_size)
 
+    def read_view(self, name):
+        """Return a read-only memoryview of the bytes of 'name' without
+        copying them. Requires the archive to be opened with mmap=True.
+
+        The view can be passed to Bsp.open(), Mdl.open(), Lmp.open() and
+        Spr.open(). The mapping stays alive until every view of it has been
+        released, even after the PakFile is closed.
+
+        Raises:
+            EOFError: If the member extends past the end of the archive.
+        """
+
+        if self._mmap is None:
+            raise RuntimeError('read_view() requires a PakFile opened with mmap=True')
+
+        if not self.fp:
+            raise RuntimeError('Attempt to read PAK archive that was already closed')
+
+        info = self.getinfo(name)
+        end = info.file_offset + info.file_size
+
+        if end > len(self._mmap):
+            raise EOFError('Member %r extends past the end of the archive' % info.filename)
+
+        if open_hook is not None:
+            open_hook(self, info)
+
+        return memoryview(self._mmap)[info.file_offset:end]
+
     def open(self, name, mode='r'):
         """Return a file-like object for 'name'."""
 
@@ -469,17 +869,26 @@ class PakFile(object):
         if mode == 'w':
             return self._open_to_write(info)
 
+        if open_hook is not None:
+            open_hook(self, info)
+
+        return self._open_to_read(info)
+
+    def _open_to_read(self, pak_info):
+        """Returns a file-like object for pak_info without calling
+        open_hook, for reads the archive makes itself."""
+
         self._file_reference_count += 1
-        shared_file = _SharedFile(self.fp, info.file_offset, info.file_size, self._fpclose, self._lock)
+        shared_file = _SharedFile(self.fp, pak_info.file_offset, pak_info.file_size, self._fpclose, self._lock, self._fileno)
 
         try:
-            return PakExtFile(shared_file, mode, info, True)
+            return PakExtFile(shared_file, 'r', pak_info, True)
 
         except:
             shared_file.close()
             raise
 
-    def _open_to_write(self, pak_info):
+    def _open_to_write(self, pak_info, digest=None):
         if self._writing:
             raise ValueError("Can't write to the PAK file while there is "
                              "another write handle open on it. Close the first"
@@ -487,8 +896,9 @@ class PakFile(object):
 
         self._did_modify = True
         self._writing = True
+        pak_info.file_offset = self._start_write()
 
-        return _PakWriteFile(self, pak_info)
+        return _PakWriteFile(self, pak_info, digest)
 
     def extract(self, member, path=None):
         """Extract a member from the pak file to the current working directory
@@ -508,7 +918,7 @@ class PakFile(object):
 
         return self._extract_member(member, path)
 
-    def extractall(self, path=None, members=None):
+    def extractall(self, path=None, members=None, workers=None):
         """Extract all members from the pak file to the current working
         directory.
 
@@ -518,13 +928,71 @@ class PakFile(object):
         members: The names of the members to extract. This must be a subset of
             the list returned by namelist(). All members will be extracted if
             None.
+
+        workers: The number of threads to extract with. Defaults to the
+            number of CPUs. Members are extracted one at a time if 1, or if
+            the archive is not a file opened for reading.
+        """
+
+        for member, error in self.iter_extract(path, members, workers):
+            if error is not None:
+                raise error
+
+    def iter_extract(self, path=None, members=None, workers=None):
+        """Extract members like extractall() and yield (info, error) for
+        each member as soon as it has been extracted, in the order they
+        finish. error is the exception raised while extracting the member,
+        or None. Extraction carries on past members that fail.
         """
 
         if members is None:
             members = self.namelist()
 
-        for pakinfo in members:
-            self.extract(pakinfo, path)
+        if path is None:
+            path = os.getcwd()
+
+        members = [m if isinstance(m, PakInfo) else self.getinfo(m) for m in members]
+        fileno = self._extract_fileno()
+
+        if fileno is None or workers == 1:
+            for pakinfo in members:
+                try:
+                    self.extract(pakinfo, path)
+
+                except Exception as e:
+                    yield pakinfo, e
+                    continue
+
+                yield pakinfo, None
+
+            return
+
+        targets = [self._target_path(m, path) for m in members]
+
+        # Create every directory once up front rather than once per member
+        for directory in sorted({os.path.dirname(t) for t in targets}):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        def copy(member, target_path):
+            if member.filename[-1] == '/':
+                os.makedirs(target_path, exist_ok=True)
+                return
+
+            with open(target_path, 'wb') as target:
+                _copy_range(fileno, target.fileno(), member.file_offset, member.file_size)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(copy, m, t): m for m, t in zip(members, targets)}
+
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.exception()
+
+    def _extract_fileno(self):
+        """Returns the file descriptor to extract members from with positional
+        reads, or None if members have to be read through open()."""
+
+        return self._fileno if self.fp else None
 
     @classmethod
     def _sanitize_windows_name(cls, archive_name, path_separator):
@@ -547,9 +1015,9 @@ class PakFile(object):
 
         return archive_name
 
-    def _extract_member(self, member, target_path):
-        """Extract the PakInfo object 'member' to a physical file on the path
-        target_path.
+    def _target_path(self, member, target_path):
+        """Returns the path the PakInfo object 'member' is extracted to
+        within target_path.
         """
 
         # Build the destination pathname, replacing forward slashes to
@@ -570,7 +1038,15 @@ class PakFile(object):
             archive_name = self._sanitize_windows_name(archive_name, os.path.sep)
 
         target_path = os.path.join(target_path, archive_name)
-        target_path = os.path.normpath(target_path)
+
+        return os.path.normpath(target_path)
+
+    def _extract_member(self, member, target_path):
+        """Extract the PakInfo object 'member' to a physical file on the path
+        target_path.
+        """
+
+        target_path = self._target_path(member, target_path)
 
         # Create all upper directories if necessary.
         upperdirs = os.path.dirname(target_path)
@@ -605,7 +1081,6 @@ class PakFile(object):
             raise ValueError
 
         info = PakInfo.from_file(filename)
-        info.file_offset = self.fp.tell()
 
         if arcname:
             info.filename = arcname
@@ -641,8 +1116,6 @@ class PakFile(object):
         else:
             info = info_or_arcname
 
-        info.file_offset = self.fp.tell()
-
         if not info.file_size:
             info.file_size = len(data)
 
@@ -651,6 +1124,23 @@ class PakFile(object):
         if isinstance(data, str):
             data = data.encode('ascii')
 
+        digest = None
+
+        # Skip writing bytes that are already in the archive
+        if self.dedup and isinstance(data, bytes) and data:
+            digest = hashlib.sha1(data).digest()
+            offset = self._find_duplicate(len(data), digest)
+
+            if offset is not None:
+                info.file_offset = offset
+                info.file_size = len(data)
+                self.duplicate_count += 1
+                self.duplicate_size += len(data)
+                self._did_modify = True
+                self._add_info(info)
+
+                return
+
         if isinstance(data, bytes):
             data = io.BytesIO(data)
             should_close = True
@@ -658,12 +1148,318 @@ class PakFile(object):
         if not hasattr(data, 'read'):
             raise BadPakFile('Invalid data type. Pak.writestr expects a string or bytes.')
 
-        with self.open(info, 'w') as dest:
+        with self._open_to_write(info, digest) as dest:
             shutil.copyfileobj(data, dest, 8*1024)
 
         if should_close:
             data.close()
 
+    def build(self, tree, order=None, workers=None):
+        """Write every file of a directory tree into the pak file at once.
+
+        The files are stat'ed in parallel and the offset of every member is
+        worked out before any data is written. The members are then copied
+        back to back in one sequential pass, by the kernel where it can, and
+        the directory is written once when the pak file is closed. The same
+        files in the same order always give the same pak file.
+
+        Args:
+            tree: Either the path to a directory, whose files are added under
+                their paths relative to it, or a dict of member names to the
+                paths of the files to add.
+
+            order: Optional. Either a function returning a sort key for a
+                member name, or a sequence of member names to write first in
+                that order. Names in the sequence that are not in the tree are
+                ignored. All other members are written in sorted order.
+
+            workers: Optional. The number of threads to stat files with.
+                Defaults to the number of CPUs.
+
+        Returns:
+            A list of the PakInfo objects written, in the order they were
+            written.
+        """
+
+        if self.mode not in ('w', 'a'):
+            raise RuntimeError("build() requires mode 'w' or 'a'")
+
+        if not self.fp:
+            raise RuntimeError('Attempt to write to PAK archive that was already closed')
+
+        if self._writing:
+            raise ValueError("Can't write to the PAK file while there is "
+                             "another write handle open on it.")
+
+        if isinstance(tree, str):
+            paths = {}
+
+            for root, dirs, files in os.walk(tree):
+                for file_name in files:
+                    path = os.path.join(root, file_name)
+                    paths[os.path.relpath(path, tree).replace(os.sep, '/')] = path
+
+        else:
+            paths = dict(tree)
+
+        names = sorted(paths)
+
+        if callable(order):
+            names.sort(key=order)
+
+        elif order is not None:
+            first = [name for name in dict.fromkeys(order) if name in paths]
+            ordered = set(first)
+            names = first + [name for name in names if name not in ordered]
+
+        def measure(name):
+            if len(name) > 56:
+                raise BadPakFile('PakFile filename must be 56 characters or less')
+
+            st = os.stat(paths[name])
+
+            if stat.S_ISDIR(st.st_mode):
+                raise RuntimeError('PakFile expects a file, got a directory')
+
+            if not self.dedup or not st.st_size:
+                return st.st_size, None
+
+            with open(paths[name], 'rb') as file:
+                return st.st_size, _sha1(file)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            measurements = list(executor.map(measure, names))
+
+        with self._lock:
+            # Lay out the members after the last one
+            offset = self.start_of_directory
+            infos = []
+            copies = []
+
+            for name, (size, digest) in zip(names, measurements):
+                info = PakInfo(name, offset, size)
+                infos.append(info)
+
+                if digest is not None and self._deduplicate(info, digest):
+                    continue
+
+                copies.append((paths[name], 0, size))
+                offset += size
+
+            self._did_modify = True
+            self._copy_files(copies)
+            self.start_of_directory = offset
+
+            for info in infos:
+                self._add_info(info)
+
+            self.fp.seek(self.start_of_directory)
+
+        return infos
+
+    def _copy_files(self, copies):
+        """Copies the byte ranges in copies, a list of (path, offset, size)
+        tuples, one after another from the start of the directory."""
+
+        fp = self.fp
+        fp.seek(self.start_of_directory)
+
+        try:
+            fileno = fp.fileno()
+
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            fileno = None
+
+        if fileno is not None:
+            fp.flush()
+            os.lseek(fileno, self.start_of_directory, os.SEEK_SET)
+
+        source = None
+
+        try:
+            for path, offset, size in copies:
+                # Consecutive ranges of the same file share one open file
+                if source is None or source.name != path:
+                    if source is not None:
+                        source.close()
+
+                    source = open(path, 'rb')
+
+                if fileno is not None:
+                    _copy_range(source.fileno(), fileno, offset, size)
+                    continue
+
+                source.seek(offset)
+                remaining = size
+
+                while remaining:
+                    data = source.read(min(_COPY_BUFFER_SIZE, remaining))
+
+                    if not data:
+                        raise EOFError
+
+                    fp.write(data)
+                    remaining -= len(data)
+
+        finally:
+            if source is not None:
+                source.close()
+
+        # Seeking from the end makes the file object pick up the position of
+        # its descriptor again after the copies
+        if fileno is not None:
+            fp.seek(0, io.SEEK_END)
+
+    def _reset_digests(self):
+        """Forgets the digests of all members. Members already in the
+        archive are only hashed once a member of the same size is written."""
+
+        self._digests = {}
+        self._unhashed = {}
+
+        if not self.dedup:
+            return
+
+        for info in self.file_list:
+            self._unhashed.setdefault(info.file_size, []).append(info)
+
+    def _find_duplicate(self, size, digest):
+        """Returns the offset of the bytes of a member with the given size
+        and digest, or None if there is none."""
+
+        for info in self._unhashed.pop(size, ()):
+            with self._open_to_read(info) as member:
+                self._digests.setdefault((size, _sha1(member)), info.file_offset)
+
+        return self._digests.get((size, digest))
+
+    def _deduplicate(self, info, digest):
+        """Points info at the bytes of an identical member if there is one.
+
+        Returns:
+            True if info is a duplicate.
+        """
+
+        if not info.file_size:
+            return False
+
+        offset = self._find_duplicate(info.file_size, digest)
+
+        if offset is None:
+            self._digests[info.file_size, digest] = info.file_offset
+            return False
+
+        info.file_offset = offset
+        self.duplicate_count += 1
+        self.duplicate_size += info.file_size
+
+        return True
+
+    def _start_write(self):
+        """Moves the file pointer to where the next member is written, which
+        reading members through the shared file object may have moved, and
+        returns its offset."""
+
+        self.fp.seek(self.start_of_directory)
+
+        return self.start_of_directory
+
+    def remove(self, name):
+        """Remove the member 'name' from the directory. The bytes of the
+        member are left in the archive until compact() is called.
+
+        Args:
+            name: Either the name of the member or a PakInfo object.
+
+        Raises:
+            KeyError: If there is no member named 'name'.
+        """
+
+        if self.mode not in ('w', 'a'):
+            raise RuntimeError("remove() requires mode 'w' or 'a'")
+
+        if not self.fp:
+            raise RuntimeError('Attempt to write to PAK archive that was already closed')
+
+        if self._writing:
+            raise ValueError("Can't remove a member while there is a write "
+                             "handle open on the PAK file.")
+
+        if isinstance(name, PakInfo):
+            name = name.filename
+
+        info = self.getinfo(name)
+
+        with self._lock:
+            self.file_list.remove(info)
+            del self.NameToInfo[name]
+            self._did_modify = True
+
+    def unused_size(self):
+        """Return the number of bytes between the header and the directory
+        that do not belong to any member, which compact() would reclaim."""
+
+        used = sum(end - start for start, end in _merge_spans(self.file_list))
+
+        return self.start_of_directory - header_size - used
+
+    def compact(self):
+        """Move every member towards the start of the archive to remove the
+        space left behind by removed and replaced members, then rewrite the
+        directory after the last member and truncate the file. Members are
+        moved in order of their offsets in large sequential copies and
+        members sharing bytes keep sharing them.
+
+        Note: The archive is rewritten in place. If the process is
+        interrupted before the directory is written the archive is left
+        unreadable.
+
+        Returns:
+            The number of bytes reclaimed.
+        """
+
+        if self.mode not in ('w', 'a'):
+            raise RuntimeError("compact() requires mode 'w' or 'a'")
+
+        if not self.fp:
+            raise RuntimeError('Attempt to write to PAK archive that was already closed')
+
+        if self._writing:
+            raise ValueError("Can't compact the PAK file while there is a "
+                             "write handle open on it.")
+
+        with self._lock:
+            unused_size = self.unused_size()
+            spans = _merge_spans(self.file_list)
+            starts = [start for start, end in spans]
+            shifts = []
+            position = header_size
+
+            for start, end in spans:
+                if start != position:
+                    _move_range(self.fp, start, position, end - start)
+
+                shifts.append(position - start)
+                position += end - start
+
+            for info in self.file_list:
+                if not info.file_size:
+                    info.file_offset = header_size
+                    continue
+
+                span = bisect.bisect_right(starts, info.file_offset) - 1
+                info.file_offset += shifts[span]
+
+            self.start_of_directory = position
+            self._did_modify = True
+            self._reset_digests()
+
+            self.fp.seek(self.start_of_directory)
+            self._write_directory()
+            self.fp.seek(self.start_of_directory)
+
+        return unused_size
+
     def close(self):
         """Close the file."""
 
@@ -683,6 +1479,22 @@ class PakFile(object):
             fp = self.fp
             self.fp = None
             self._fpclose(fp)
+            self._unmap()
+
+    def _unmap(self):
+        if self._mmap is None:
+            return
+
+        mapping = self._mmap
+        self._mmap = None
+
+        # Views returned by read_view() keep the mapping alive until they are
+        # released, after which it is closed when collected.
+        try:
+            mapping.close()
+
+        except BufferError:
+            pass
 
     def _fpclose(self, fp):
         assert self._file_reference_count > 0
@@ -690,3 +1502,187 @@ class PakFile(object):
 
         if not self._file_reference_count and not self._file_passed:
             fp.close()
+
+
+class AccessTrace(object):
+    """Records the members read from pak files, in the order they are read.
+
+    While it is installed as open_hook every member read through
+    PakFile.open(), PakFile.read() or PakFile.read_view() is recorded,
+    including reads made through a vfs.SearchPath. The trace can be passed
+    to repack() to put members that are read together next to each other.
+
+    Example:
+        with pak.AccessTrace() as trace:
+            search_path.read('maps/e1m1.bsp')
+
+        trace.save('e1m1.trace', 'id1/pak0.pak')
+
+    Attributes:
+        accesses: A list of (archive filename, member name) tuples in the
+            order they were read.
+    """
+
+    __slots__ = (
+        'accesses',
+        '_previous_hook'
+    )
+
+    def __init__(self):
+        self.accesses = []
+        self._previous_hook = None
+
+    def __call__(self, pak_file, info):
+        self.accesses.append((pak_file.filename, info.filename))
+
+    def __enter__(self):
+        global open_hook
+
+        self._previous_hook = open_hook
+        open_hook = self
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        global open_hook
+
+        open_hook = self._previous_hook
+        self._previous_hook = None
+
+    def names(self, archive=None):
+        """Returns the names of the members read in the order they were first
+        read.
+
+        Args:
+            archive: Optional. If given only the members read from the pak
+                file at this path are returned.
+        """
+
+        if archive is not None:
+            archive = os.path.abspath(archive)
+
+        return list(dict.fromkeys(
+            name for filename, name in self.accesses
+            if archive is None or (isinstance(filename, str) and os.path.abspath(filename) == archive)
+        ))
+
+    def save(self, file, archive=None):
+        """Writes the names returned by names() to a text file, one per line.
+
+        Args:
+            file: Either the path to the file, or a file-like object opened in
+                text mode.
+
+            archive: Optional. If given only the members read from the pak
+                file at this path are written.
+        """
+
+        lines = ''.join('%s\n' % name for name in self.names(archive))
+
+        if isinstance(file, str):
+            with open(file, 'w') as text_file:
+                text_file.write(lines)
+
+        else:
+            file.write(lines)
+
+
+def count_seeks(infos, names):
+    """Estimates the seeks needed to read members one after another.
+
+    A read that does not start where the previous one ended counts as a
+    seek, including the first one.
+
+    Args:
+        infos: A dict of member names to PakInfo objects, such as
+            PakFile.NameToInfo.
+
+        names: The names of the members in the order they are read. Names
+            not in infos are skipped.
+
+    Returns:
+        A tuple of the number of seeks and the total distance in bytes
+        moved by them.
+    """
+
+    seeks = 0
+    distance = 0
+    position = None
+
+    for name in names:
+        info = infos.get(name)
+
+        if info is None:
+            continue
+
+        if info.file_offset != position:
+            seeks += 1
+
+            if position is not None:
+                distance += abs(info.file_offset - position)
+
+        position = info.file_offset + info.file_size
+
+    return seeks, distance
+
+
+def repack(file, target, order=()):
+    """Writes a copy of a pak file with its members rearranged.
+
+    The members named in order come first, in that order, followed by the
+    rest in the order of their offsets. Passing the names of an access
+    trace in the order they were first read puts members that are read
+    together next to each other, so they are read without seeking. Members
+    sharing bytes in the source keep sharing them.
+
+    Args:
+        file: The path to the pak file to read.
+
+        target: The path to the pak file to write. Must not be file.
+
+    Raises:
+        ValueError: If target is the same file as file.
+
+        order: Optional. The member names to write first. Names not in the
+            pak file are ignored.
+
+    Returns:
+        A list of the PakInfo objects written, in the order they were
+        written.
+    """
+
+    # Opening the target for writing would truncate the source
+    if os.path.exists(target) and os.path.samefile(file, target):
+        raise ValueError('repack() can not write %r over itself' % file)
+
+    with PakFile(file) as source, PakFile(target, 'w') as pak_file:
+        first = [name for name in dict.fromkeys(order) if name in source.NameToInfo]
+        ordered = set(first)
+        rest = sorted((i for i in source.file_list if i.filename not in ordered), key=lambda i: i.file_offset)
+        members = [source.NameToInfo[name] for name in first] + rest
+
+        offset = pak_file.start_of_directory
+        offsets = {}
+        infos = []
+        copies = []
+
+        for member in members:
+            key = member.file_offset, member.file_size
+            info = PakInfo(member.filename, offsets.get(key, offset), member.file_size)
+            infos.append(info)
+
+            if key in offsets or not member.file_size:
+                continue
+
+            offsets[key] = offset
+            copies.append((file, member.file_offset, member.file_size))
+            offset += member.file_size
+
+        with pak_file._lock:
+            pak_file._copy_files(copies)
+            pak_file.start_of_directory = offset
+
+            for info in infos:
+                pak_file._add_info(info)
+
+    return infos
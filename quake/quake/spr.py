@@ -16,6 +16,8 @@ References:
 import io
 import struct
 
+from .pak import _ViewFile
+
 __all__ = ['BadSprFile', 'Spr', 'is_sprfile']
 
 
@@ -368,7 +370,8 @@ class Spr(object):
         """Returns an Spr object
 
         Args:
-            file: Either the path to the file, a file-like object, or bytes.
+            file: Either the path to the file, a file-like object, bytes, or
+                a memoryview.
 
             mode: An optional string that indicates which mode to open the file
 
@@ -388,6 +391,9 @@ class Spr(object):
         elif isinstance(file, bytes):
             file = io.BytesIO(file)
 
+        elif isinstance(file, memoryview):
+            file = _ViewFile(file)
+
         elif not hasattr(file, 'read'):
             raise RuntimeError(
                 "Spr.open() requires 'file' to be a path, a file-like object, or bytes")
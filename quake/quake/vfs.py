@@ -0,0 +1,268 @@
+"""This module provides a layered virtual filesystem over Quake PAK files and
+directories.
+
+Example:
+    with vfs.SearchPath() as search_path:
+        search_path.add_game_directory('id1')
+        search_path.add_game_directory('mymod')
+
+        data = search_path.read('progs/player.mdl')
+
+References:
+    Quake Source
+    - id Software
+    - https://github.com/id-Software/Quake
+"""
+
+import fnmatch
+import io
+import os
+import re
+
+try:
+    import threading
+
+except ImportError:
+    import dummy_threading as threading
+
+from . import pak
+
+
+__all__ = ['SearchPath']
+
+
+class _PakLayer(object):
+    """A PAK file in the search path. The archive is only opened once one of
+    its members is accessed."""
+
+    __slots__ = (
+        'path',
+        'mmap',
+        '_pak_file',
+        '_lock'
+    )
+
+    def __init__(self, path, mmap=False):
+        self.path = path
+        self.mmap = mmap
+        self._pak_file = None
+        self._lock = threading.Lock()
+
+    def names(self):
+        """Returns a dict of member names to PakInfo objects."""
+
+        with pak.PakFile(self.path) as pak_file:
+            return dict(pak_file.NameToInfo)
+
+    def pak_file(self):
+        if self._pak_file is None:
+            with self._lock:
+                if self._pak_file is None:
+                    self._pak_file = pak.PakFile(self.path, mmap=self.mmap)
+
+        return self._pak_file
+
+    def open(self, entry):
+        return self.pak_file().open(entry)
+
+    def read(self, entry):
+        return self.pak_file().read(entry.filename)
+
+    def close(self):
+        if self._pak_file is not None:
+            self._pak_file.close()
+            self._pak_file = None
+
+
+class _DirectoryLayer(object):
+    """A directory of loose files in the search path."""
+
+    __slots__ = (
+        'path',
+    )
+
+    def __init__(self, path):
+        self.path = path
+
+    def names(self):
+        """Returns a dict of the relative names of all files in the directory
+        to their paths."""
+
+        names = {}
+
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            relative_root = os.path.relpath(root, self.path)
+
+            for file_name in sorted(files):
+                name = file_name if relative_root == os.curdir else os.path.join(relative_root, file_name)
+                names[name.replace(os.sep, '/')] = os.path.join(root, file_name)
+
+        return names
+
+    def open(self, entry):
+        return io.open(entry, 'rb')
+
+    def read(self, entry):
+        with io.open(entry, 'rb') as file:
+            return file.read()
+
+    def close(self):
+        pass
+
+
+class SearchPath(object):
+    """Class for looking up files across PAK files and directories
+
+    Layers are searched in reverse order of being added, so a file in a later
+    layer overrides the file with the same name in an earlier one. The names
+    of all layers are merged into a single index when each layer is added,
+    so lookups do not depend on the number of layers. PAK files are opened
+    the first time one of their members is read.
+
+    Example:
+        search_path = SearchPath(['id1/pak0.pak', 'id1/pak1.pak', 'mymod'])
+        bsp_file = bsp.Bsp.open(search_path.open('maps/e1m1.bsp'))
+
+    Attributes:
+        layers: The paths of the layers in the order they were added.
+
+        mmap: Whether PAK files are memory mapped.
+    """
+
+    __slots__ = (
+        'layers',
+        'mmap',
+        '_layers',
+        '_index'
+    )
+
+    def __init__(self, paths=(), mmap=False):
+        """Constructs a SearchPath object
+
+        Args:
+            paths: Optional. PAK files and directories to add, lowest
+                priority first.
+
+            mmap: Optional. If True PAK files are memory mapped.
+        """
+
+        self.layers = []
+        self.mmap = mmap
+        self._layers = []
+        self._index = {}
+
+        for path in paths:
+            self.add(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, path):
+        """Adds a PAK file or directory as the highest priority layer.
+
+        Args:
+            path: The path to a PAK file or a directory.
+
+        Raises:
+            BadPakFile: If path is a file but not a PAK file.
+        """
+
+        if os.path.isdir(path):
+            layer = _DirectoryLayer(path)
+
+        else:
+            layer = _PakLayer(path, self.mmap)
+
+        number = len(self._layers)
+        names = layer.names()
+        self._layers.append(layer)
+        self.layers.append(path)
+        self._index.update({name: (number, entry) for name, entry in names.items()})
+
+    def add_game_directory(self, path):
+        """Adds a game directory the way Quake does: the loose files first,
+        then pak0.pak, pak1.pak, ... in order until one is missing. A PAK
+        file therefore overrides the loose files of its directory.
+
+        Args:
+            path: The path to the game directory, e.g. 'id1'.
+        """
+
+        self.add(path)
+        number = 0
+
+        while True:
+            pak_path = os.path.join(path, 'pak%i.pak' % number)
+
+            if not os.path.isfile(pak_path):
+                break
+
+            self.add(pak_path)
+            number += 1
+
+    def _lookup(self, name):
+        try:
+            number, entry = self._index[name]
+
+        except KeyError:
+            raise KeyError('There is no item named %r in the search path' % name)
+
+        return self._layers[number], entry
+
+    def exists(self, name):
+        """Returns True if any layer has a file named 'name'."""
+
+        return name in self._index
+
+    def find(self, name):
+        """Returns the path of the layer that provides 'name'."""
+
+        layer, entry = self._lookup(name)
+
+        return layer.path
+
+    def open(self, name):
+        """Returns a binary file-like object for 'name' from the highest
+        priority layer that has it."""
+
+        layer, entry = self._lookup(name)
+
+        return layer.open(entry)
+
+    def read(self, name):
+        """Returns the bytes of 'name' from the highest priority layer that
+        has it."""
+
+        layer, entry = self._lookup(name)
+
+        return layer.read(entry)
+
+    def namelist(self):
+        """Returns a sorted list of every name in the search path."""
+
+        return sorted(self._index)
+
+    def glob(self, pattern):
+        """Returns a sorted list of the names matching a shell-style pattern,
+        e.g. 'maps/*.bsp'. A '*' matches across '/' as well.
+        """
+
+        match = re.compile(fnmatch.translate(pattern)).match
+
+        return sorted(name for name in self._index if match(name))
+
+    def close(self):
+        """Closes all open PAK files."""
+
+        for layer in self._layers:
+            layer.close()
@@ -13,6 +13,8 @@ References:
     - http://www.gamers.org/dEngine/quake/spec/quake-spec34/qkspec_7.htm
 """
 
+import concurrent.futures
+import hashlib
 import io
 import os
 import shutil
@@ -139,6 +141,50 @@ class WadInfo(object):
         return info
 
 
+# Size of the chunks used to copy members when the copy can not be done by
+# the kernel
+_COPY_BUFFER_SIZE = 1 << 20
+
+
+def _copy_range(source, target, offset, size):
+    """Copies size bytes at offset of the source file descriptor to the
+    current position of the target file descriptor."""
+
+    position = offset
+    end = offset + size
+
+    # Let the kernel copy the bytes directly between the files when it can
+    for copy in ('copy_file_range', 'sendfile'):
+        if position >= end or not hasattr(os, copy):
+            continue
+
+        try:
+            while position < end:
+                if copy == 'copy_file_range':
+                    count = os.copy_file_range(source, target, end - position, position)
+
+                else:
+                    count = os.sendfile(target, source, position, end - position)
+
+                if not count:
+                    break
+
+                position += count
+
+        except OSError:
+            # Not supported between these files, fall back to the next method
+            continue
+
+    while position < end:
+        data = os.pread(source, min(_COPY_BUFFER_SIZE, end - position), position)
+
+        if not data:
+            raise EOFError
+
+        os.write(target, data)
+        position += len(data)
+
+
 class _SharedFile:
     def __init__(self, file, position, size, close, lock):
         self._file = file
@@ -185,7 +231,7 @@ class WadExtFile(io.BufferedIOBase):
         self._close_file_object = close_file_object
         self._bytes_left = wad_info.file_size
 
-        self._eof = False
+        self._eof = self._bytes_left <= 0
         self._readbuffer = b''
         self._offset = 0
         self._size = wad_info.file_size
@@ -286,11 +332,15 @@ class WadExtFile(io.BufferedIOBase):
 
 
 class _WadWriteFile(io.BufferedIOBase):
-    def __init__(self, wad_file, wad_info):
+    def __init__(self, wad_file, wad_info, digest=None):
         self._wad_info = wad_info
         self._wad_file = wad_file
         self._file_size = 0
 
+        # The data is hashed as it is written unless its digest is given
+        self._digest = digest
+        self._hash = hashlib.sha1() if wad_file.dedup and digest is None else None
+
     @property
     def _fileobj(self):
         return self._wad_file.fp
@@ -303,13 +353,26 @@ class _WadWriteFile(io.BufferedIOBase):
         self._file_size += number_of_bytes
         self._fileobj.write(data)
 
+        if self._hash is not None:
+            self._hash.update(data)
+
         return number_of_bytes
 
     def close(self):
         super().close()
 
-        self._wad_file.start_of_directory = self._fileobj.tell()
         self._wad_file._writing = False
+        end_of_member = self._fileobj.tell()
+
+        # A duplicate is pointed at the bytes already in the archive and the
+        # copy just written is overwritten by the next member or directory
+        if self._hash is not None:
+            self._digest = self._hash.digest()
+
+        if self._digest is None or not self._wad_file._deduplicate(self._wad_info, self._file_size, self._digest):
+            self._wad_file.start_of_directory = end_of_member
+
+        self._fileobj.seek(self._wad_file.start_of_directory)
         self._wad_file.file_list.append(self._wad_info)
         self._wad_file.NameToInfo[self._wad_info.filename] = self._wad_info
 
@@ -317,18 +380,23 @@ class _WadWriteFile(io.BufferedIOBase):
 class WadFile(object):
     """Class with methods to open, read, close, and list wad files.
 
-     p = WadFile(file, mode='r')
+     p = WadFile(file, mode='r', dedup=False)
 
     file: Either the path to the file, or a file-like object. If it is a path,
         the file will be opened and closed by WadFile.
 
     mode: Currently the only supported mode is 'r'
+
+    dedup: If True members written with identical bytes are stored once, and
+        the directory entries of the duplicates point at the same bytes. The
+        number of duplicates and the bytes they saved are counted in
+        duplicate_count and duplicate_size.
     """
 
     fp = None
     _windows_illegal_name_trans_table = None
 
-    def __init__(self, file, mode='r'):
+    def __init__(self, file, mode='r', dedup=False):
         if mode not in ('r', 'w', 'a'):
             raise RuntimeError("WadFile requires mode 'r', 'w', or 'a'")
 
@@ -341,6 +409,12 @@ class WadFile(object):
         self._lock = threading.RLock()
         self._writing = False
 
+        self.dedup = dedup
+        self.duplicate_count = 0
+        self.duplicate_size = 0
+        self._digests = {}
+        self._unhashed = {}
+
         filemode = {'r': 'rb', 'w': 'w+b', 'a': 'r+b'}[mode]
 
         if isinstance(file, str):
@@ -372,6 +446,13 @@ class WadFile(object):
                     self._read_archive_content()
                     self.fp.seek(self.start_of_directory)
 
+                    # Members already in the archive are only hashed once a
+                    # member of the same size is written
+                    if dedup:
+                        for info in self.file_list:
+                            if info.compression == CMP_NONE:
+                                self._unhashed.setdefault(info.file_size, []).append(info)
+
                 except BadWadFile:
                     # Don't support appending to non-wad file
                     raise
@@ -454,10 +535,64 @@ class WadFile(object):
                                   count,
                                   self.start_of_directory)
 
+        end_of_directory = self.fp.tell()
         self.fp.seek(0)
         self.fp.write(header_data)
         self.fp.flush()
 
+        # Bytes written for a duplicate member can extend past the directory
+        try:
+            self.fp.truncate(end_of_directory)
+
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+
+    def _find_duplicate(self, size, digest):
+        """Returns the offset of the bytes of a member with the given size
+        and digest, or None if there is none."""
+
+        unhashed = self._unhashed.pop(size, ())
+
+        if unhashed:
+            position = self.fp.tell()
+
+            for info in unhashed:
+                digest_of_info = hashlib.sha1()
+
+                with self.open(info) as member:
+                    for chunk in iter(lambda: member.read(_COPY_BUFFER_SIZE), b''):
+                        digest_of_info.update(chunk)
+
+                self._digests.setdefault((size, digest_of_info.digest()), info.file_offset)
+
+            # Reading moves the file pointer away from the end of the members
+            self.fp.seek(position)
+
+        return self._digests.get((size, digest))
+
+    def _deduplicate(self, info, size, digest):
+        """Points info at the identical size bytes of another member if
+        there is one.
+
+        Returns:
+            True if info is a duplicate.
+        """
+
+        if not size:
+            return False
+
+        offset = self._find_duplicate(size, digest)
+
+        if offset is None:
+            self._digests[size, digest] = info.file_offset
+            return False
+
+        info.file_offset = offset
+        self.duplicate_count += 1
+        self.duplicate_size += size
+
+        return True
+
     def namelist(self):
         """Return a list of file names in the wad file."""
 
@@ -518,7 +653,7 @@ class WadFile(object):
             shared_file.close()
             raise
 
-    def _open_to_write(self, wad_info):
+    def _open_to_write(self, wad_info, digest=None):
         if self._writing:
             raise ValueError("Can't write to the WAD file while there is "
                              "another write handle open on it. Close the first"
@@ -527,7 +662,7 @@ class WadFile(object):
         self._did_modify = True
         self._writing = True
 
-        return _WadWriteFile(self, wad_info)
+        return _WadWriteFile(self, wad_info, digest)
 
     def extract(self, member, path=None):
         """Extract a member from the wad file to the current working directory
@@ -547,7 +682,7 @@ class WadFile(object):
 
         return self._extract_member(member, path)
 
-    def extractall(self, path=None, members=None):
+    def extractall(self, path=None, members=None, workers=None):
         """Extract all members from the wad file to the current working
         directory.
 
@@ -557,13 +692,78 @@ class WadFile(object):
         members: The names of the members to extract. This must be a subset of
             the list returned by namelist(). All members will be extracted if
             None.
+
+        workers: The number of threads to extract with. Defaults to the
+            number of CPUs. Members are extracted one at a time if 1, or if
+            the archive is not a file opened for reading.
+        """
+
+        for member, error in self.iter_extract(path, members, workers):
+            if error is not None:
+                raise error
+
+    def iter_extract(self, path=None, members=None, workers=None):
+        """Extract members like extractall() and yield (info, error) for
+        each member as soon as it has been extracted, in the order they
+        finish. error is the exception raised while extracting the member,
+        or None. Extraction carries on past members that fail.
         """
 
         if members is None:
             members = self.namelist()
 
-        for wadinfo in members:
-            self.extract(wadinfo, path)
+        if path is None:
+            path = os.getcwd()
+
+        members = [m if isinstance(m, WadInfo) else self.getinfo(m) for m in members]
+        fileno = self._extract_fileno()
+
+        if fileno is None or workers == 1:
+            for wadinfo in members:
+                try:
+                    self.extract(wadinfo, path)
+
+                except Exception as e:
+                    yield wadinfo, e
+                    continue
+
+                yield wadinfo, None
+
+            return
+
+        targets = [self._target_path(m, path) for m in members]
+
+        # Create every directory once up front rather than once per member
+        for directory in sorted({os.path.dirname(t) for t in targets}):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        def copy(member, target_path):
+            if member.filename[-1] == '/':
+                os.makedirs(target_path, exist_ok=True)
+                return
+
+            with open(target_path, 'wb') as target:
+                _copy_range(fileno, target.fileno(), member.file_offset, member.file_size)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(copy, m, t): m for m, t in zip(members, targets)}
+
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.exception()
+
+    def _extract_fileno(self):
+        """Returns the file descriptor to extract members from with positional
+        reads, or None if members have to be read through open()."""
+
+        if self.mode != 'r' or not self.fp or not hasattr(os, 'pread'):
+            return None
+
+        try:
+            return self.fp.fileno()
+
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
 
     @classmethod
     def _sanitize_windows_name(cls, archive_name, path_separator):
@@ -586,9 +786,9 @@ class WadFile(object):
 
         return archive_name
 
-    def _extract_member(self, member, target_path):
-        """Extract the WadInfo object 'member' to a physical file on the path
-        target_path.
+    def _target_path(self, member, target_path):
+        """Returns the path the WadInfo object 'member' is extracted to
+        within target_path.
         """
 
         # Build the destination pathname, replacing forward slashes to
@@ -609,7 +809,15 @@ class WadFile(object):
             archive_name = self._sanitize_windows_name(archive_name, os.path.sep)
 
         target_path = os.path.join(target_path, archive_name)
-        target_path = os.path.normpath(target_path)
+
+        return os.path.normpath(target_path)
+
+    def _extract_member(self, member, target_path):
+        """Extract the WadInfo object 'member' to a physical file on the path
+        target_path.
+        """
+
+        target_path = self._target_path(member, target_path)
 
         # Create all upper directories if necessary.
         upperdirs = os.path.dirname(target_path)
@@ -680,6 +888,23 @@ class WadFile(object):
         if isinstance(data, str):
             data = data.encode('ascii')
 
+        digest = None
+
+        # Skip writing bytes that are already in the archive
+        if self.dedup and isinstance(data, bytes) and data:
+            digest = hashlib.sha1(data).digest()
+            offset = self._find_duplicate(len(data), digest)
+
+            if offset is not None:
+                info.file_offset = offset
+                self.duplicate_count += 1
+                self.duplicate_size += len(data)
+                self._did_modify = True
+                self.file_list.append(info)
+                self.NameToInfo[info.filename] = info
+
+                return
+
         if isinstance(data, bytes):
             data = io.BytesIO(data)
             should_close = True
@@ -687,7 +912,7 @@ class WadFile(object):
         if not hasattr(data, 'read'):
             raise BadWadFile('Invalid data type. Wad.writestr expects a string or bytes')
 
-        with data as src, self.open(info, 'w') as dest:
+        with data as src, self._open_to_write(info, digest) as dest:
             shutil.copyfileobj(src, dest, 8*1024)
 
         if should_close:
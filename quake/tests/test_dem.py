@@ -1,10 +1,19 @@
+import asyncio
 import io
+import os
+import tempfile
+import threading
+import time
 import unittest
 
 from tests.basecase import TestCase
 from quake import dem
 
 
+def count_messages(message_blocks):
+    return sum(len(b.messages) for b in message_blocks)
+
+
 class TestDemReadWrite(TestCase):
     def test_bad_message(self):
         dem.Bad.write(self.buff)
@@ -619,6 +628,468 @@ class TestDemReadWrite(TestCase):
         self.assertTrue(fp.closed, 'File should be closed')
         self.assertIsNone(d1.fp, 'File pointer should be cleaned up')
 
+    def test_message_block(self):
+        d = dem.Dem.open('./test_data/test.dem')
+        d.close()
+
+        dem.MessageBlock.write(self.buff, d.message_blocks[1])
+        dem.MessageBlock.write(self.buff, d.message_blocks[2])
+        self.buff.seek(0)
+
+        b0 = dem.MessageBlock.read(self.buff)
+        self.assertEqual(len(b0.messages), len(d.message_blocks[1].messages), 'Message counts should be equal')
+        self.assertTrue(isinstance(b0.messages[0], dem.SpawnBaseline), 'The first message should be a SpawnBaseline')
+
+        b1 = dem.MessageBlock.read(self.buff)
+        self.assertEqual(len(b1.messages), len(d.message_blocks[2].messages), 'Message counts should be equal')
+        self.assertEqual(self.buff.read(), b'', 'Reading a block should consume exactly one block')
+
+        # Blocks can be read from a pipe, which can not seek
+        read_fd, write_fd = os.pipe()
+
+        with io.open(read_fd, 'rb') as reader, io.open(write_fd, 'wb') as writer:
+            writer.write(self.buff.getvalue() + b'\x00')
+            writer.close()
+
+            b2 = dem.MessageBlock.read(reader)
+            b3 = dem.MessageBlock.read(reader)
+            self.assertEqual(len(b2.messages), len(b0.messages), 'Message counts should be equal')
+            self.assertEqual(len(b3.messages), len(b1.messages), 'Message counts should be equal')
+            self.assertEqual(reader.read(), b'\x00', 'Reading a block should not read past it')
+
+    def test_bad_message_block(self):
+        b = dem.MessageBlock()
+        b.view_angles = 0, 0, 0
+        dem.MessageBlock.write(self.buff, b)
+        self.buff.seek(0)
+        data = bytearray(self.buff.read())
+
+        # Claim a message that is not in the block
+        data[0] = 1
+        with self.assertRaises(dem.BadDemFile):
+            dem.MessageBlock.read(io.BytesIO(bytes(data)))
+
+        # Invalid message id
+        with self.assertRaises(dem.BadDemFile):
+            dem.MessageBlock.read(io.BytesIO(bytes(data) + b'\x64'))
+
+        # Time message cut off by the end of the data
+        data[0] = 3
+        truncated = bytes(data) + b'\x07\x00\x00'
+        with self.assertRaises(dem.BadDemFile):
+            dem.MessageBlock.read(io.BytesIO(truncated))
+
+        with dem.Dem.open(b'2\n' + truncated, lazy=True) as d:
+            with self.assertRaisesRegex(dem.BadDemFile, 'offset 2$'):
+                list(d.iter_message_blocks())
+
+    def test_dem_index(self):
+        i0 = dem.DemIndex.build('./test_data/test.dem')
+
+        self.assertEqual(len(i0), 168, 'The index should have 168 message blocks')
+        self.assertEqual(i0.offsets[0], 2, 'The first block should follow the cd track')
+        self.assertEqual(list(i0.sign_ons[:4]), [1, 2, 3, 4], 'Sign on states should be 1, 2, 3, 4')
+        self.assertEqual(i0.times[0], 0.0, 'Blocks before the first Time message should have a time of zero')
+        self.assertAlmostEqual(i0.times[3], 1.421, 3, 'Block time should match its Time message')
+
+        i0.save(self.buff)
+        self.buff.seek(0)
+        i1 = dem.DemIndex.open(self.buff)
+
+        self.assertEqual(i0.size, i1.size, 'Sizes should be equal')
+        self.assertEqual(i0.offsets, i1.offsets, 'Offsets should be equal')
+        self.assertEqual(i0.times, i1.times, 'Times should be equal')
+        self.assertEqual(i0.sign_ons, i1.sign_ons, 'Sign on states should be equal')
+
+        with self.assertRaises(dem.BadDemFile):
+            dem.DemIndex.open(b'IDEM')
+
+    def test_seek(self):
+        with open('./test_data/test.dem', 'rb') as file:
+            d0 = dem.Dem.open(file.read())
+
+        with dem.Dem.open('./test_data/test.dem', lazy=True) as d1:
+            self.assertEqual(d1.cd_track, '2', 'Cd track should be 2')
+            self.assertEqual(len(d1.message_blocks), 0, 'Lazy demos should not read message blocks')
+
+            number = d1.seek(2.0)
+            block = next(d1.iter_message_blocks())
+
+            self.assertLessEqual(block.messages[0].time, 2.0, 'Block should be at or before the seek time')
+            self.assertEqual(block.messages[0].time, d0.message_blocks[number].messages[0].time, 'Times should be equal')
+            self.assertGreater(d0.message_blocks[number + 1].messages[0].time, 2.0, 'Next block should be after the seek time')
+
+            self.assertEqual(d1.seek(-1), 0, 'Seeking before the start should return the first block')
+
+            d1.seek_block(2)
+            blocks = list(d1.iter_message_blocks())
+            self.assertEqual(len(blocks), 166, 'Should read the remaining blocks')
+            self.assertTrue(isinstance(blocks[-1].messages[0], dem.Disconnect), 'The last message should be a Disconnect')
+
+    def test_message_type_filter(self):
+        d0 = dem.Dem.open('./test_data/test.dem')
+        d0.close()
+
+        types = dem.Time, dem.UpdateEntity, dem.ClientData, dem.UpdateFrags
+        d1 = dem.Dem.open('./test_data/test.dem', types=types)
+        d1.close()
+
+        self.assertEqual(len(d0.message_blocks), len(d1.message_blocks), 'Filtering should not drop blocks')
+
+        for b0, b1 in zip(d0.message_blocks, d1.message_blocks):
+            expected = [type(m) for m in b0.messages if isinstance(m, types)]
+            self.assertEqual([type(m) for m in b1.messages], expected, 'Only the given message types should be decoded')
+
+        with self.assertRaises(ValueError):
+            dem.Dem.open('./test_data/test.dem', types=(dem.MessageBlock,))
+
+    def test_parallel_decode(self):
+        d0 = dem.Dem.open('./test_data/test.dem', compact=True)
+        d0.close()
+
+        with open('./test_data/test.dem', 'rb') as file:
+            data = file.read()
+
+        for source in './test_data/test.dem', data:
+            d1 = dem.Dem.open(source, processes=2, compact=True)
+            d1.close()
+
+            self.assertEqual(d1.cd_track, d0.cd_track, 'Cd track should match')
+            self.assertEqual(len(d1.message_blocks), len(d0.message_blocks), 'Should decode every block')
+
+            for b0, b1 in zip(d0.message_blocks, d1.message_blocks):
+                self.assertEqual(repr(b1.view_angles), repr(b0.view_angles), 'View angles should match')
+                self.assertEqual(repr(b1.messages), repr(b0.messages), 'Blocks should be merged in order')
+
+        d2 = dem.Dem.open('./test_data/test.dem', types=(dem.Time,), processes=2)
+        d2.close()
+
+        self.assertTrue(all(isinstance(m, dem.Time) for b in d2.message_blocks for m in b.messages), 'Workers should honor types')
+
+        counts = dem.map_message_blocks('./test_data/test.dem', len, processes=2)
+        self.assertGreater(len(counts), 1, 'The demo should be split into chunks')
+        self.assertEqual(sum(counts), len(d0.message_blocks), 'Every block should be passed to the function')
+
+        counts = dem.map_message_blocks(data, count_messages, processes=2, types=(dem.Time,))
+        self.assertEqual(sum(counts), count_messages(d2.message_blocks), 'Workers should honor types')
+
+        with self.assertRaises(ValueError):
+            dem.Dem.open(self.buff, 'w', processes=2)
+
+        # Sending every message object back is slower than decoding them
+        with self.assertRaises(ValueError):
+            dem.Dem.open('./test_data/test.dem', processes=2)
+
+    def test_write_unseekable(self):
+        class UnseekableFile(object):
+            def __init__(self):
+                self.data = b''
+
+            def write(self, data):
+                self.data += bytes(data)
+
+        with open('./test_data/test.dem', 'rb') as file:
+            data = file.read()
+
+        d0 = dem.Dem.open(data)
+        d0.close()
+
+        file = UnseekableFile()
+        dem.Dem.write(file, d0)
+
+        self.assertEqual(file.data, data, 'Writing should reproduce the original file')
+
+        file = UnseekableFile()
+        dem.MessageBlock.write(file, d0.message_blocks[3])
+        self.buff.write(file.data)
+        self.buff.seek(0)
+        b1 = dem.MessageBlock.read(self.buff)
+
+        self.assertEqual([type(m) for m in b1.messages], [type(m) for m in d0.message_blocks[3].messages], 'Block should round trip')
+
+    def test_cut(self):
+        with open('./test_data/test.dem', 'rb') as file:
+            data = file.read()
+
+        dem.cut(data, self.buff)
+
+        self.assertEqual(self.buff.getvalue(), data, 'Cutting the whole demo should copy it unchanged')
+
+        self.buff = io.BytesIO()
+        dem.cut(data, self.buff, 2.0, 2.5)
+        d = dem.Dem.open(self.buff.getvalue())
+        d.close()
+
+        original = dem.Dem.open(data)
+        original.close()
+
+        times = [m.time for b in d.message_blocks for m in b.messages if isinstance(m, dem.Time)]
+
+        self.assertEqual([type(m) for m in d.message_blocks[1].messages], [type(m) for m in original.message_blocks[1].messages], 'Sign on blocks should be kept')
+        self.assertAlmostEqual(times[1], original.message_blocks[3].messages[0].time, 5, 'First clip block should follow sign on')
+        self.assertAlmostEqual(times[-1] - times[1], 0.497, 2, 'Clip should span the given range')
+        self.assertTrue(isinstance(d.message_blocks[-1].messages[0], dem.Disconnect), 'Clip should end with a Disconnect')
+
+    def test_splice(self):
+        with open('./test_data/test.dem', 'rb') as file:
+            data = file.read()
+
+        dem.splice([data, data], self.buff)
+        d = dem.Dem.open(self.buff.getvalue())
+        d.close()
+
+        times = [m.time for b in d.message_blocks for m in b.messages if isinstance(m, dem.Time)]
+
+        self.assertEqual(len(d.message_blocks), 2 * 168 - 4, 'Sign on blocks should only be kept once')
+        self.assertEqual(times, sorted(times), 'Times should not go backwards')
+
+        first_time = d.message_blocks[167].messages[0].time
+        last_time = d.message_blocks[166].messages[0].time
+        self.assertAlmostEqual(first_time - last_time, 0.014, 3, 'Second demo should start one frame later')
+        self.assertEqual(sum(isinstance(m, dem.Disconnect) for b in d.message_blocks for m in b.messages), 1, 'Only the last block should disconnect')
+
+        server_info = dem.ServerInfo()
+        server_info.map_name = 'e1m2'
+        server_info.models = 'maps/e1m2.bsp',
+        server_info.sounds = ()
+        message_block = dem.MessageBlock()
+        message_block.view_angles = 0, 0, 0
+        message_block.messages.append(server_info)
+
+        other = io.BytesIO()
+        other.write(b'-1\n')
+        dem.MessageBlock.write(other, message_block)
+
+        with self.assertRaises(ValueError):
+            dem.splice([data, other.getvalue()], io.BytesIO())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.dem')
+
+            with open(path, 'wb') as file:
+                file.write(data)
+
+            with self.assertRaises(ValueError):
+                dem.cut(path, path)
+
+            with self.assertRaises(ValueError):
+                dem.splice([data, path], path)
+
+            with open(path, 'rb') as file:
+                self.assertEqual(file.read(), data, 'Input demo should be left intact')
+
+    def test_raw_round_trip(self):
+        with open('./test_data/test.dem', 'rb') as file:
+            data = file.read()
+
+        d0 = dem.Dem.open(data, raw=True)
+        d0.close()
+
+        dem.Dem.write(self.buff, d0)
+
+        self.assertEqual(self.buff.getvalue(), data, 'Unchanged demo should be written verbatim')
+
+        # Change one message, add one and drop one
+        update_names = [m for b in d0.message_blocks for m in b.messages if isinstance(m, dem.UpdateName)]
+        original_names = [m.name for m in update_names]
+        update_names[0].name = 'anon'
+        d0.message_blocks[3].messages.append(dem.Nop())
+        del d0.message_blocks[4].messages[1]
+
+        self.buff = io.BytesIO()
+        dem.Dem.write(self.buff, d0)
+        self.buff.seek(0)
+        d1 = dem.Dem.open(self.buff)
+        d1.close()
+
+        names = [m.name for b in d1.message_blocks for m in b.messages if isinstance(m, dem.UpdateName)]
+        self.assertEqual(names, ['anon'] + original_names[1:], 'Changed message should be written')
+        self.assertTrue(isinstance(d1.message_blocks[3].messages[-1], dem.Nop), 'Added message should be written')
+        self.assertEqual(len(d1.message_blocks[4].messages), len(d0.message_blocks[4].messages), 'Removed message should not be written')
+
+        # Messages that are not decoded are still written back
+        self.buff = io.BytesIO(data)
+        d2 = dem.Dem.open(self.buff, 'a', types=(dem.UpdateName,))
+
+        for message_block in d2.message_blocks:
+            for message in message_block.messages:
+                message.name = 'anon'
+
+        output = io.BytesIO()
+        d2.save(output)
+        d3 = dem.Dem.open(output.getvalue())
+        d3.close()
+
+        expected_size = len(data) - sum(len(n) - len('anon') for n in original_names)
+        self.assertEqual(len(output.getvalue()), expected_size, 'Only the names should change')
+        self.assertEqual(sum(len(b.messages) for b in d3.message_blocks), sum(len(b.messages) for b in dem.Dem.open(data).message_blocks), 'Skipped messages should be kept')
+
+    def test_follow(self):
+        with open('./test_data/test.dem', 'rb') as file:
+            data = file.read()
+
+        d0 = dem.Dem.open(data)
+        d0.close()
+        expected = [[type(m) for m in b.messages] for b in d0.message_blocks]
+
+        def record(path):
+            # Write in uneven chunks so blocks arrive split across reads
+            with open(path, 'ab') as file:
+                for start in range(0, len(data), 777):
+                    file.write(data[start:start + 777])
+                    file.flush()
+                    time.sleep(0.001)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'live.dem')
+
+            for use_async in False, True:
+                open(path, 'wb').close()
+                writer = threading.Thread(target=record, args=(path,))
+                writer.start()
+
+                follower = dem.Dem.follow(path, interval=0.001, timeout=5)
+
+                if use_async:
+                    async def collect():
+                        return [b async for b in follower]
+
+                    blocks = asyncio.run(collect())
+
+                else:
+                    blocks = list(follower)
+
+                writer.join()
+
+                self.assertEqual(follower.cd_track, d0.cd_track, 'Cd track should match')
+                self.assertEqual([[type(m) for m in b.messages] for b in blocks], expected, 'Every block should be read once')
+
+            with dem.Dem.follow(path, types=(dem.Time,), timeout=0) as follower:
+                blocks = list(follower)
+
+            self.assertEqual(len(blocks), len(expected), 'Should stop at the Disconnect')
+            self.assertEqual(blocks[-1].messages, [], 'Disconnect should not be kept when not asked for')
+
+            with open(path, 'wb') as file:
+                file.write(data[:len(data) // 2])
+
+            with dem.Dem.follow(path, timeout=0.01) as follower:
+                blocks = list(follower)
+
+            self.assertTrue(0 < len(blocks) < len(expected), 'Partial blocks should not be read')
+
+            def trickle(path):
+                # The first block arrives over longer than the timeout, but
+                # never with a gap as long as it
+                with open(path, 'ab') as file:
+                    for start in range(0, 1651, 64):
+                        file.write(data[start:min(start + 64, 1651)])
+                        file.flush()
+                        time.sleep(0.01)
+
+            open(path, 'wb').close()
+            writer = threading.Thread(target=trickle, args=(path,))
+            writer.start()
+
+            with dem.Dem.follow(path, interval=0.001, timeout=0.1) as follower:
+                blocks = list(follower)
+
+            writer.join()
+
+            self.assertEqual(len(blocks), 1, 'The timeout should restart whenever data arrives')
+
+    def test_compact(self):
+        d0 = dem.Dem.open('./test_data/test.dem')
+        d0.close()
+
+        d1 = dem.Dem.open('./test_data/test.dem', compact=True)
+        d1.close()
+
+        self.assertEqual(len(d1.message_blocks), len(d0.message_blocks), 'Should decode every block')
+
+        for b0, b1 in zip(d0.message_blocks, d1.message_blocks):
+            self.assertEqual(len(b1.messages), len(b0.messages), 'Should decode every message')
+
+            for message, record in zip(b0.messages, b1.messages):
+                self.assertTrue(isinstance(record, tuple), 'Messages should be tuples')
+
+                if isinstance(message, dem.UpdateEntity):
+                    self.assertEqual(record[0], dem.U_SIGNAL, 'UpdateEntity should be tagged with U_SIGNAL')
+                    fields = dict(zip(dem.COMPACT_FIELDS[dem.U_SIGNAL], record[1:]))
+                    self.assertEqual(fields['entity'], message.entity, 'Entities should match')
+                    self.assertEqual((fields['x'], fields['y'], fields['z']), message.origin, 'Origins should match')
+                    self.assertEqual((fields['pitch'], fields['yaw'], fields['roll']), message.angles, 'Angles should match')
+
+                elif isinstance(message, dem.ClientData):
+                    fields = dict(zip(dem.COMPACT_FIELDS[dem.SVC_CLIENTDATA], record[1:]))
+                    self.assertEqual(fields['view_height'], message.view_height, 'View heights should match')
+                    self.assertEqual((fields['velocity_x'], fields['velocity_y'], fields['velocity_z']), message.velocity, 'Velocities should match')
+                    self.assertEqual(fields['on_ground'], message.on_ground, 'On ground should match')
+                    self.assertEqual(fields['health'], message.health, 'Health should match')
+
+                elif isinstance(message, dem.Time):
+                    self.assertEqual(record, (dem.SVC_TIME, message.time), 'Times should match')
+
+                else:
+                    self.assertEqual(record[0], dem._messages.index(type(message)), 'Records should be tagged with the message id')
+
+        d2 = dem.Dem.open('./test_data/test.dem', types=(dem.UpdateEntity,), compact=True)
+        d2.close()
+
+        self.assertTrue(all(r[0] == dem.U_SIGNAL for b in d2.message_blocks for r in b.messages), 'Compact mode should honor types')
+
+        with self.assertRaises(ValueError):
+            dem.Dem.open('./test_data/test.dem', raw=True, compact=True)
+
+    def test_skip_messages(self):
+        sound = dem.Sound()
+        sound.entity = 16
+        sound.channel = 2
+        sound.sound_number = 4
+        sound.origin = -512, 256, 2048
+        sound.volume = 64
+        sound.bit_mask = dem.SND_VOLUME
+
+        server_info = dem.ServerInfo()
+        server_info.map_name = 'e1m1'
+        server_info.models = 'maps/e1m1.bsp', 'progs/player.mdl'
+        server_info.sounds = 'weapons/r_exp3.wav',
+
+        lightning = dem.TempEntity()
+        lightning.type = dem.TE_LIGHTNING2
+        lightning.entity = 8
+        lightning.start = 0, 0, 0
+        lightning.end = 16, 16, 16
+
+        explosion = dem.TempEntity()
+        explosion.type = dem.TE_EXPLOSION2
+        explosion.origin = 0, 0, 0
+        explosion.color_start = 1
+        explosion.color_length = 2
+
+        update_entity = dem.UpdateEntity()
+        update_entity.bit_mask = dem.U_MOREBITS | dem.U_LONGENTITY | dem.U_ORIGIN2 | dem.U_SKIN
+        update_entity.entity = 300
+        update_entity.skin = 1
+        update_entity.origin = None, 64, None
+
+        light_style = dem.LightStyle()
+        light_style.style = 0
+        light_style.string = 'aaazaazaaaaaz'
+
+        for message in sound, server_info, lightning, explosion, update_entity, light_style:
+            b = dem.MessageBlock()
+            b.view_angles = 0, 0, 0
+            b.messages = [message]
+
+            data = io.BytesIO()
+            dem.MessageBlock.write(data, b)
+            data.seek(0)
+
+            b = dem.MessageBlock.read(data, types=())
+            self.assertEqual(b.messages, [], 'Skipped messages should not be decoded')
+            self.assertEqual(data.read(), b'', '%s should be skipped entirely' % message.__class__.__name__)
+
     def test_context_manager(self):
         with dem.Dem.open('./test_data/test.dem', 'a') as dem_file:
             self.assertFalse(dem_file.fp.closed, 'File should be open')
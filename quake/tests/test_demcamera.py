@@ -0,0 +1,89 @@
+import math
+import unittest
+
+from tests.basecase import TestCase
+from quake import dem, demcamera
+
+
+class TestDemCamera(TestCase):
+    def test_build(self):
+        with dem.Dem.open('./test_data/test.dem', types=demcamera.CameraPath.types) as dem_file:
+            path = demcamera.CameraPath.build(dem_file.message_blocks)
+
+        self.assertGreater(len(path), 0, 'Path should not be empty')
+        self.assertEqual(len(path.origin), 3 * len(path), 'Origins should be triples')
+        self.assertEqual(len(path.angles), 3 * len(path), 'Angles should be triples')
+        self.assertTrue(all(a < b for a, b in zip(path.time, path.time[1:])), 'Times should be increasing')
+        self.assertTrue(all(map(math.isfinite, path.angles)), 'Angles should be finite')
+
+    def test_build_levels(self):
+        with open('./test_data/test.dem', 'rb') as file:
+            data = file.read()
+
+        # The same level twice, so time restarts halfway through
+        data += data[data.index(b'\n') + 1:]
+
+        with dem.Dem.open(data, types=demcamera.CameraPath.types) as dem_file:
+            paths = demcamera.CameraPath.build_levels(dem_file.message_blocks)
+            second = demcamera.CameraPath.build(dem_file.message_blocks, level=1)
+
+            with self.assertRaises(IndexError):
+                demcamera.CameraPath.build(dem_file.message_blocks, level=2)
+
+        self.assertEqual(len(paths), 2, 'Should have a path per level')
+        self.assertGreater(len(paths[1]), 0, 'The second level should not be dropped')
+
+        for path in paths[1], second:
+            self.assertEqual(path.time, paths[0].time, 'Times should restart with the level')
+            self.assertEqual(path.origin, paths[0].origin, 'Origins should be equal')
+
+    def test_resample(self):
+        path = demcamera.CameraPath()
+        path.append(0.0, (0, 0, 0), (0, 350, 0))
+        path.append(1.0, (30, 0, 0), (0, 10, 0))
+
+        unwrapped = path.unwrap()
+        self.assertEqual(unwrapped.angles[4], 370, 'Yaw should be unwrapped past 360')
+
+        resampled = path.resample(10)
+        self.assertEqual(len(resampled), 11, 'Should have a sample every 0.1 seconds')
+        self.assertAlmostEqual(resampled.origin[3 * 5], 15, 4, 'Origin should be interpolated')
+        self.assertAlmostEqual(resampled.angles[3 * 5 + 1], 360, 4, 'Yaw should turn the short way')
+
+        with self.assertRaises(ValueError):
+            path.resample(0)
+
+    def test_simplify(self):
+        path = demcamera.CameraPath()
+
+        for n in range(301):
+            t = n / 30
+            path.append(t, (100 * t, 50 * math.sin(t), 0), (0, 90 * t, 0))
+
+        keys = path.simplify(2.0, 1.0)
+        self.assertLess(len(keys), len(path) / 10, 'Path should be at least 10x smaller')
+        self.assertEqual((keys.time[0], keys.time[-1]), (path.time[0], path.time[-1]), 'Ends should be kept')
+
+        # Every original row should be within the bounds of the keyframes
+        resampled = keys.resample(30, path.time[0], path.time[-1])
+
+        for n in range(len(path)):
+            distance = math.dist(path.origin[3 * n:3 * n + 3], resampled.origin[3 * n:3 * n + 3])
+            angle = max(abs(a - b) for a, b in zip(path.angles[3 * n:3 * n + 3], resampled.angles[3 * n:3 * n + 3]))
+            self.assertLess(distance, 2.01, 'Origin should be within the tolerance')
+            self.assertLess(angle, 1.01, 'Angles should be within the tolerance')
+
+        line = demcamera.CameraPath()
+
+        for n in range(100):
+            line.append(n, (n, 2 * n, 0), (0, 0, 0))
+
+        self.assertEqual(len(line.simplify(0.1, window=16)), 8, 'A line should keep only the window ends')
+        self.assertEqual(len(line.simplify(0.1, window=2)), 51, 'The smallest window should keep every other row and the end')
+
+        with self.assertRaises(ValueError):
+            line.simplify(0.1, window=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
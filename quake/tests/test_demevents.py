@@ -0,0 +1,114 @@
+import unittest
+
+from tests.basecase import TestCase
+from quake import dem, demevents
+
+
+def frame(time, *messages):
+    t = dem.Time()
+    t.time = time
+
+    message_block = dem.MessageBlock()
+    message_block.messages = [t] + list(messages)
+
+    return message_block
+
+
+def update_frags(player, frags):
+    message = dem.UpdateFrags()
+    message.player = player
+    message.frags = frags
+
+    return message
+
+
+def center_print(text):
+    message = dem.CenterPrint()
+    message.text = text
+
+    return message
+
+
+class TestDemEvents(TestCase):
+    def test_build(self):
+        with dem.Dem.open('./test_data/test.dem') as dem_file:
+            dem_file._did_modify = False
+            expected = [(n, m) for n, b in enumerate(dem_file.message_blocks) for m in b.messages if type(m) in demevents.EventIndex.event_types]
+
+        with dem.Dem.open('./test_data/test.dem', lazy=True) as dem_file:
+            e0 = demevents.EventIndex.build(dem_file.iter_message_blocks(demevents.EventIndex.types))
+
+        self.assertEqual(len(e0), len(expected), 'Index should have a row per event')
+        self.assertEqual(list(e0.block), [n for n, m in expected], 'Block numbers should match')
+
+        prints = e0.query(dem.Print, contains='FITZQUAKE')
+        self.assertEqual(len(prints), 1, 'Demo should have one server banner')
+        self.assertEqual(prints[0][3], e0.text(0), 'Print should be keyed by text')
+
+        e0.save(self.buff)
+        self.buff.seek(0)
+        e1 = demevents.EventIndex.open(self.buff)
+
+        self.assertEqual([e1[n] for n in range(len(e1))], [e0[n] for n in range(len(e0))], 'Events should be equal')
+
+    def test_query(self):
+        blocks = [
+            frame(1.0, update_frags(3, 1), center_print('You found a secret area!'), dem.FoundSecret()),
+            frame(2.0, update_frags(1, 1)),
+            frame(3.0, update_frags(3, 2), dem.KilledMonster()),
+            frame(4.0, update_frags(3, 3)),
+            frame(5.0, update_frags(1, 2), center_print('The Slipgate is open')),
+        ]
+
+        e0 = demevents.EventIndex.build(blocks)
+        e0.save(self.buff)
+        self.buff.seek(0)
+        e1 = demevents.EventIndex.open(self.buff)
+
+        for events in e0, e1:
+            frags = events.query(dem.UpdateFrags, key=3, start=1.5, end=4.0)
+            self.assertEqual([(t, v) for t, b, m, k, v in frags], [(3.0, 2), (4.0, 3)], 'Should find frags by player 3 in range')
+
+            frags = events.query(dem.UpdateFrags, start=2.0)
+            self.assertEqual([e[1] for e in frags], [1, 2, 3, 4], 'Frags by all players should be in time order')
+
+            self.assertEqual(len(events.query(dem.UpdateFrags, key=7)), 0, 'Unknown key should find nothing')
+            self.assertEqual(events.query(dem.KilledMonster)[0][:2], (3.0, 2), 'Should find kill')
+            self.assertEqual(len(events.query(start=3.0, end=3.0)), 2, 'Should find events at a single time')
+            self.assertEqual(events.query(contains='secret')[0][3], 'You found a secret area!', 'Should find text')
+            self.assertEqual(len(events.query(dem.CenterPrint, key='The Slipgate is open')), 1, 'Should find text key')
+
+        with self.assertRaises(ValueError):
+            e0.query(key=3)
+
+    def test_levels(self):
+        blocks = [
+            frame(1.0, dem.ServerInfo(), update_frags(3, 1)),
+            frame(1.5, update_frags(1, 1)),
+            frame(2.0, update_frags(3, 2)),
+            frame(0.5, dem.ServerInfo(), update_frags(3, 0)),
+            frame(2.5, update_frags(3, 1)),
+        ]
+
+        e0 = demevents.EventIndex.build(blocks)
+        e0.save(self.buff)
+        self.buff.seek(0)
+        e1 = demevents.EventIndex.open(self.buff)
+
+        for events in e0, e1:
+            self.assertEqual(list(events.level), [0, 0, 0, 1, 1], 'A ServerInfo should start a new level')
+            self.assertEqual(events.time[3], 0.0, 'Time should restart with the level')
+            self.assertEqual(events.select(start=0, end=1.5), [0, 1, 3], 'Times should apply to every level')
+            self.assertEqual(events.select(start=0, end=1.5, level=1), [3], 'Should find events in the level')
+            self.assertEqual(events.select(dem.UpdateFrags, key=3, end=1.0), [0, 3], 'Should find keyed events in every level')
+            self.assertEqual(events.select(dem.UpdateFrags, start=2.0, level=0), [2], 'Should find events by type in the level')
+            self.assertEqual(events.select(dem.UpdateFrags, level=1), [3, 4], 'Should find events by type in the level')
+            self.assertEqual(events.select(level=2), [], 'Unknown level should find nothing')
+
+    def test_bad_identity(self):
+        with self.assertRaises(dem.BadDemFile):
+            demevents.EventIndex.open(b'IDEM' + bytes(12))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+
+from tests.basecase import TestCase
+from quake import dem, demstate
+
+
+class TestDemState(TestCase):
+    def test_baseline_fallback(self):
+        spawn_baseline = dem.SpawnBaseline()
+        spawn_baseline.entity = 5
+        spawn_baseline.model_index = 3
+        spawn_baseline.frame = 1
+        spawn_baseline.color_map = 0
+        spawn_baseline.skin = 2
+        spawn_baseline.origin = 8, 16, 24
+        spawn_baseline.angles = 0, 90, 0
+
+        time = dem.Time()
+        time.time = 1.5
+
+        update_entity = dem.UpdateEntity()
+        update_entity.entity = 5
+        update_entity.bit_mask = dem.U_ORIGIN1 | dem.U_FRAME
+        update_entity.frame = 4
+        update_entity.origin = 32, None, None
+
+        b0 = dem.MessageBlock()
+        b0.messages = [spawn_baseline]
+
+        b1 = dem.MessageBlock()
+        b1.messages = [time, update_entity]
+
+        world_state = demstate.WorldState(4)
+        world_state.apply(b0)
+        world_state.apply(b1)
+
+        entities = world_state.entities
+
+        self.assertGreater(len(entities), 5, 'Entity arrays should grow to fit the entity')
+        self.assertEqual(world_state.time, 1.5, 'Time should be 1.5')
+        self.assertEqual(world_state.updated, [5], 'Only entity 5 should be updated')
+        self.assertEqual(entities.visible[5], 1, 'Entity should be visible')
+        self.assertEqual(entities.model_index[5], 3, 'Unsent model index should come from the baseline')
+        self.assertEqual(entities.frame[5], 4, 'Sent frame should be used')
+        self.assertEqual(entities.skin[5], 2, 'Unsent skin should come from the baseline')
+        self.assertEqual(list(entities.origin[15:18]), [32, 16, 24], 'Origin should merge the update and the baseline')
+        self.assertEqual(list(entities.angles[15:18]), [0, 90, 0], 'Unsent angles should come from the baseline')
+
+        snapshot = world_state.snapshot()
+        world_state.apply(dem.MessageBlock())
+        b2 = dem.MessageBlock()
+        b2.messages = [time]
+        world_state.apply(b2)
+
+        self.assertEqual(entities.visible[5], 0, 'Entity should not be visible if not sent in a frame')
+        self.assertEqual(snapshot.visible[5], 1, 'Snapshots should not change')
+
+    def test_entity_history(self):
+        with dem.Dem.open('./test_data/test.dem') as dem_file:
+            dem_file._did_modify = False
+            history = demstate.EntityHistory.build(dem_file.message_blocks)
+            messages = [m for b in dem_file.message_blocks for m in b.messages if isinstance(m, dem.UpdateEntity)]
+
+        self.assertEqual(len(history), len(messages), 'History should have a row per entity update')
+        self.assertEqual(len(history.origin), 3 * len(history), 'Origins should be triples')
+        self.assertEqual(history.select(1), list(range(len(history))), 'All rows should be the player entity')
+        self.assertEqual(history.block[0], 3, 'The first update should be in block 3')
+        self.assertEqual(history.origin[2], messages[0].origin[2], 'Origins should match the update')
+
+    def test_client_telemetry(self):
+        with dem.Dem.open('./test_data/test.dem') as dem_file:
+            dem_file._did_modify = False
+            messages = [m for b in dem_file.message_blocks for m in b.messages if isinstance(m, dem.ClientData)]
+
+        with dem.Dem.open('./test_data/test.dem', lazy=True) as dem_file:
+            t0 = demstate.ClientTelemetry.build(dem_file.iter_message_blocks(demstate.ClientTelemetry.types))
+
+        self.assertEqual(len(t0), len(messages), 'Telemetry should have a row per ClientData')
+        self.assertEqual(len(t0.ammo), 4 * len(t0), 'Ammo counts should be quadruples')
+        self.assertEqual(list(t0.health), [m.health for m in messages], 'Health should match')
+        self.assertEqual(list(t0.velocity), [v for m in messages for v in m.velocity], 'Velocities should match')
+        self.assertEqual(t0.block[0], 2, 'The first ClientData should be in block 2')
+
+        for row, message in enumerate(messages):
+            expected = message.view_height if message.bit_mask & dem.SU_VIEWHEIGHT else 22
+            self.assertEqual(t0.view_height[row], expected, 'Unsent view height should be the default')
+
+        t0.save(self.buff)
+        self.buff.seek(0)
+        t1 = demstate.ClientTelemetry.open(self.buff)
+
+        for name in demstate.ClientTelemetry.__slots__:
+            self.assertEqual(getattr(t1, name), getattr(t0, name), 'Column %s should be equal' % name)
+
+    def test_checkpoints(self):
+        with dem.Dem.open('./test_data/test.dem', lazy=True) as dem_file:
+            c0 = demstate.Checkpoints.build(dem_file, blocks=16)
+            dem_file.checkpoints = c0
+
+            self.assertEqual(c0.block_numbers[0], 0, 'The first checkpoint should follow the first block')
+            self.assertEqual(c0.block_numbers[1], 16, 'Checkpoints should be 16 blocks apart')
+
+            c0.save(self.buff)
+            self.buff.seek(0)
+            c1 = demstate.Checkpoints.open(self.buff)
+
+            self.assertEqual(c0.block_numbers, c1.block_numbers, 'Block numbers should be equal')
+            self.assertEqual(c0.index.offsets, c1.index.offsets, 'Index offsets should be equal')
+            self.assertEqual(c0.world_states[3].entities.origin, c1.world_states[3].entities.origin, 'Origins should be equal')
+
+            for time in 1.0, 1.5, 2.0, 2.5:
+                world_state = demstate.WorldState()
+                dem_file.seek_block(0)
+
+                for number, message_block in enumerate(dem_file.iter_message_blocks()):
+                    if dem_file.index.times[number] > time:
+                        break
+
+                    world_state.apply(message_block)
+
+                for checkpoints in c0, c1:
+                    dem_file.checkpoints = checkpoints
+                    result = dem_file.state_at(time)
+
+                    self.assertEqual(result.time, world_state.time, 'Times should be equal')
+                    self.assertEqual(result.entities.visible, world_state.entities.visible, 'Visible entities should be equal')
+                    self.assertEqual(result.entities.origin, world_state.entities.origin, 'Origins should be equal')
+                    self.assertEqual(result.entities.angles, world_state.entities.angles, 'Angles should be equal')
+
+    def test_checkpoints_levels(self):
+        with open('./test_data/test.dem', 'rb') as file:
+            data = file.read()
+
+        # The same level twice, so time restarts halfway through
+        data += data[data.index(b'\n') + 1:]
+
+        with dem.Dem.open(data, lazy=True) as dem_file:
+            checkpoints = demstate.Checkpoints.build(dem_file, seconds=0.5)
+            dem_file.checkpoints = checkpoints
+
+            self.assertEqual(dem_file.index.levels(), [0, 168], 'The second level should start at block 168')
+            self.assertIn(168, checkpoints.block_numbers, 'A checkpoint should be taken when time restarts')
+            self.assertEqual(dem_file.seek(1.5, 1), dem_file.seek(1.5) + 168, 'Seeking should stay in the level')
+
+            for time in -1.0, 1.5, 2.5:
+                first = dem_file.state_at(time)
+                second = dem_file.state_at(time, 1)
+
+                self.assertEqual(second.time, first.time, 'Times should be equal')
+                self.assertEqual(second.entities.origin, first.entities.origin, 'Origins should be equal')
+
+            with self.assertRaises(IndexError):
+                dem_file.state_at(1.5, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
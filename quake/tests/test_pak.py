@@ -1,8 +1,16 @@
 import io
+import os
+import tempfile
+import threading
 import unittest
 
 from tests.basecase import TestCase
-from quake import pak
+from quake import bsp, lmp, mdl, pak, spr
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
 
 
 class TestPakReadWrite(TestCase):
@@ -75,14 +83,16 @@ class TestPakReadWrite(TestCase):
             self.buff = io.BytesIO(f.read())
 
         pak_file = pak.PakFile(self.buff, 'a')
+        pak_file.write('./test_data/test.bsp', 'maps/test.bsp')
         pak_file.write('./test_data/test.bsp')
         pak_file.close()
 
         self.buff.seek(0)
 
         pak_file = pak.PakFile(self.buff, 'r')
-        self.assertTrue('./test_data/test.bsp' in pak_file.namelist(), 'Appended file should be in Pak file')
+        self.assertTrue('maps/test.bsp' in pak_file.namelist(), 'Appended file should be in Pak file')
         self.assertEqual(len(pak_file.infolist()), 3, 'Pak file should contain exactly three entries.')
+        self.assertGreater(pak_file.getinfo('./test_data/test.bsp').file_offset, pak_file.getinfo('maps/test.bsp').file_offset, 'Rewritten file should replace its entry')
 
         fp = pak_file.fp
         pak_file.close()
@@ -125,5 +135,415 @@ class TestPakReadWrite(TestCase):
             data = pak_file.read('zero.txt')
             self.assertEqual(len(data), 0, 'Length of bytes read should be zero.')
 
+    def test_concurrent_read(self):
+        with open('./test_data/test.mdl', 'rb') as file:
+            mdl_data = file.read()
+
+        with open('./test_data/test.bsp', 'rb') as file:
+            bsp_data = file.read()
+
+        with pak.PakFile('./test_data/test.pak') as pak_file:
+            self.assertIsNotNone(pak_file._fileno, 'Member reads should be positional')
+
+            names = pak_file.namelist()
+            expected = {name: pak_file.read(name) for name in names}
+            self.assertIn(mdl_data, expected.values(), 'Mdl data should be read unchanged')
+            errors = []
+
+            def reader(name):
+                try:
+                    for i in range(50):
+                        with pak_file.open(name) as member:
+                            data = member.read(100) + member.read()
+
+                        if data != expected[name] or pak_file.read(name) != expected[name]:
+                            errors.append(name)
+
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=reader, args=(names[i % len(names)],)) for i in range(8)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [], 'Concurrent reads should not interfere')
+
+        # File-like objects without a descriptor fall back to locked reads
+        with pak.PakFile(self.buff, 'w') as pak_file:
+            pak_file.writestr('maps/test.bsp', bsp_data)
+
+        self.buff.seek(0)
+
+        with pak.PakFile(self.buff) as pak_file:
+            self.assertIsNone(pak_file._fileno, 'BytesIO has no file descriptor')
+            self.assertEqual(pak_file.read('maps/test.bsp'), bsp_data, 'Bsp data should be read unchanged')
+
+    def test_truncated_member(self):
+        with pak.PakFile(self.buff, 'w') as pak_file:
+            pak_file.writestr('short.txt', b'short')
+
+        # Claim more bytes than the archive holds
+        data = self.buff.getvalue()
+        directory_offset = len(data) - 64
+        data = data[:directory_offset + 60] + (100000).to_bytes(4, 'little')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.pak')
+
+            with open(path, 'wb') as file:
+                file.write(data)
+
+            for file, mmap in (path, False), (path, True), (io.BytesIO(data), False):
+                with pak.PakFile(file, mmap=mmap) as pak_file:
+                    with self.assertRaises(EOFError):
+                        pak_file.read('short.txt')
+
+                    if mmap:
+                        with self.assertRaises(EOFError):
+                            pak_file.read_view('short.txt')
+
+    def test_read_view(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.pak')
+
+            with pak.PakFile(path, 'w') as pak_file:
+                for name in ('test.bsp', 'test.mdl', 'test.lmp', 'test.spr'):
+                    pak_file.write('./test_data/%s' % name, name)
+
+            with pak.PakFile(path, mmap=True) as pak_file:
+                with open('./test_data/test.bsp', 'rb') as file:
+                    self.assertEqual(pak_file.read_view('test.bsp'), file.read(), 'View should match the member')
+
+                b0 = bsp.Bsp.open('./test_data/test.bsp')
+                b1 = bsp.Bsp.open(pak_file.read_view('test.bsp'))
+                self.assertEqual(b0.entities, b1.entities, 'Entities should be equal')
+                self.assertEqual(len(b0.faces), len(b1.faces), 'Face counts should be equal')
+                b0.close()
+                b1.close()
+
+                m0 = mdl.Mdl.open('./test_data/test.mdl')
+                m1 = mdl.Mdl.open(pak_file.read_view('test.mdl'))
+                self.assertEqual(m0.number_of_vertices, m1.number_of_vertices, 'Vertex counts should be equal')
+                self.assertEqual(m0.scale, m1.scale, 'Scales should be equal')
+                m0.close()
+                m1.close()
+
+                l0 = lmp.Lmp.open('./test_data/test.lmp')
+                l1 = lmp.Lmp.open(pak_file.read_view('test.lmp'))
+                self.assertEqual(l0.pixels, l1.pixels, 'Pixels should be equal')
+                l0.close()
+                l1.close()
+
+                s1 = spr.Spr.open(pak_file.read_view('test.spr'))
+                self.assertGreater(s1.number_of_frames, 0, 'Sprite should have frames')
+                s1.close()
+
+                view = pak_file.read_view('test.mdl')
+
+            self.assertEqual(bytes(view[:4]), b'IDPO', 'Views should outlive the PakFile')
+            view.release()
+
+        with self.assertRaises(RuntimeError):
+            with pak.PakFile('./test_data/test.pak') as pak_file:
+                pak_file.read_view('./test_data/test.mdl')
+
+        with self.assertRaises(ValueError):
+            pak.PakFile(self.buff, 'w', mmap=True)
+
+    def test_extractall(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.pak')
+
+            with pak.PakFile(path, 'w') as pak_file:
+                pak_file.writestr('maps/test.bsp', read_file('./test_data/test.bsp'))
+                pak_file.writestr('progs/test.mdl', read_file('./test_data/test.mdl'))
+                pak_file.writestr('progs/empty.mdl', b'')
+                pak_file.writestr('default.cfg', b'bind ALT +strafe')
+
+            with pak.PakFile(path) as pak_file:
+                expected = {name: pak_file.read(name) for name in pak_file.namelist()}
+
+                for workers in (1, 4):
+                    target = os.path.join(directory, str(workers))
+                    pak_file.extractall(target, workers=workers)
+
+                    for name, data in expected.items():
+                        with open(os.path.join(target, name), 'rb') as file:
+                            self.assertEqual(file.read(), data, 'Extracted %s should match' % name)
+
+                pak_file.extractall(os.path.join(directory, 'subset'), ['default.cfg'])
+                self.assertEqual(os.listdir(os.path.join(directory, 'subset')), ['default.cfg'], 'Only the given members should be extracted')
+
+                # A directory in the way of one member does not stop the rest
+                for workers in (1, 4):
+                    target = os.path.join(directory, 'blocked%i' % workers)
+                    os.makedirs(os.path.join(target, 'default.cfg'))
+                    results = {info.filename: error for info, error in pak_file.iter_extract(target, workers=workers)}
+
+                    self.assertEqual(set(results), set(expected), 'Every member should be reported')
+                    self.assertIsInstance(results.pop('default.cfg'), OSError, 'The blocked member should fail')
+                    self.assertEqual(list(results.values()), [None] * 3, 'Other members should be extracted')
+                    self.assertTrue(os.path.isfile(os.path.join(target, 'maps/test.bsp')), 'Other members should be written')
+
+    def test_update_in_place(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.pak')
+
+            with pak.PakFile(path, 'w') as pak_file:
+                pak_file.writestr('a.txt', b'a' * 1000)
+                pak_file.writestr('b.txt', b'b' * 2000)
+                pak_file.writestr('c.txt', b'c' * 3000)
+
+            size = os.path.getsize(path)
+            directory_size = 3 * 64
+
+            with pak.PakFile(path, 'a') as pak_file:
+                # Reading moves the shared file pointer
+                self.assertEqual(pak_file.open('c.txt').read(), b'c' * 3000, 'Member should be read')
+                pak_file.writestr('b.txt', b'B' * 100)
+                self.assertEqual(pak_file.namelist(), ['a.txt', 'b.txt', 'c.txt'], 'Replaced member should keep its place')
+
+            # The previous directory is kept until the header points past it
+            self.assertEqual(os.path.getsize(path), size + 100 + directory_size, 'Update should only add the new member and directory')
+
+            with pak.PakFile(path) as pak_file:
+                self.assertEqual(pak_file.read('b.txt'), b'B' * 100, 'Replaced member should be read')
+                self.assertEqual(pak_file.read('c.txt'), b'c' * 3000, 'Other members should be unchanged')
+
+            # A member that fails partway through is not added
+            with pak.PakFile(path, 'a') as pak_file:
+                with self.assertRaises(OSError):
+                    with pak_file.open(pak.PakInfo('b.txt'), 'w') as member:
+                        member.write(b'x' * 50)
+                        raise OSError('Read failed')
+
+                self.assertEqual(pak_file.read('b.txt'), b'B' * 100, 'Previous member should be kept')
+
+            self.assertEqual(os.path.getsize(path), size + 100 + 2 * directory_size, 'Failed member should not be kept')
+
+            with pak.PakFile(path) as pak_file:
+                self.assertEqual(pak_file.read('b.txt'), b'B' * 100, 'Previous member should be kept')
+
+            with pak.PakFile(path, 'a') as pak_file:
+                pak_file.remove('a.txt')
+                self.assertEqual(pak_file.unused_size(), 3000 + 3 * directory_size, 'Removed and replaced members and previous directories should be unused')
+
+                with self.assertRaises(KeyError):
+                    pak_file.remove('a.txt')
+
+            with pak.PakFile(path, 'a') as pak_file:
+                self.assertEqual(pak_file.compact(), 3000 + 3 * directory_size + 2 * 64, 'Compact should reclaim the unused bytes')
+                self.assertEqual(pak_file.unused_size(), 0, 'Nothing should be unused after compact')
+                pak_file.writestr('d.txt', b'd' * 10)
+
+            self.assertEqual(os.path.getsize(path), 12 + 3110 + 3 * 64, 'File should be truncated after the directory')
+
+            with pak.PakFile(path) as pak_file:
+                self.assertEqual(pak_file.namelist(), ['b.txt', 'c.txt', 'd.txt'], 'Members should be kept')
+                self.assertEqual(pak_file.read('b.txt'), b'B' * 100, 'Moved member should be read')
+                self.assertEqual(pak_file.read('c.txt'), b'c' * 3000, 'Moved member should be read')
+                self.assertEqual(pak_file.read('d.txt'), b'd' * 10, 'Appended member should be read')
+
+                with self.assertRaises(RuntimeError):
+                    pak_file.compact()
+
+    def test_dedup(self):
+        bsp_data = read_file('./test_data/test.bsp')
+        mdl_data = read_file('./test_data/test.mdl')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.pak')
+
+            with pak.PakFile(path, 'w', dedup=True) as pak_file:
+                pak_file.writestr('maps/test.bsp', bsp_data)
+                pak_file.writestr('progs/test.mdl', mdl_data)
+                pak_file.writestr('maps/copy.bsp', bsp_data)
+                pak_file.write('./test_data/test.mdl', 'progs/copy.mdl')
+
+                self.assertEqual(pak_file.duplicate_count, 2, 'Both copies should be duplicates')
+                self.assertEqual(pak_file.duplicate_size, len(bsp_data) + len(mdl_data), 'Saved bytes should be counted')
+
+            self.assertEqual(os.path.getsize(path), 12 + len(bsp_data) + len(mdl_data) + 4 * 64, 'Duplicates should not be stored')
+
+            with pak.PakFile(path, 'a', dedup=True) as pak_file:
+                pak_file.writestr('maps/another.bsp', bsp_data)
+                pak_file.writestr('new.txt', b'new')
+                self.assertEqual(pak_file.duplicate_count, 1, 'Existing members should be found')
+
+                # Shared bytes stay in use while any entry points at them
+                pak_file.remove('maps/test.bsp')
+                self.assertEqual(pak_file.unused_size(), 4 * 64, 'Only the previous directory should be unused')
+
+            with pak.PakFile(path) as pak_file:
+                self.assertEqual(pak_file.getinfo('maps/copy.bsp').file_offset, pak_file.getinfo('maps/another.bsp').file_offset, 'Duplicates should share bytes')
+
+                for name, data in (('maps/copy.bsp', bsp_data), ('progs/copy.mdl', mdl_data), ('new.txt', b'new')):
+                    self.assertEqual(pak_file.read(name), data, 'Member %s should be read' % name)
+
+    def test_build(self):
+        bsp_data = read_file('./test_data/test.bsp')
+        mdl_data = read_file('./test_data/test.mdl')
+
+        with tempfile.TemporaryDirectory() as directory:
+            tree = os.path.join(directory, 'tree')
+            os.makedirs(os.path.join(tree, 'maps'))
+            os.makedirs(os.path.join(tree, 'progs'))
+
+            for name, data in (('maps/test.bsp', bsp_data), ('progs/test.mdl', mdl_data), ('progs/copy.mdl', mdl_data), ('default.cfg', b''), ('autoexec.cfg', b'exec')):
+                with open(os.path.join(tree, *name.split('/')), 'wb') as file:
+                    file.write(data)
+
+            paths = [os.path.join(directory, '%i.pak' % n) for n in range(2)]
+
+            for path in paths:
+                with pak.PakFile(path, 'w') as pak_file:
+                    infos = pak_file.build(tree)
+
+            self.assertEqual([i.filename for i in infos], ['autoexec.cfg', 'default.cfg', 'maps/test.bsp', 'progs/copy.mdl', 'progs/test.mdl'], 'Members should be sorted')
+            self.assertEqual(read_file(paths[0]), read_file(paths[1]), 'Builds should be reproducible')
+
+            with pak.PakFile(paths[0]) as pak_file:
+                self.assertEqual(pak_file.read('maps/test.bsp'), bsp_data, 'Member should be read')
+                self.assertEqual(pak_file.read('progs/copy.mdl'), mdl_data, 'Member should be read')
+                self.assertEqual(pak_file.read('default.cfg'), b'', 'Empty member should be read')
+                self.assertEqual(pak_file.unused_size(), 0, 'Members should be back to back')
+
+            # Caller defined order, dedup and a file-like object without a descriptor
+            with pak.PakFile(self.buff, 'w', dedup=True) as pak_file:
+                pak_file.writestr('first.txt', b'first')
+                pak_file.build(tree, order=['progs/test.mdl', 'missing.mdl', 'maps/test.bsp'])
+                self.assertEqual(pak_file.namelist()[:4], ['first.txt', 'progs/test.mdl', 'maps/test.bsp', 'autoexec.cfg'], 'Order should be followed')
+                self.assertEqual(pak_file.duplicate_count, 1, 'Copy should be a duplicate')
+
+                pak_file.build({'maps/test.bsp': os.path.join(tree, 'autoexec.cfg')}, order=len)
+
+            self.buff.seek(0)
+
+            with pak.PakFile(self.buff) as pak_file:
+                self.assertEqual(len(pak_file.namelist()), 6, 'Rebuilt member should be replaced')
+                self.assertEqual(pak_file.read('maps/test.bsp'), b'exec', 'Member should be replaced')
+                self.assertEqual(pak_file.read('progs/copy.mdl'), mdl_data, 'Duplicate should be read')
+                self.assertEqual(pak_file.read('first.txt'), b'first', 'Written member should be kept')
+
+    def test_repack(self):
+        members = [('m%i.bin' % n, bytes([n]) * (1000 + n)) for n in range(8)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.pak')
+            target = os.path.join(directory, 'repacked.pak')
+
+            with pak.PakFile(path, 'w', dedup=True) as pak_file:
+                for name, data in members:
+                    pak_file.writestr(name, data)
+
+                pak_file.writestr('copy.bin', members[6][1])
+
+            with pak.AccessTrace() as trace:
+                with pak.PakFile(path) as pak_file:
+                    pak_file.read('m6.bin')
+                    pak_file.read('m1.bin')
+
+                    with pak_file.open('m4.bin') as file:
+                        file.read()
+
+                    pak_file.read('m1.bin')
+                    pak_file.read('copy.bin')
+
+            self.assertIsNone(pak.open_hook, 'Hook should be removed')
+            self.assertEqual(len(trace.accesses), 5, 'Every read should be recorded')
+            self.assertEqual(trace.names(path), ['m6.bin', 'm1.bin', 'm4.bin', 'copy.bin'], 'Names should be in first read order')
+            self.assertEqual(trace.names(target), [], 'Other archives should be filtered out')
+
+            with pak.PakFile(path, 'a', dedup=True) as pak_file, pak.AccessTrace() as trace_of_write:
+                pak_file.writestr('another.bin', members[3][1])
+                self.assertEqual(pak_file.duplicate_count, 1, 'Existing member should be hashed')
+
+            self.assertEqual(trace_of_write.accesses, [], 'Hashing members should not be recorded as reads')
+
+            with self.assertRaises(ValueError):
+                pak.repack(path, path)
+
+            with pak.PakFile(path) as pak_file:
+                self.assertEqual(pak_file.read('m6.bin'), members[6][1], 'Archive should be left intact')
+
+            trace_file = io.StringIO()
+            trace.save(trace_file)
+            names = trace_file.getvalue().splitlines()
+
+            infos = pak.repack(path, target, names + ['missing.bin'])
+            self.assertEqual([i.filename for i in infos[:4]], names, 'Traced members should come first')
+
+            with pak.PakFile(path) as old, pak.PakFile(target) as new:
+                self.assertEqual(pak.count_seeks(old.NameToInfo, names), (4, 9031), 'Original order should seek')
+                self.assertEqual(pak.count_seeks(new.NameToInfo, names), (2, 3011), 'Repacked order should only seek back to the shared copy')
+                self.assertEqual(new.getinfo('copy.bin').file_offset, new.getinfo('m6.bin').file_offset, 'Shared bytes should stay shared')
+                self.assertEqual(new.unused_size(), 0, 'Members should be back to back')
+
+                for name, data in members:
+                    self.assertEqual(new.read(name), data, 'Member %s should be unchanged' % name)
+
+    def test_seek(self):
+        bsp_data = read_file('./test_data/test.bsp')
+        mdl_data = read_file('./test_data/test.mdl')
+
+        with pak.PakFile(self.buff, 'w') as pak_file:
+            pak_file.writestr('progs/test.mdl', mdl_data)
+            pak_file.writestr('maps/test.bsp', bsp_data)
+
+        self.buff.seek(0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.pak')
+
+            with open(path, 'wb') as file:
+                file.write(self.buff.getvalue())
+
+            # Both the positional and the locked read paths
+            for file in path, self.buff:
+                with pak.PakFile(file) as pak_file:
+                    with pak_file.open('maps/test.bsp') as member:
+                        self.assertTrue(member.seekable(), 'Member should be seekable')
+                        self.assertEqual(member.read(4), bsp_data[:4], 'Should read the start of the member')
+                        self.assertEqual(member.tell(), 4, 'Position should follow reads')
+
+                        self.assertEqual(member.seek(100), 100, 'Seek should return the position')
+                        self.assertEqual(member.read(8), bsp_data[100:108], 'Should read after seek')
+
+                        member.seek(-8, io.SEEK_END)
+                        self.assertEqual(member.read(100), bsp_data[-8:], 'Reads should stop at the end of the member')
+                        self.assertEqual(member.read(), b'', 'Should be at the end of the member')
+
+                        member.seek(10)
+                        member.seek(-6, io.SEEK_CUR)
+                        buffer = bytearray(6)
+                        self.assertEqual(member.readinto(buffer), 6, 'Should read into the buffer')
+                        self.assertEqual(buffer, bsp_data[4:10], 'Buffer should hold the member bytes')
+
+                        self.assertEqual(member.seek(len(bsp_data) + 10), len(bsp_data), 'Seek should clamp to the end')
+                        self.assertEqual(member.read(), b'', 'Nothing should be read past the end')
+
+                        member.seek(0)
+                        self.assertEqual(member.read(), bsp_data, 'Whole member should be read after seek')
+
+                    with pak_file.open('maps/test.bsp') as member:
+                        b0 = bsp.Bsp.open('./test_data/test.bsp')
+                        b1 = bsp.Bsp.open(member)
+                        self.assertEqual(b0.entities, b1.entities, 'Entities should be equal')
+                        self.assertEqual(len(b0.faces), len(b1.faces), 'Face counts should be equal')
+                        b0.close()
+
+                    m0 = mdl.Mdl.open('./test_data/test.mdl')
+                    m1 = mdl.Mdl.open(pak_file.open('progs/test.mdl'))
+                    self.assertEqual(m0.number_of_frames, m1.number_of_frames, 'Frame counts should be equal')
+                    m0.close()
+                    m1.close()
+
+                self.buff.seek(0)
+
+
 if __name__ == '__main__':
     unittest.main()
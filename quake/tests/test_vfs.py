@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+from tests.basecase import TestCase
+from quake import pak, vfs
+
+
+class TestVfs(TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.directory = tempfile.TemporaryDirectory()
+        root = self.directory.name
+
+        self.id1 = os.path.join(root, 'id1')
+        self.mod = os.path.join(root, 'mod')
+        os.makedirs(os.path.join(self.id1, 'gfx'))
+        os.makedirs(os.path.join(self.mod, 'maps'))
+
+        with pak.PakFile(os.path.join(self.id1, 'pak0.pak'), 'w') as pak_file:
+            pak_file.writestr('default.cfg', b'pak0')
+            pak_file.writestr('gfx/palette.lmp', b'palette')
+            pak_file.write('./test_data/test.bsp', 'maps/e1m1.bsp')
+
+        with pak.PakFile(os.path.join(self.id1, 'pak1.pak'), 'w') as pak_file:
+            pak_file.writestr('default.cfg', b'pak1')
+            pak_file.writestr('maps/e2m1.bsp', b'e2m1')
+
+        self.write(os.path.join(self.id1, 'default.cfg'), b'loose')
+        self.write(os.path.join(self.id1, 'gfx', 'conback.lmp'), b'conback')
+        self.write(os.path.join(self.mod, 'maps', 'e1m1.bsp'), b'mod e1m1')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def write(path, data):
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    def test_override(self):
+        with vfs.SearchPath() as search_path:
+            search_path.add_game_directory(self.id1)
+
+            self.assertEqual(search_path.layers[1:], [os.path.join(self.id1, 'pak0.pak'), os.path.join(self.id1, 'pak1.pak')], 'Paks should be added in order')
+            self.assertEqual(search_path.read('default.cfg'), b'pak1', 'Later paks should override loose files and earlier paks')
+            self.assertEqual(search_path.read('gfx/conback.lmp'), b'conback', 'Loose files should be found')
+
+            with open('./test_data/test.bsp', 'rb') as file:
+                self.assertEqual(search_path.read('maps/e1m1.bsp'), file.read(), 'Pak members should be read unchanged')
+
+            search_path.add(self.mod)
+
+            self.assertEqual(search_path.read('maps/e1m1.bsp'), b'mod e1m1', 'Mod should override the base game')
+            self.assertEqual(search_path.find('maps/e1m1.bsp'), self.mod, 'Mod should provide the map')
+
+            with search_path.open('gfx/palette.lmp') as file:
+                self.assertEqual(file.read(), b'palette', 'Opened file should be read')
+
+    def test_lookup(self):
+        search_path = vfs.SearchPath([self.id1, os.path.join(self.id1, 'pak0.pak')])
+
+        self.assertTrue(search_path.exists('gfx/palette.lmp'), 'Member should exist')
+        self.assertTrue('gfx/conback.lmp' in search_path, 'Loose file should exist')
+        self.assertFalse(search_path.exists('maps/e2m1.bsp'), 'Unadded pak should not be searched')
+        self.assertEqual(search_path.glob('gfx/*.lmp'), ['gfx/conback.lmp', 'gfx/palette.lmp'], 'Glob should list matching names')
+        self.assertEqual(len(search_path), 6, 'Overridden names should be counted once')
+
+        with self.assertRaises(KeyError):
+            search_path.read('maps/missing.bsp')
+
+        self.assertIsNone(search_path._layers[1]._pak_file, 'Pak should not be opened until read')
+        search_path.read('gfx/palette.lmp')
+        self.assertIsNotNone(search_path._layers[1]._pak_file, 'Pak should be opened on read')
+
+        search_path.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
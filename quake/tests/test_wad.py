@@ -1,10 +1,17 @@
 import io
+import os
+import tempfile
 import unittest
 
 from tests.basecase import TestCase
 from quake import wad
 
 
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
 class TestWadReadWrite(TestCase):
     def test_check_file_type(self):
         self.assertFalse(wad.is_wadfile('./test_data/test.bsp'))
@@ -133,5 +140,59 @@ class TestWadReadWrite(TestCase):
             data = wad_file.read('zero.txt')
             self.assertEqual(len(data), 0, 'Length of bytes read should be zero.')
 
+    def test_extractall(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.wad')
+
+            with wad.WadFile(path, 'w') as wad_file:
+                wad_file.writestr('conchars', read_file('./test_data/test.lmp'))
+                wad_file.writestr('empty', b'')
+                wad_file.writestr('test', read_file('./test_data/test.mdl'))
+
+            with wad.WadFile(path) as wad_file:
+                expected = {name: wad_file.read(name) for name in wad_file.namelist()}
+
+                for workers in (1, 4):
+                    target = os.path.join(directory, str(workers))
+                    wad_file.extractall(target, workers=workers)
+
+                    for name, data in expected.items():
+                        with open(os.path.join(target, name), 'rb') as file:
+                            self.assertEqual(file.read(), data, 'Extracted %s should match' % name)
+
+                wad_file.extractall(os.path.join(directory, 'subset'), ['test'])
+                self.assertEqual(os.listdir(os.path.join(directory, 'subset')), ['test'], 'Only the given members should be extracted')
+
+
+    def test_dedup(self):
+        lmp_data = read_file('./test_data/test.lmp')
+        mdl_data = read_file('./test_data/test.mdl')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.wad')
+
+            with wad.WadFile(path, 'w', dedup=True) as wad_file:
+                wad_file.writestr('conchars', lmp_data)
+                wad_file.writestr('test', mdl_data)
+                wad_file.writestr('copy', lmp_data)
+                info = wad.WadInfo('stream', file_size=len(mdl_data))
+                wad_file.writestr(info, io.BytesIO(mdl_data))
+
+                self.assertEqual(wad_file.duplicate_count, 2, 'Both copies should be duplicates')
+                self.assertEqual(wad_file.duplicate_size, len(lmp_data) + len(mdl_data), 'Saved bytes should be counted')
+
+            self.assertEqual(os.path.getsize(path), 12 + len(lmp_data) + len(mdl_data) + 4 * 32, 'Duplicates should not be stored')
+
+            with wad.WadFile(path, 'a', dedup=True) as wad_file:
+                wad_file.writestr('another', lmp_data)
+                self.assertEqual(wad_file.duplicate_count, 1, 'Existing members should be found')
+
+            with wad.WadFile(path) as wad_file:
+                self.assertEqual(len(wad_file.namelist()), 5, 'Every name should be listed')
+                self.assertEqual(wad_file.getinfo('copy').file_offset, wad_file.getinfo('conchars').file_offset, 'Duplicates should share bytes')
+
+                for name, data in (('another', lmp_data), ('stream', mdl_data), ('test', mdl_data)):
+                    self.assertEqual(wad_file.read(name), data, 'Duplicate %s should be read' % name)
+
 if __name__ == '__main__':
     unittest.main()
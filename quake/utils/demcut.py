@@ -0,0 +1,99 @@
+"""Command line utility for cutting and joining DEM files
+
+Supported Games:
+    - QUAKE
+"""
+
+__version__ = '1.0.0'
+
+import argparse
+import os
+import sys
+
+from quake import dem
+
+
+class ResolvePathAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        if isinstance(values, list):
+            fullpath = [os.path.expanduser(v) for v in values]
+
+        else:
+            fullpath = os.path.expanduser(values)
+
+        setattr(namespace, self.dest, fullpath)
+
+
+class Parser(argparse.ArgumentParser):
+    """Simple wrapper class to provide help on error"""
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = Parser(prog='demcut',
+                    description='Default action is to cut the given time range out of file.dem. If more than one demo is given they are joined instead.',
+                    epilog='example: demcut demo1.dem -s 60 -e 90 -o clip.dem => write seconds 60 to 90 of demo1.dem to clip.dem')
+
+    parser.add_argument('files',
+                        metavar='file.dem',
+                        nargs='+',
+                        action=ResolvePathAction)
+
+    parser.add_argument('-o',
+                        metavar='out.dem',
+                        dest='output',
+                        required=True,
+                        action=ResolvePathAction,
+                        help='demo to write')
+
+    parser.add_argument('-s', '--start',
+                        dest='start',
+                        type=float,
+                        default=0.0,
+                        help='time in seconds of the first block to keep')
+
+    parser.add_argument('-e', '--end',
+                        dest='end',
+                        type=float,
+                        default=None,
+                        help='time in seconds of the last block to keep')
+
+    parser.add_argument('-q',
+                        dest='quiet',
+                        action='store_true',
+                        help='quiet mode')
+
+    parser.add_argument('-v', '--version',
+                        dest='version',
+                        action='version',
+                        help=argparse.SUPPRESS,
+                        version='{} version {}'.format(parser.prog, __version__))
+
+    args = parser.parse_args()
+
+    if len(args.files) > 1 and (args.start or args.end is not None):
+        parser.error('time ranges can only be used with a single demo')
+
+    for file in args.files:
+        if not os.path.isfile(file):
+            print('{0}: cannot find or open {1}'.format(parser.prog, file), file=sys.stderr)
+            sys.exit(1)
+
+    try:
+        if len(args.files) == 1:
+            dem.cut(args.files[0], args.output, args.start, args.end)
+
+        else:
+            dem.splice(args.files, args.output)
+
+    except (dem.BadDemFile, ValueError) as e:
+        print('{0}: error: {1}'.format(parser.prog, e), file=sys.stderr)
+        sys.exit(1)
+
+    if not args.quiet:
+        print('  writing: {}'.format(args.output))
+
+    sys.exit(0)
@@ -0,0 +1,527 @@
+"""Command line utility for gathering statistics across many DEM files
+
+Each demo is streamed through a set of reducers in a pool of worker
+processes and the results are written as one JSON object per line.
+
+Supported Games:
+    - QUAKE
+"""
+
+__version__ = '1.0.0'
+
+import argparse
+import collections
+import concurrent.futures
+import importlib
+import json
+import os
+import sys
+import time
+
+from quake import dem
+from quake import demstate
+
+# Player stat indices sent with UpdateStat
+STAT_TOTALSECRETS = 11
+STAT_TOTALMONSTERS = 12
+
+
+class Reducer(object):
+    """Base class for per-demo reducers
+
+    A new reducer is created for each demo. Every message block of the demo
+    is passed to update() in order and then result() is called once. Blocks
+    may also hold messages of types requested by other reducers. Subclasses
+    override both methods, by default nothing is collected.
+
+    Attributes:
+        name: The key used for the result in the output.
+
+        types: The message classes this reducer needs. All other messages
+            are skipped without being decoded.
+    """
+
+    name = None
+    types = ()
+
+    def update(self, message_block):
+        """Processes the next message block.
+
+        Args:
+            message_block: A MessageBlock object.
+        """
+
+        pass
+
+    def result(self):
+        """Returns the JSON serializable result for the demo."""
+
+        return None
+
+
+class Frags(Reducer):
+    """Final frag count of each named player"""
+
+    name = 'frags'
+    types = (dem.UpdateName, dem.UpdateFrags)
+
+    def __init__(self):
+        self.names = {}
+        self.frags = {}
+
+    def update(self, message_block):
+        for message in message_block.messages:
+            message_type = type(message)
+
+            if message_type is dem.UpdateName:
+                self.names[message.player] = message.name
+
+            elif message_type is dem.UpdateFrags:
+                self.frags[message.player] = message.frags
+
+    def result(self):
+        return {self.names.get(player) or str(player): frags for player, frags in sorted(self.frags.items())}
+
+
+class Kills(Reducer):
+    """Monsters killed out of the total"""
+
+    name = 'kills'
+    types = (dem.KilledMonster, dem.UpdateStat)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+
+    def update(self, message_block):
+        for message in message_block.messages:
+            if type(message) is dem.KilledMonster:
+                self.count += 1
+
+            elif type(message) is dem.UpdateStat and message.index == STAT_TOTALMONSTERS:
+                self.total = message.value
+
+    def result(self):
+        return {'count': self.count, 'total': self.total}
+
+
+class Secrets(Kills):
+    """Secrets found out of the total"""
+
+    name = 'secrets'
+    types = (dem.FoundSecret, dem.UpdateStat)
+
+    def update(self, message_block):
+        for message in message_block.messages:
+            if type(message) is dem.FoundSecret:
+                self.count += 1
+
+            elif type(message) is dem.UpdateStat and message.index == STAT_TOTALSECRETS:
+                self.total = message.value
+
+
+class MapTime(Reducer):
+    """Time spent on each map, up to the intermission if there is one"""
+
+    name = 'map_time'
+    types = (dem.ServerInfo, dem.Time, dem.Intermission)
+
+    def __init__(self):
+        self.maps = []
+        self.current = None
+        self.time = 0.0
+
+    def update(self, message_block):
+        for message in message_block.messages:
+            message_type = type(message)
+
+            if message_type is dem.Time:
+                self.time = message.time
+
+                if self.current is not None and self.current['start'] is None:
+                    self.current['start'] = self.time
+
+            elif message_type is dem.ServerInfo:
+                self._finish()
+                self.current = {'map': message.map_name, 'start': None, 'end': None}
+
+            elif message_type is dem.Intermission and self.current is not None and self.current['end'] is None:
+                self.current['end'] = self.time
+
+    def _finish(self):
+        if self.current is None:
+            return
+
+        start = self.current['start'] or 0.0
+        end = self.current['end'] if self.current['end'] is not None else self.time
+        self.maps.append({'map': self.current['map'], 'time': round(end - start, 3)})
+        self.current = None
+
+    def result(self):
+        self._finish()
+        return self.maps
+
+
+class PlayerPath(Reducer):
+    """Origin of the view entity sampled once per interval"""
+
+    name = 'player_path'
+    types = demstate.WorldState.types
+
+    # Seconds between samples
+    interval = 1.0
+
+    def __init__(self):
+        self.world_state = demstate.WorldState()
+        self.path = []
+        self.next_time = 0.0
+
+    def update(self, message_block):
+        world_state = self.world_state
+        world_state.apply(message_block)
+
+        if world_state.time < self.next_time and self.path:
+            return
+
+        entities = world_state.entities
+        entity = world_state.view_entity
+
+        if not entity or entity >= len(entities) or not entities.visible[entity]:
+            return
+
+        x, y, z = entities.origin[entity * 3:entity * 3 + 3]
+        self.path.append([round(world_state.time, 3), x, y, z])
+        self.next_time = world_state.time + self.interval
+
+    def result(self):
+        return self.path
+
+
+reducers = {r.name: r for r in (Frags, Kills, Secrets, MapTime, PlayerPath)}
+
+
+def load_reducer(spec):
+    """Returns the reducer class for the given name or 'module:Class' spec."""
+
+    if spec in reducers:
+        return reducers[spec]
+
+    module_name, _, class_name = spec.partition(':')
+
+    if not class_name:
+        raise ValueError('Unknown reducer: %s' % spec)
+
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def analyze(path, reducer_classes):
+    """Returns a dict of the reducer results for the demo at path.
+
+    The demo is streamed one message block at a time, so memory use does not
+    grow with the size of the demo.
+    """
+
+    result = {'file': path, 'size': os.path.getsize(path)}
+    instances = [c() for c in reducer_classes]
+    types = {t for c in reducer_classes for t in c.types}
+    block_count = 0
+
+    with dem.Dem.open(path, lazy=True) as dem_file:
+        for message_block in dem_file.iter_message_blocks(types):
+            block_count += 1
+
+            for reducer in instances:
+                reducer.update(message_block)
+
+    result['blocks'] = block_count
+
+    for reducer in instances:
+        result[reducer.name] = reducer.result()
+
+    return result
+
+
+_worker_reducers = None
+
+
+def _init_worker(specs, memory_limit):
+    global _worker_reducers
+    _worker_reducers = [load_reducer(s) for s in specs]
+
+    if memory_limit:
+        try:
+            import resource
+
+        except ImportError:
+            return
+
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _analyze_worker(path):
+    try:
+        return analyze(path, _worker_reducers)
+
+    except MemoryError:
+        return {'file': path, 'error': 'MemoryError'}
+
+    except Exception as e:
+        return {'file': path, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def _executor(jobs, specs, max_tasks=None, memory_limit=None):
+    options = {}
+
+    # Worker recycling is only available from Python 3.11
+    if max_tasks and sys.version_info >= (3, 11):
+        options['max_tasks_per_child'] = max_tasks
+
+    return concurrent.futures.ProcessPoolExecutor(jobs,
+                                                  initializer=_init_worker,
+                                                  initargs=(specs, memory_limit),
+                                                  **options)
+
+
+def analyze_all(demos, specs, jobs=None, max_tasks=None, memory_limit=None):
+    """Yields the result of each demo as it finishes, in no particular order.
+
+    A worker that dies takes the demos it was running with it and breaks the
+    pool. Those demos are retried one at a time in a pool of their own, and a
+    demo that kills its worker again is reported as an error.
+
+    Args:
+        demos: The paths of the demos.
+
+        specs: The reducer names or 'module:Class' specs to run.
+
+        jobs: Optional. The number of worker processes.
+
+        max_tasks: Optional. The demos per worker before it is replaced.
+
+        memory_limit: Optional. The address space limit of each worker in MB.
+    """
+
+    jobs = jobs or os.cpu_count() or 1
+    pending = collections.deque(demos)
+    suspects = []
+
+    while pending:
+        executor = _executor(jobs, specs, max_tasks, memory_limit)
+        running = {}
+        broken = False
+
+        try:
+            while running or (pending and not broken):
+                # Only a few demos are queued ahead so the pool never holds
+                # the whole list
+                while pending and not broken and len(running) < jobs * 2:
+                    path = pending.popleft()
+                    running[executor.submit(_analyze_worker, path)] = path
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    path = running.pop(future)
+
+                    try:
+                        result = future.result()
+
+                    except concurrent.futures.BrokenExecutor:
+                        suspects.append(path)
+                        broken = True
+                        continue
+
+                    yield result
+
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    for path in suspects:
+        with _executor(1, specs, memory_limit=memory_limit) as executor:
+            try:
+                yield executor.submit(_analyze_worker, path).result()
+
+            except concurrent.futures.BrokenExecutor:
+                yield {'file': path, 'error': 'BrokenProcessPool: the worker process died'}
+
+
+def find_demos(paths):
+    """Yields the paths of all .dem files in the given files or directories."""
+
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+
+            for name in sorted(files):
+                if name.lower().endswith('.dem'):
+                    yield os.path.join(root, name)
+
+
+def read_progress(path):
+    """Returns the set of demos already finished according to the progress
+    file at path."""
+
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, encoding='utf-8') as file:
+        return {line.rstrip('\n') for line in file if line.endswith('\n')}
+
+
+class ResolvePathAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        if isinstance(values, list):
+            fullpath = [os.path.expanduser(v) for v in values]
+
+        else:
+            fullpath = os.path.expanduser(values)
+
+        setattr(namespace, self.dest, fullpath)
+
+
+class Parser(argparse.ArgumentParser):
+    """Simple wrapper class to provide help on error"""
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = Parser(prog='demstat',
+                    description='Default action is to write statistics for each demo as JSON lines to stdout.',
+                    epilog='example: demstat demos/ -o stats.jsonl -r frags -r kills => write frags and kills of every demo in demos/ to stats.jsonl')
+
+    parser.add_argument('files',
+                        metavar='file.dem',
+                        nargs='+',
+                        action=ResolvePathAction,
+                        help='demos or directories of demos')
+
+    parser.add_argument('-o',
+                        metavar='file.jsonl',
+                        dest='output',
+                        default=None,
+                        action=ResolvePathAction,
+                        help='append results to file.jsonl')
+
+    parser.add_argument('-r', '--reducer',
+                        dest='reducers',
+                        action='append',
+                        help='reducer to run, either one of {} or module:Class. default: all'.format(', '.join(reducers)))
+
+    parser.add_argument('-p', '--progress',
+                        metavar='file',
+                        dest='progress',
+                        default=None,
+                        action=ResolvePathAction,
+                        help='progress file used to resume. default: file.jsonl.progress')
+
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='number of worker processes')
+
+    parser.add_argument('--max-tasks',
+                        dest='max_tasks',
+                        type=int,
+                        default=100,
+                        help='demos per worker before it is replaced')
+
+    parser.add_argument('--memory-limit',
+                        metavar='MB',
+                        dest='memory_limit',
+                        type=int,
+                        default=None,
+                        help='address space limit of each worker')
+
+    parser.add_argument('-q',
+                        dest='quiet',
+                        action='store_true',
+                        help='quiet mode')
+
+    parser.add_argument('-v', '--version',
+                        dest='version',
+                        action='version',
+                        help=argparse.SUPPRESS,
+                        version='{} version {}'.format(parser.prog, __version__))
+
+    args = parser.parse_args()
+
+    specs = args.reducers or list(reducers)
+
+    try:
+        for spec in specs:
+            load_reducer(spec)
+
+    except (ValueError, ImportError, AttributeError) as e:
+        print('{0}: error: {1}'.format(parser.prog, e), file=sys.stderr)
+        sys.exit(1)
+
+    progress_path = args.progress
+
+    if progress_path is None and args.output:
+        progress_path = args.output + '.progress'
+
+    finished = read_progress(progress_path) if progress_path else set()
+    demos = [d for d in find_demos(args.files) if d not in finished]
+
+    output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    progress = open(progress_path, 'a', encoding='utf-8') if progress_path else None
+
+    if not args.quiet and finished:
+        print('{0}: skipping {1} finished demos'.format(parser.prog, len(finished)), file=sys.stderr)
+
+    start_time = time.perf_counter()
+    last_report = start_time
+    count = 0
+    errors = 0
+    total_size = 0
+
+    results = analyze_all(demos, specs, args.jobs, args.max_tasks, args.memory_limit)
+
+    try:
+        for result in results:
+            failed = 'error' in result
+
+            # The result is flushed before the demo is marked as finished, so
+            # a crash can at worst repeat a line but never lose one. Failed
+            # demos are left unmarked so they are retried on the next run.
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+
+            if progress and not failed:
+                progress.write(result['file'] + '\n')
+                progress.flush()
+
+            count += 1
+            errors += failed
+            total_size += result.get('size', 0)
+
+            now = time.perf_counter()
+
+            if not args.quiet and now - last_report >= 5:
+                last_report = now
+                elapsed = now - start_time
+                print('{0}/{1} demos, {2:.1f} demos/s, {3:.2f} MB/s'.format(count, len(demos), count / elapsed, total_size / elapsed / 1e6), file=sys.stderr)
+
+    finally:
+        results.close()
+
+        if output is not sys.stdout:
+            output.close()
+
+        if progress:
+            progress.close()
+
+    if not args.quiet:
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        print('{0} demos, {1} errors in {2:.2f}s, {3:.1f} demos/s, {4:.2f} MB/s'.format(count, errors, elapsed, count / elapsed, total_size / elapsed / 1e6), file=sys.stderr)
+
+    sys.exit(0)
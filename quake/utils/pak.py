@@ -48,6 +48,11 @@ if __name__ == '__main__':
                         action=ResolvePathAction,
                         default=[t.strip('\n') for t in sys.stdin] if not sys.stdin.isatty() else None)
 
+    parser.add_argument('-d', '--dedup',
+                        dest='dedup',
+                        action='store_true',
+                        help='store identical files once')
+
     parser.add_argument('-q',
                         dest='quiet',
                         action='store_true',
@@ -72,11 +77,13 @@ if __name__ == '__main__':
     if not os.path.isfile(args.file):
         filemode = 'w'
 
-    with pak.PakFile(args.file, filemode) as pak_file:
+    with pak.PakFile(args.file, filemode, dedup=args.dedup) as pak_file:
         if not args.quiet:
             print('Archive: %s' % os.path.basename(args.file))
 
-        # Process input files
+        # Collect input files
+        tree = {}
+
         for file in args.list:
             # Walk directories
             if os.path.isdir(file):
@@ -84,18 +91,18 @@ if __name__ == '__main__':
                     for name in [f for f in files if not f.startswith('.')]:
                         fullpath = os.path.join(root, name)
                         relpath = os.path.relpath(fullpath, os.getcwd())
-
-                        if not args.quiet:
-                            print('  adding: %s' % relpath)
-
-                        pak_file.write(relpath)
+                        tree[relpath.replace(os.sep, '/')] = relpath
 
             else:
                 relpath = os.path.relpath(file, os.getcwd())
+                tree[relpath.replace(os.sep, '/')] = relpath
 
-                if not args.quiet:
-                    print('  adding: %s' % relpath)
+        # Write all files in one pass
+        for info in pak_file.build(tree):
+            if not args.quiet:
+                print('  adding: %s' % info.filename)
 
-                pak_file.write(relpath)
+        if args.dedup and not args.quiet:
+            print('Deduplicated %i file(s), saved %i bytes' % (pak_file.duplicate_count, pak_file.duplicate_size))
 
     sys.exit(0)
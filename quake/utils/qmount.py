@@ -4,6 +4,10 @@ Supported Games:
     - QUAKE
 
 Notes:
+    Changed files are synced to the pak file every few seconds while it is
+    mounted. Only the changed members are appended to the pak file, which
+    is compacted once enough space is left unused by replaced members.
+
     Watchdog will raise an uncatchable exception if it attempts to walk a
     directory that it does not have read permissions to.
 
@@ -17,12 +21,14 @@ Notes:
 __version__ = '1.0.0'
 
 import argparse
+import hashlib
 import os
 import shutil
 import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 from watchdog.observers import Observer
@@ -38,56 +44,237 @@ def handleSIGINT(signum, frame):
 signal.signal(signal.SIGINT, handleSIGINT)
 
 
-class TempPakFileHandler(Handler):
-    """A Watchdog handler that maintains a list of files to be written out to 
-    the target pak file.
+class ManifestEntry(object):
+    """What is known about a member of the pak file and the file it was
+    extracted to.
+
+    Attributes:
+        offset: The offset of the member in the pak file.
+
+        size: The size of the member in bytes.
+
+        mtime: The modification time in nanoseconds of the file on the volume
+            when it was last synced.
+
+        hash: The SHA-1 digest of the member, or None if it has not been
+            needed yet.
     """
 
-    def __init__(self, context, working_directory, **kwargs):
-        super().__init__(**kwargs)
-        self.context = context
+    __slots__ = (
+        'offset',
+        'size',
+        'mtime',
+        'hash'
+    )
+
+    def __init__(self, offset, size, mtime, hash=None):
+        self.offset = offset
+        self.size = size
+        self.mtime = mtime
+        self.hash = hash
+
+
+class PakSync(object):
+    """Keeps a pak file up to date with a working directory.
+
+    Only a manifest of the members is kept in memory. Changed files are
+    recorded by name and read from disk when sync() is called. Changed
+    members are appended to the pak file in place, removed members are
+    dropped from its directory, and the pak file is compacted once the
+    unused space left behind grows past compact_ratio of the file. The pak
+    file stays readable if a sync is interrupted: appended members and the
+    new directory go past the end of the previous directory and the header
+    is written last, and a compacted copy is written to a temporary file
+    that replaces the pak file once complete.
+    """
+
+    def __init__(self, pak_path, working_directory, compact_ratio=0.25):
+        self.pak_path = pak_path
         self.working_directory = working_directory
+        self.compact_ratio = compact_ratio
+        self.manifest = {}
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
 
-    def on_modified(self, event):
-        self.context['dirty'] = True
+    def extract(self):
+        """Extracts the pak file to the working directory and builds the
+        manifest, creating an empty pak file if there is none."""
 
-        if args.verbose:
-            print('{0} modified'.format(os.path.relpath(event.src_path, self.working_directory)))
+        if not os.path.exists(self.pak_path):
+            with pak.PakFile(self.pak_path, 'w'):
+                pass
 
-        rel_path = os.path.relpath(event.src_path, self.working_directory)
-        with open(event.src_path, 'rb') as file:
-            files[rel_path] = file.read()
+        with pak.PakFile(self.pak_path) as pak_file:
+            pak_file.extractall(self.working_directory)
 
-    def on_created(self, event):
-        self.context['dirty'] = True
+            for info in pak_file.infolist():
+                mtime = os.stat(self.local_path(info.filename)).st_mtime_ns
+                self.manifest[info.filename] = ManifestEntry(info.file_offset, info.file_size, mtime)
 
-        if args.verbose:
-            print('{0} created'.format(os.path.relpath(event.src_path, self.working_directory)))
+    def local_path(self, name):
+        return os.path.join(self.working_directory, *name.split('/'))
 
-        rel_path = os.path.relpath(event.src_path, self.working_directory)
+    def mark(self, path):
+        """Records that the file at path on the volume has changed."""
 
-        with open(event.src_path, 'rb') as file:
-            files[rel_path] = file.read()
+        name = os.path.relpath(path, self.working_directory).replace(os.sep, '/')
 
-    def on_deleted(self, event):
-        self.context['dirty'] = True
+        with self._pending_lock:
+            self._pending.add(name)
 
-        if args.verbose:
-            print('{0} deleted'.format(os.path.relpath(event.src_path, self.working_directory)))
+    @staticmethod
+    def _hash(file):
+        digest = hashlib.sha1()
 
-        rel_path = os.path.relpath(event.src_path, self.working_directory)
-        files.pop(rel_path, None)
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
 
-    def on_moved(self, event):
-        self.context['dirty'] = True
+        return digest.digest()
 
-        if args.verbose:
-            print('{0} moved'.format(os.path.relpath(event.src_path, self.working_directory)))
+    def _unchanged(self, pak_file, name, entry, st):
+        """Returns True if the file for name on the volume has the same bytes
+        as its member even though its modification time changed."""
+
+        if entry.size != st.st_size:
+            return False
+
+        if entry.hash is None:
+            with pak_file.open(name) as member:
+                entry.hash = self._hash(member)
+
+        with open(self.local_path(name), 'rb') as file:
+            return self._hash(file) == entry.hash
+
+    def sync(self):
+        """Writes the files that changed since the last sync to the pak file.
+
+        Returns:
+            The names of the members that were written or removed.
+        """
+
+        # An ejected volume would look like every file was deleted
+        if not os.path.isdir(self.working_directory):
+            return []
+
+        with self._sync_lock:
+            with self._pending_lock:
+                pending = sorted(self._pending)
+                self._pending.clear()
+
+            if not pending:
+                return []
+
+            try:
+                return self._sync(pending)
+
+            except BaseException:
+                # Try every file again on the next sync, the ones already
+                # written are skipped by their modification time
+                with self._pending_lock:
+                    self._pending.update(pending)
+
+                raise
+
+    def _sync(self, pending):
+        changed = []
+        failed = []
+
+        with pak.PakFile(self.pak_path, 'a') as pak_file:
+            for name in pending:
+                entry = self.manifest.get(name)
+
+                try:
+                    st = os.stat(self.local_path(name))
+
+                except FileNotFoundError:
+                    if entry is not None:
+                        pak_file.remove(name)
+                        del self.manifest[name]
+                        changed.append(name)
+
+                    continue
+
+                if entry is not None and entry.mtime == st.st_mtime_ns:
+                    continue
+
+                try:
+                    if entry is not None and self._unchanged(pak_file, name, entry, st):
+                        entry.mtime = st.st_mtime_ns
+                        continue
+
+                    # Stream the file into the pak file, hashing it on the
+                    # way so it does not need to be read again. If reading
+                    # fails partway the member is discarded and the
+                    # previous copy is kept.
+                    digest = hashlib.sha1()
+                    info = pak.PakInfo(name, file_size=st.st_size)
+
+                    with open(self.local_path(name), 'rb') as file:
+                        with pak_file.open(info, 'w') as member:
+                            for chunk in iter(lambda: file.read(1 << 20), b''):
+                                digest.update(chunk)
+                                member.write(chunk)
+
+                except OSError:
+                    # The file may still be open in an editor, try again
+                    # on the next sync
+                    failed.append(name)
+                    continue
 
-        rel_src_path = os.path.relpath(event.src_path, self.working_directory)
-        rel_dest_path = os.path.relpath(event.dest_path, self.working_directory)
+                self.manifest[name] = ManifestEntry(info.file_offset, info.file_size, st.st_mtime_ns, digest.digest())
+                changed.append(name)
 
-        files[rel_dest_path] = files.pop(rel_src_path, None)
+            compact = pak_file.unused_size() > self.compact_ratio * os.path.getsize(self.pak_path)
+
+        if compact:
+            self.compact()
+
+        if failed:
+            with self._pending_lock:
+                self._pending.update(failed)
+
+        return changed
+
+
+    def compact(self):
+        """Rewrites the pak file without unused space.
+
+        Compacting in place moves members over each other, so the copy is
+        written to a temporary file next to the pak file and replaces it
+        once complete.
+        """
+
+        handle, temp_path = tempfile.mkstemp(suffix='.pak', dir=os.path.dirname(os.path.abspath(self.pak_path)))
+        os.close(handle)
+
+        try:
+            infos = pak.repack(self.pak_path, temp_path)
+            os.replace(temp_path, self.pak_path)
+
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        for info in infos:
+            self.manifest[info.filename].offset = info.file_offset
+
+
+class SyncHandler(Handler):
+    """A Watchdog handler that records changed files for the next sync."""
+
+    def __init__(self, pak_sync, **kwargs):
+        super().__init__(**kwargs)
+        self.pak_sync = pak_sync
+
+    def on_any_event(self, event):
+        self.pak_sync.mark(event.src_path)
+
+        if args.verbose:
+            print('{0} {1}'.format(os.path.relpath(event.src_path, self.pak_sync.working_directory), event.event_type))
+
+    def on_moved(self, event):
+        self.pak_sync.mark(event.dest_path)
 
 
 class PlatformHelper(object):
@@ -229,6 +416,18 @@ if __name__ == '__main__':
                         action='store_true',
                         help='opens a file browser once mounted')
 
+    parser.add_argument('-i', '--interval',
+                        dest='interval',
+                        type=float,
+                        default=5,
+                        help='seconds between syncs to the pak file')
+
+    parser.add_argument('--compact-ratio',
+                        dest='compact_ratio',
+                        type=float,
+                        default=0.25,
+                        help='compact the pak file once this fraction of it is unused')
+
     parser.add_argument('--verbose',
                         dest='verbose',
                         action='store_true',
@@ -246,31 +445,11 @@ if __name__ == '__main__':
     if not os.path.exists(dir):
         os.makedirs(dir)
 
-    context = {'dirty': False}
-    files = {}
-
-    # If the pak file exists put the contents into the file dictionary
-    if os.path.exists(args.file):
-        with pak.PakFile(args.file) as pak_file:
-            for info in pak_file.infolist():
-                name = info.filename
-                files[name] = pak_file.read(name)
-
-    else:
-        context['dirty'] = True
-
     temp_directory = PlatformHelper.temp_volume()
 
-    # Copy pak file contents into the temporary directory
-    for filename in files:
-        abs_path = os.path.join(temp_directory, filename)
-        dir = os.path.dirname(abs_path)
-
-        if not os.path.exists(dir):
-            os.makedirs(dir)
-
-        with open(abs_path, 'wb') as out_file:
-            out_file.write(files[filename])
+    # Extract the pak file contents into the temporary directory
+    pak_sync = PakSync(args.file, temp_directory, args.compact_ratio)
+    pak_sync.extract()
 
     # Open a native file browser
     if args.open_file_browser:
@@ -278,12 +457,33 @@ if __name__ == '__main__':
 
     # Start file watching
     observer = Observer()
-    handler = TempPakFileHandler(context, temp_directory, ignore_patterns=['*/.DS_Store', '*/Thumbs.db'], ignore_directories=True)
+    handler = SyncHandler(pak_sync, ignore_patterns=['*/.DS_Store', '*/Thumbs.db'], ignore_directories=True)
     observer.schedule(handler, path=temp_directory, recursive=True)
 
-    print('Press Ctrl+C to save and quit')
+    def sync():
+        changed = pak_sync.sync()
+
+        if changed:
+            print('Synced {0} change(s) to {1}'.format(len(changed), os.path.basename(args.file)))
+
+    # Sync changes in the background
+    stop = threading.Event()
+
+    def sync_periodically():
+        while not stop.wait(args.interval):
+            # Keep syncing after an error, the changes are tried again
+            try:
+                sync()
+
+            except Exception as e:
+                print('Failed to sync {0}: {1!r}'.format(os.path.basename(args.file), e), file=sys.stderr)
+
+    sync_thread = threading.Thread(target=sync_periodically, daemon=True)
+
+    print('Changes are synced every {0} seconds. Press Ctrl+C to quit'.format(args.interval))
 
     observer.start()
+    sync_thread.start()
 
     # Wait for user to terminate
     try:
@@ -304,17 +504,12 @@ if __name__ == '__main__':
             if the watched media is ejected."""
 
     observer.join()
+    stop.set()
+    sync_thread.join()
 
-    # Write out updated files
-    if context['dirty']:
-        print('Updating changes to {0}'.format(os.path.basename(args.file)))
-
-        with pak.PakFile(args.file, 'w') as pak_file:
-            for filename in files:
-                pak_file.writestr(filename, files[filename])
-
-    else:
-        print('No changes detected to {0}'.format(os.path.basename(args.file)))
+    # Sync anything changed since the last sync
+    if os.path.exists(temp_directory):
+        sync()
 
     # Clean up temp directory
     PlatformHelper.unmount_temp_volume(temp_directory)
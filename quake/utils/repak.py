@@ -0,0 +1,152 @@
+"""Command line utility for reordering PAK files by access pattern
+
+Supported Games:
+    - QUAKE
+
+Notes:
+    A trace is a text file with one member name per line, in the order the
+    members are first read. It can be written by any tool, or recorded by
+    running a Python program with the --record option, which installs a
+    pak.AccessTrace while the program runs.
+"""
+
+__version__ = '1.0.0'
+
+import argparse
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+
+from quake import pak
+
+
+class ResolvePathAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        fullpath = os.path.expanduser(values)
+        setattr(namespace, self.dest, fullpath)
+
+
+class Parser(argparse.ArgumentParser):
+    """Simple wrapper class to provide help on error"""
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(1)
+
+
+def record(script, arguments, archive):
+    """Runs a Python script with an access trace installed and returns the
+    names of the members of archive it read."""
+
+    argv = sys.argv
+    sys.argv = [script] + arguments
+
+    try:
+        with pak.AccessTrace() as trace:
+            runpy.run_path(script, run_name='__main__')
+
+    except SystemExit:
+        pass
+
+    finally:
+        sys.argv = argv
+
+    return trace.names(archive)
+
+
+if __name__ == '__main__':
+    parser = Parser(prog='repak',
+                    description='Default action is to rewrite the pak file with the members '
+                                'in trace first, in the order they were read.',
+                    epilog='example: repak PAK0.PAK startup.trace => reorders PAK0.PAK by startup.trace')
+
+    parser.add_argument('file',
+                        metavar='file.pak',
+                        action=ResolvePathAction)
+
+    parser.add_argument('trace',
+                        metavar='file.trace',
+                        action=ResolvePathAction,
+                        help='member names in the order they are read')
+
+    parser.add_argument('-o', '--output',
+                        dest='output',
+                        default=None,
+                        action=ResolvePathAction,
+                        help='pak file to write, defaults to rewriting file.pak')
+
+    parser.add_argument('-n', '--dry-run',
+                        dest='dry_run',
+                        action='store_true',
+                        help='only report the estimated seeks')
+
+    parser.add_argument('-q',
+                        dest='quiet',
+                        action='store_true',
+                        help='quiet mode')
+
+    parser.add_argument('-r', '--record',
+                        dest='record',
+                        nargs=argparse.REMAINDER,
+                        metavar='SCRIPT',
+                        help='run a Python script and save the members it reads to file.trace first')
+
+    parser.add_argument('-v', '--version',
+                        dest='version',
+                        action='version',
+                        help=argparse.SUPPRESS,
+                        version='{} version {}'.format(parser.prog, __version__))
+
+    args = parser.parse_args()
+
+    if not pak.is_pakfile(args.file):
+        print('{0}: cannot find or open {1}'.format(parser.prog, args.file), file=sys.stderr)
+        sys.exit(1)
+
+    if args.record:
+        names = record(args.record[0], args.record[1:], args.file)
+
+        with open(args.trace, 'w') as file:
+            file.write(''.join('%s\n' % name for name in names))
+
+        if not args.quiet:
+            print('Recorded {0} member(s) to {1}'.format(len(names), args.trace))
+
+    with open(args.trace) as file:
+        names = [line.rstrip('\r\n') for line in file if line.strip()]
+
+    with pak.PakFile(args.file) as pak_file:
+        before = pak.count_seeks(pak_file.NameToInfo, names)
+
+    if not args.dry_run:
+        output = args.output or args.file
+        directory = os.path.dirname(output) or '.'
+
+        # Write beside the output so it can be swapped in at once
+        handle, temp_path = tempfile.mkstemp(suffix='.pak', dir=directory)
+        os.close(handle)
+
+        try:
+            shutil.copymode(args.file, temp_path)
+            infos = pak.repack(args.file, temp_path, names)
+            os.replace(temp_path, output)
+
+        except:
+            os.remove(temp_path)
+            raise
+
+        after = pak.count_seeks({i.filename: i for i in infos}, names)
+
+    if not args.quiet:
+        print('Archive: %s' % os.path.basename(args.file))
+        print('  seeks before: %i (%i bytes)' % before)
+
+        if not args.dry_run:
+            print('  seeks after:  %i (%i bytes)' % after)
+
+            if before[0]:
+                print('  reduction:    %.1f%%' % (100 * (before[0] - after[0]) / before[0]))
+
+    sys.exit(0)
@@ -48,6 +48,12 @@ if __name__ == '__main__':
                         action=ResolvePathAction,
                         help='extract files into xdir')
 
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        default=None,
+                        help='number of files to extract at once. default: number of CPUs')
+
     parser.add_argument('-q',
                         dest='quiet',
                         action='store_true',
@@ -88,17 +94,13 @@ if __name__ == '__main__':
             sys.exit(0)
 
     with pak.PakFile(args.file) as pak_file:
-        info_list = pak_file.infolist()
-        for item in sorted(info_list, key=lambda i: i.filename):
-            filename = item.filename
-            fullpath = os.path.join(args.dest, filename)
-
-            if not args.quiet:
-                print(' extracting: %s' % fullpath)
-
-            try:
-                pak_file.extract(filename, args.dest)
-            except:
-                print('{0}: error: {1}'.format(parser.prog, sys.exc_info()[0]), file=sys.stderr)
+        info_list = sorted(pak_file.infolist(), key=lambda i: i.filename)
+
+        for item, error in pak_file.iter_extract(args.dest, info_list, workers=args.jobs):
+            if error is not None:
+                print('{0}: error: {1}'.format(parser.prog, error), file=sys.stderr)
+
+            elif not args.quiet:
+                print(' extracting: %s' % os.path.join(args.dest, item.filename))
 
     sys.exit(0)
@@ -51,6 +51,12 @@ if __name__ == '__main__':
                         action=ResolvePathAction,
                         help='extract files into xdir')
 
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        default=None,
+                        help='number of files to extract at once. default: number of CPUs')
+
     parser.add_argument('-q',
                         dest='quiet',
                         action='store_true',
@@ -124,6 +130,9 @@ if __name__ == '__main__':
         for p in lmp.default_palette:
             palette += p
 
+        # Lumps that are not converted are extracted together at the end
+        raw_items = []
+
         for item in wad_file.infolist():
             filename = item.filename
             fullpath = os.path.join(args.dest, filename)
@@ -172,11 +181,15 @@ if __name__ == '__main__':
 
                 # Extract as raw file
                 else:
-                    wad_file.extract(filename, args.dest)
-
-                    if not args.quiet:
-                        print(' extracting: %s' % fullpath)
+                    raw_items.append(item)
             except:
                 print('{0}: error: {1}'.format(parser.prog, sys.exc_info()[1]), file=sys.stderr)
 
+        for item, error in wad_file.iter_extract(args.dest, raw_items, workers=args.jobs):
+            if error is not None:
+                print('{0}: error: {1}'.format(parser.prog, error), file=sys.stderr)
+
+            elif not args.quiet:
+                print(' extracting: %s' % os.path.join(args.dest, item.filename))
+
     sys.exit(0)
@@ -57,6 +57,11 @@ if __name__ == '__main__':
                         default='MIPTEX',
                         choices=['LUMP', 'QPIC', 'MIPTEX'])
 
+    parser.add_argument('-d', '--dedup',
+                        dest='dedup',
+                        action='store_true',
+                        help='store identical files once')
+
     parser.add_argument('-q',
                         dest='quiet',
                         action='store_true',
@@ -81,7 +86,7 @@ if __name__ == '__main__':
     if not os.path.isfile(args.file):
         filemode = 'w'
 
-    with wad.WadFile(args.file, filemode) as wad_file:
+    with wad.WadFile(args.file, filemode, dedup=args.dedup) as wad_file:
         if not args.quiet:
             print('Archive: %s' % os.path.basename(args.file))
 
@@ -169,4 +174,7 @@ if __name__ == '__main__':
                 except:
                     print('{0}: error: {1}'.format(parser.prog, sys.exc_info()[1]), file=sys.stderr)
 
+        if args.dedup and not args.quiet:
+            print('Deduplicated %i file(s), saved %i bytes' % (wad_file.duplicate_count, wad_file.duplicate_size))
+
     sys.exit(0)